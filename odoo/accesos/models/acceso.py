@@ -1,6 +1,6 @@
 # accesos/models/acceso.py
 # -*- coding: utf-8 -*-
-from odoo import models, api, _, fields
+from odoo import models, api, _, fields, tools
 from odoo.exceptions import ValidationError
 from functools import wraps
 import logging
@@ -50,12 +50,15 @@ class Acceso(models.Model):
     def create(self, vals_list):
         recs = super().create(vals_list)
         recs._post_change_sync()
+        self.env['permisos.perm.version']._perm_bump()  # matriz de permisos (res.users._perm_matrix)
         return recs
 
     def write(self, vals):
         res = super().write(vals)
         if {'usuario_id', 'modulo_id', 'active'} & set(vals.keys()):
             self._post_change_sync()
+        if {'usuario_id', 'modulo_id', 'active', 'is_admin'} & set(vals.keys()):
+            self.env['permisos.perm.version']._perm_bump()
         return res
 
     def unlink(self):
@@ -63,6 +66,7 @@ class Acceso(models.Model):
         res = super().unlink()
         if mods:
             self._sync_group_for_modules(mods)
+        self.env['permisos.perm.version']._perm_bump()
         return res
     
     # Helpers
@@ -193,90 +197,196 @@ class ResUsersPerms(models.Model):
     @api.model
     def _perm__resolve_ctx(self, modulo_code, empresa_id=None, sucursal_id=None, bodega_id=None):
         """Resuelve IDs usando: args explícitos -> contexto por módulo -> vacío."""
-        Mod = self.env['permisos.modulo'].sudo()
-        Ctx = self.env['permisos.user.context'].sudo()
-        modulo = Mod.search([('code','=', modulo_code)], limit=1)
         emp_id = getattr(empresa_id,'id',empresa_id) or False
         suc_id = getattr(sucursal_id,'id',sucursal_id) or False
         bod_id = getattr(bodega_id,'id',bodega_id) or False
-        if modulo and not (emp_id and (suc_id or True)):
-            ctx = Ctx.search([('usuario_id','=', self.env.user.id), ('modulo_id','=', modulo.id)], limit=1)
-            if ctx:
-                emp_id = emp_id or (ctx.empresa_id.id or False)
-                suc_id = suc_id or (ctx.sucursal_id.id or False)
-                bod_id = bod_id or (ctx.bodega_id.id or False)
+        if not emp_id:
+            # contexto guardado cacheado (permisos: _perm_user_ctx_ids)
+            c_emp, c_suc, c_bod = self._perm_user_ctx_ids(self.env.user.id, modulo_code)
+            emp_id = c_emp
+            suc_id = suc_id or c_suc
+            bod_id = bod_id or c_bod
         return emp_id, suc_id, bod_id
 
     # --- GATE por accesos: ¿el usuario tiene acceso al módulo? (independiente de empresa)
     def _perm__has_gate(self, modulo_code, empresa_id=None):
-        Acc = self.env['accesos.acceso'].sudo()
-        Mod = self.env['permisos.modulo'].sudo()
-        modulo = Mod.search([('code','=', modulo_code)], limit=1)
-        if not modulo:
-            return False
-        return bool(Acc.search([('usuario_id','=', self.id),
-                                ('modulo_id','=', modulo.id),
-                                ('active','=', True)], limit=1))
+        return self._perm_matrix(self.id, modulo_code or '', False, False, False)[0]
 
     # --- Admin por gate (independiente de empresa)
     def _perm__is_admin_gate(self, modulo_code, empresa_id=None):
-        Acc = self.env['accesos.acceso'].sudo()
-        Mod = self.env['permisos.modulo'].sudo()
-        modulo = Mod.search([('code','=', modulo_code)], limit=1)
-        if not modulo:
-            return False
-        a = Acc.search([('usuario_id','=', self.id),
-                        ('modulo_id','=', modulo.id),
-                        ('active','=', True)], limit=1)
-        return bool(a and a.is_admin)
+        return self._perm_matrix(self.id, modulo_code or '', False, False, False)[1]
+
+    # --- Matriz compilada de permisos de un usuario en un módulo y contexto.
+    # Regresa (gate, admin, frozenset(códigos permitidos)) con las mismas reglas que tenía
+    # has_perm: gate por accesos.acceso activo; admin concede todo; por permiso, rangos
+    # aplicables al contexto según su scope y overrides (deny gana sobre allow). Un id de
+    # contexto vacío no filtra esa dimensión.
+    # Se calcula una vez por llave, worker y versión de permisos (ormcache) con _perm__compile;
+    # create/write/unlink de accesos, permisos, rangos, asignaciones y módulos suben la versión
+    # (permisos.perm.version._perm_bump).
+    @api.model
+    @tools.ormcache('user_id', 'modulo_code', 'emp_id', 'suc_id', 'bod_id',
+                    'self.env["permisos.perm.version"]._perm_version()')
+    def _perm_matrix(self, user_id, modulo_code, emp_id, suc_id, bod_id):
+        key = (user_id, modulo_code)
+        return self._perm__compile({key: (emp_id, suc_id, bod_id)})[key]
+
+    # Compila la matriz para varias llaves {(user_id, modulo_code): (emp_id, suc_id, bod_id)}
+    # con un número fijo de consultas (módulos, accesos, permisos, asignaciones de rango y
+    # overrides), sin importar cuántos usuarios o módulos se pidan.
+    # Regresa {(user_id, modulo_code): (gate, admin, frozenset(códigos))}; para admin el
+    # conjunto trae todos los permisos activos del módulo.
+    @api.model
+    def _perm__compile(self, keys):
+        none = (False, False, frozenset())
+        out = dict.fromkeys(keys, none)
+        user_ids = sorted({u for u, _m in keys})
+        codes = sorted({m for _u, m in keys if m})
+        if not (user_ids and codes):
+            return out
+        mods = self.env['permisos.modulo'].sudo().search([('code', 'in', codes)])
+        mod_by_code = {m.code: m.id for m in mods}
+        accs = self.env['accesos.acceso'].sudo().search([('usuario_id', 'in', user_ids),
+                                                         ('modulo_id', 'in', mods.ids),
+                                                         ('active', '=', True)])
+        acc_admin = {}
+        for acc in accs:
+            acc_admin.setdefault((acc.usuario_id.id, acc.modulo_id.id), acc.is_admin)
+        perms = self.env['permisos.permiso'].sudo().search([('active', '=', True),
+                                                            ('modulo_id', 'in', mods.ids)])
+        perms_by_mod = {}
+        for p in perms:
+            perms_by_mod.setdefault(p.modulo_id.id, []).append(p)
+        asigs = self.env['permisos.asignacion.rango'].sudo().search([('usuario_id', 'in', user_ids),
+                                                                     ('active', '=', True)])
+        ovs = self.env['permisos.asignacion.permiso'].sudo().search([('usuario_id', 'in', user_ids),
+                                                                     ('permiso_id', 'in', perms.ids),
+                                                                     ('active', '=', True)])
+        rangos_by_user = {}
+        for a in asigs:
+            rangos_by_user.setdefault(a.usuario_id.id, []).append((a, set(a.rango_id.permiso_ids.ids)))
+        ovs_by_user_perm = {}
+        for o in ovs:
+            ovs_by_user_perm.setdefault((o.usuario_id.id, o.permiso_id.id), []).append(o)
+
+        for (user_id, modulo_code), ctx_ids in keys.items():
+            mod_id = mod_by_code.get(modulo_code)
+            if not mod_id or (user_id, mod_id) not in acc_admin:
+                continue
+            mod_perms = perms_by_mod.get(mod_id, [])
+            if acc_admin[(user_id, mod_id)]:
+                out[(user_id, modulo_code)] = (True, True, frozenset(p.code for p in mod_perms))
+                continue
+            rangos = rangos_by_user.get(user_id, [])
+            allowed = set()
+            for p in mod_perms:
+                has = any(p.id in pids and self._perm__applies(a, p.scope, ctx_ids) for a, pids in rangos)
+                applied = [o for o in ovs_by_user_perm.get((user_id, p.id), ())
+                           if self._perm__applies(o, p.scope, ctx_ids)]
+                if any(not o.allow for o in applied):
+                    has = False
+                elif applied:
+                    has = True
+                if has:
+                    allowed.add(p.code)
+            out[(user_id, modulo_code)] = (True, False, frozenset(allowed))
+        return out
+
+    # ¿La asignación/override `rec` aplica al contexto para un permiso con `scope`?
+    @staticmethod
+    def _perm__applies(rec, scope, ctx_ids):
+        emp_id, suc_id, bod_id = ctx_ids
+        if scope in ('empresa', 'empresa_sucursal', 'empresa_sucursal_bodega') and emp_id:
+            if rec.empresa_id and rec.empresa_id.id != emp_id:
+                return False
+        if scope in ('empresa_sucursal', 'empresa_sucursal_bodega') and suc_id:
+            if rec.sucursal_id and rec.sucursal_id.id != suc_id:
+                return False
+        if scope == 'empresa_sucursal_bodega' and bod_id:
+            if rec.bodega_id and rec.bodega_id.id != bod_id:
+                return False
+        return True
 
-    # --- Permisos atómicos (tu lógica, ajustada al gate y sin empresa_actual)
+    # --- Permisos atómicos: consulta a la matriz compilada
     def has_perm(self, modulo_code, permiso_code, empresa_id=None, sucursal_id=None, bodega_id=None):
         self.ensure_one()
         emp_id, suc_id, bod_id = self._perm__resolve_ctx(modulo_code, empresa_id, sucursal_id, bodega_id)
-        # Gate de visibilidad (si no hay gate al módulo, no hay permiso)
-        if not self._perm__has_gate(modulo_code, emp_id):
-            return False
-        # Admin por gate
-        if self._perm__is_admin_gate(modulo_code, emp_id):
-            return True
-
-        Permiso  = self.env['permisos.permiso'].sudo()
-        AsigR    = self.env['permisos.asignacion.rango'].sudo()
-        AsigP    = self.env['permisos.asignacion.permiso'].sudo()
-        target   = Permiso.search([('active','=',True),
-                                   ('code','=', permiso_code),
-                                   ('modulo_id.code','=', modulo_code)], limit=1)
-        if not target:
+        gate, admin, codes = self._perm_matrix(self.id, modulo_code or '', emp_id or False,
+                                               suc_id or False, bod_id or False)
+        # Gate de visibilidad (si no hay gate al módulo, no hay permiso); admin por gate
+        if not gate:
             return False
-        scope = target.scope
-
-        # Rangos aplicables
-        dom = [('usuario_id','=', self.id), ('active','=', True)]
-        if scope in ('empresa','empresa_sucursal','empresa_sucursal_bodega') and emp_id:
-            dom += ['|', ('empresa_id','=', False), ('empresa_id','=', emp_id)]
-        if scope in ('empresa_sucursal','empresa_sucursal_bodega') and suc_id:
-            dom += ['|', ('sucursal_id','=', False), ('sucursal_id','=', suc_id)]
-        if scope == 'empresa_sucursal_bodega' and bod_id:
-            dom += ['|', ('bodega_id','=', False), ('bodega_id','=', bod_id)]
-        r_asigs = AsigR.search(dom)
-        perms   = r_asigs.mapped('rango_id.permiso_ids').filtered(lambda p: p.active)
-        has     = target in perms
-
-        # Overrides
-        dom_o = [('usuario_id','=', self.id), ('permiso_id','=', target.id), ('active','=', True)]
-        if scope in ('empresa','empresa_sucursal','empresa_sucursal_bodega') and emp_id:
-            dom_o += ['|', ('empresa_id','=', False), ('empresa_id','=', emp_id)]
-        if scope in ('empresa_sucursal','empresa_sucursal_bodega') and suc_id:
-            dom_o += ['|', ('sucursal_id','=', False), ('sucursal_id','=', suc_id)]
-        if scope == 'empresa_sucursal_bodega' and bod_id:
-            dom_o += ['|', ('bodega_id','=', False), ('bodega_id','=', bod_id)]
-        ovs = self.env['permisos.asignacion.permiso'].sudo().search(dom_o)
-        if any(not o.allow for o in ovs):
-            has = False
-        elif any(o.allow for o in ovs):
-            has = True
-        return bool(has)
+        return admin or permiso_code in codes
+
+    # --- Varios permisos de un módulo en una sola resolución: {código: bool}
+    def has_perms(self, modulo_code, permiso_codes, empresa_id=None, sucursal_id=None, bodega_id=None):
+        self.ensure_one()
+        emp_id, suc_id, bod_id = self._perm__resolve_ctx(modulo_code, empresa_id, sucursal_id, bodega_id)
+        gate, admin, codes = self._perm_matrix(self.id, modulo_code or '', emp_id or False,
+                                               suc_id or False, bod_id or False)
+        return {c: bool(gate and (admin or c in codes)) for c in permiso_codes}
+
+    # --- Permisos efectivos de varios usuarios en varios módulos (listas, reportes, wizards).
+    # Sin empresa explícita, el contexto de cada usuario sale de permisos.user.context (una
+    # consulta para todos). Regresa {user_id: {modulo_code: frozenset(códigos permitidos)}};
+    # admin trae todos los permisos activos del módulo y sin gate el conjunto va vacío.
+    # modulo_codes=None evalúa todos los módulos activos.
+    def effective_permissions(self, modulo_codes=None, empresa_id=None, sucursal_id=None, bodega_id=None):
+        Mod = self.env['permisos.modulo'].sudo()
+        if modulo_codes is None:
+            modulo_codes = Mod.search([('active', '=', True)]).mapped('code')
+        modulo_codes = [c for c in modulo_codes if c]
+        emp_id = getattr(empresa_id, 'id', empresa_id) or False
+        suc_id = getattr(sucursal_id, 'id', sucursal_id) or False
+        bod_id = getattr(bodega_id, 'id', bodega_id) or False
+        saved = {}
+        if not emp_id and self and modulo_codes:
+            for c in self.env['permisos.user.context'].sudo().search([
+                    ('usuario_id', 'in', self.ids), ('modulo_id.code', 'in', modulo_codes)]):
+                saved[(c.usuario_id.id, c.modulo_id.code)] = (
+                    c.empresa_id.id or False, c.sucursal_id.id or False, c.bodega_id.id or False)
+        keys = {}
+        for uid in self.ids:
+            for code in modulo_codes:
+                s_emp, s_suc, s_bod = saved.get((uid, code), (False, False, False))
+                keys[(uid, code)] = (emp_id or s_emp, suc_id or s_suc, bod_id or s_bod)
+        matrix = self._perm__compile(keys)
+        return {uid: {code: matrix[(uid, code)][2] for code in modulo_codes} for uid in self.ids}
+
+    # Benchmark para `odoo shell`: has_perm secuencial (caché fría y caliente) contra
+    # effective_permissions para los usuarios de `self` y los módulos indicados.
+    #     env['res.users'].search([('share', '=', False)])._bench_perms()
+    # Regresa y loguea segundos y queries de cada variante y el número de checks.
+    def _bench_perms(self, modulo_codes=None):
+        import time
+        cr = self.env.cr
+        Perm = self.env['permisos.permiso'].sudo()
+        dom = [('active', '=', True)] + ([('modulo_id.code', 'in', modulo_codes)] if modulo_codes else [])
+        pairs = [(p.modulo_id.code, p.code) for p in Perm.search(dom)]
+        codes = sorted({m for m, _c in pairs})
+
+        def _run(fn):
+            q0, t0 = cr.sql_log_count, time.monotonic()
+            fn()
+            return round(time.monotonic() - t0, 4), cr.sql_log_count - q0
+
+        def _sequential():
+            for u in self:
+                for m, c in pairs:
+                    u.has_perm(m, c)
+
+        self.env.registry.clear_cache()
+        cold = _run(_sequential)
+        warm = _run(_sequential)
+        bulk = _run(lambda: self.effective_permissions(codes))
+        report = {
+            'users': len(self), 'checks': len(self) * len(pairs),
+            'has_perm_cold_s': cold[0], 'has_perm_cold_queries': cold[1],
+            'has_perm_warm_s': warm[0], 'has_perm_warm_queries': warm[1],
+            'effective_s': bulk[0], 'effective_queries': bulk[1],
+        }
+        _logger.info("PERMS BENCH | %s", report)
+        return report
 
     def check_perm(self, modulo_code, permiso_code, **ctx):
         ok = self.has_perm(modulo_code, permiso_code, **ctx)
@@ -314,17 +424,13 @@ class PermittedModelMixin(models.AbstractModel):
         if not modulo_code:
             return
         user = self.env.user
-        Mod = self.env['permisos.modulo'].sudo().search([('code','=', modulo_code)], limit=1)
-        if not Mod:
-            raise ValidationError(_("Módulo no configurado: %s") % modulo_code)
 
         # Gate: necesita al menos un acceso (independiente de empresa)
         # (si el modelo tiene empresa_field en config, debería tomar el contexto; si no, con que tenga algún acceso ya ve)
         # Para CRUD fuerte, si no hay gate en ninguna empresa no permitimos.
-        any_gate = self.env['accesos.acceso'].sudo().search_count([
-            ('usuario_id','=', user.id), ('modulo_id','=', Mod.id), ('active','=', True)
-        ]) > 0
-        if not any_gate:
+        if not user._perm__has_gate(modulo_code):
+            if not self.env['permisos.modulo'].sudo().search_count([('code','=', modulo_code)], limit=1):
+                raise ValidationError(_("Módulo no configurado: %s") % modulo_code)
             raise ValidationError(_("No tienes acceso al módulo '%s' en ninguna empresa.") % modulo_code)
 
         # Overrides CRUD + base por permisos.modulo.model
@@ -17,7 +17,8 @@
         'views/cargos.xml',
         'data/cron_saldos.xml',
         'views/edocta.xml',
-        'views/entrys.xml'
+        'views/entrys.xml',
+        'views/recalculo.xml',
     ],
     'installable': True,
     'application': True,
@@ -1 +1 @@
-from . import credito, garantia, transientmodel, transientline, cargodetail_ext, entry, predio
+from . import credito, corteinteres, garantia, transientmodel, transientline, cargodetail_ext, entry, predio, venta_ext, recalculo
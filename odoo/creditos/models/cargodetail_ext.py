@@ -32,6 +32,7 @@ class cargodetail_ext(models.Model):
     def _compute_importe(self):
         for record in self:
             record.importe = record.total + (record.total * record.iva) + (record.total * record.ieps)
+            record._invalidar_cortes_interes()
             record.credito_id.recalc_cargos()
 
     @api.depends('importe', 'pagos')
@@ -48,4 +49,34 @@ class cargodetail_ext(models.Model):
             ])
 
             vals['folio'] = 'CA#' + str(10000 + count + 1)[-4:]
-        return super(cargodetail_ext, self).create(vals)
\ No newline at end of file
+        return super(cargodetail_ext, self).create(vals)
+
+    # Campos que mueven el capital del crédito en el cálculo de intereses.
+    _CAMPOS_INTERES = ('fecha', 'importe', 'total', 'costo', 'porcentaje', 'cargo', 'credito_id', 'contrato_id')
+
+    def _creditos_interes(self):
+        """Créditos cuyo interés depende de estos cargos (propios o del contrato)."""
+        creditos = self.mapped('credito_id')
+        contratos = self.mapped('contrato_id')
+        if contratos:
+            creditos |= self.env['creditos.credito'].search([('contrato', 'in', contratos.ids)])
+        return creditos
+
+    def _invalidar_cortes_interes(self, desde=None):
+        for record in self:
+            fecha = desde or record.fecha
+            if desde and record.fecha:
+                fecha = min(desde, record.fecha)
+            record._creditos_interes()._invalidar_cortes_interes(fecha)
+
+    def write(self, vals):
+        if any(f in vals for f in self._CAMPOS_INTERES):
+            self._invalidar_cortes_interes(fields.Date.to_date(vals.get('fecha')))
+        res = super(cargodetail_ext, self).write(vals)
+        if any(f in vals for f in ('credito_id', 'contrato_id')):
+            self._invalidar_cortes_interes()
+        return res
+
+    def unlink(self):
+        self._invalidar_cortes_interes()
+        return super(cargodetail_ext, self).unlink()
\ No newline at end of file
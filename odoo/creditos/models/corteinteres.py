@@ -0,0 +1,78 @@
+# creditos/models/corteinteres.py
+from odoo import models, fields, api
+from ..services import interes_engine
+
+
+class corteinteres(models.Model):
+    _name = 'creditos.corteinteres'
+    _description = 'Corte de intereses acumulados por crédito'
+    _order = 'credito_id, fecha desc'
+
+    credito_id = fields.Many2one('creditos.credito', string="Crédito", required=True, index=True, ondelete='cascade')
+    fecha = fields.Date(string="Fecha de corte", required=True, index=True)
+
+    # Parámetros con los que se calculó; si cambian el corte ya no sirve.
+    desde = fields.Date(string="Primer movimiento", required=True)
+    tasa = fields.Float(string="Tasa", required=True)
+
+    interes = fields.Float(string="Intereses")
+    capital = fields.Float(string="Capital")
+    pagos = fields.Float(string="Pagos")
+
+    _sql_constraints = [
+        ('credito_fecha_uniq', 'unique(credito_id, fecha)', 'Sólo puede haber un corte por crédito y fecha.'),
+    ]
+
+    @api.model
+    def _ultimos_por_credito(self, credito_ids, antes_de):
+        """{credito_id: corte} con el corte más reciente anterior a `antes_de`."""
+        ultimos = {}
+        if not credito_ids:
+            return ultimos
+        for corte in self.sudo().search([('credito_id', 'in', credito_ids), ('fecha', '<', antes_de)]):
+            ultimos.setdefault(corte.credito_id.id, corte)
+        return ultimos
+
+    @api.model
+    def _invalidar(self, credito_ids, desde):
+        """Descarta los cortes desde `desde` en adelante (movimiento retroactivo).
+
+        Sin fecha se descartan todos los cortes de los créditos indicados.
+        """
+        credito_ids = [cid for cid in credito_ids if isinstance(cid, int)]
+        if not credito_ids:
+            return
+        domain = [('credito_id', 'in', credito_ids)]
+        if desde:
+            domain.append(('fecha', '>=', desde))
+        self.sudo().search(domain).unlink()
+
+    @api.model
+    def _invalidar_por_fechas(self, fechas_por_credito):
+        """Aplica `_invalidar` agrupando por fecha: {credito_id: fecha_mas_antigua}."""
+        por_fecha = {}
+        for credito_id, fecha in fechas_por_credito.items():
+            por_fecha.setdefault(fecha, []).append(credito_id)
+        for fecha, credito_ids in por_fecha.items():
+            self._invalidar(credito_ids, fecha)
+
+    @api.model
+    def _registrar(self, credito, desde, tasa, cortes, anterior=None):
+        """Guarda los cortes nuevos de un crédito: {fecha: (interes, capital, pagos)}.
+
+        El corte del que se partió se descarta si no es fin de mes, así por crédito
+        sólo quedan los cierres mensuales y el más reciente.
+        """
+        if not cortes or not isinstance(credito.id, int):
+            return
+        self.sudo().create([{
+            'credito_id': credito.id,
+            'fecha': fecha,
+            'desde': desde,
+            'tasa': tasa,
+            'interes': interes,
+            'capital': capital,
+            'pagos': pagos,
+        } for fecha, (interes, capital, pagos) in sorted(cortes.items())])
+        if anterior and not interes_engine.es_fin_de_mes(anterior.fecha):
+            anterior.sudo().unlink()
@@ -0,0 +1,123 @@
+# creditos/models/recalculo.py
+from odoo import models, fields, api
+import time
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class recalculo(models.Model):
+    _name = 'creditos.recalculo'
+    _description = 'Bitácora del recálculo nocturno de saldos'
+    _order = 'inicio desc, id desc'
+
+    name = fields.Char(string="Ejecución", required=True, default="Recálculo de saldos")
+    inicio = fields.Datetime(string="Inicio", readonly=True)
+    fin = fields.Datetime(string="Fin", readonly=True)
+    worker = fields.Integer(string="Worker", readonly=True)
+    workers = fields.Integer(string="Workers", readonly=True, default=1)
+    lote = fields.Integer(string="Créditos por lote", readonly=True)
+
+    total = fields.Integer(string="Créditos", readonly=True)
+    procesados = fields.Integer(string="Procesados", readonly=True)
+    fallidos = fields.Integer(string="Fallidos", readonly=True)
+    duracion = fields.Float(string="Duración (s)", digits=(12, 3), readonly=True)
+    throughput = fields.Float(string="Créditos/s", digits=(12, 2), compute='_compute_throughput', store=True)
+
+    state = fields.Selection([
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Con errores'),
+    ], string="Estado", default='running', readonly=True)
+
+    line_ids = fields.One2many('creditos.recalculo.line', 'recalculo_id', string="Detalle por crédito", readonly=True)
+
+    @api.depends('procesados', 'duracion')
+    def _compute_throughput(self):
+        for r in self:
+            r.throughput = (r.procesados / r.duracion) if r.duracion else 0.0
+
+    @api.model
+    def _ejecutar(self, credito_ids, lote, worker=0, workers=1):
+        """Recalcula intereses de `credito_ids` en lotes, confirmando la transacción por lote.
+
+        Un crédito que falla se revierte solo (savepoint) y queda registrado en la bitácora;
+        el resto del lote se guarda normalmente.
+        """
+        log = self.create({
+            'name': "Recálculo de saldos %s/%s" % (worker + 1, workers),
+            'inicio': fields.Datetime.now(),
+            'worker': worker,
+            'workers': workers,
+            'lote': lote,
+            'total': len(credito_ids),
+        })
+        self.env.cr.commit()
+
+        Credito = self.env['creditos.credito']
+        inicio = time.perf_counter()
+        procesados = fallidos = 0
+        for i in range(0, len(credito_ids), lote):
+            chunk = Credito.browse(credito_ids[i:i + lote])
+            lineas = log._procesar_lote(chunk)
+            self.env['creditos.recalculo.line'].create(lineas)
+            procesados += sum(1 for l in lineas if l['ok'])
+            fallidos += sum(1 for l in lineas if not l['ok'])
+            log.write({
+                'procesados': procesados,
+                'fallidos': fallidos,
+                'duracion': time.perf_counter() - inicio,
+            })
+            self.env.cr.commit()
+            _logger.info("Recálculo de saldos %s/%s: %s/%s créditos (%s fallidos)",
+                         worker + 1, workers, procesados + fallidos, len(credito_ids), fallidos)
+
+        log.write({
+            'fin': fields.Datetime.now(),
+            'duracion': time.perf_counter() - inicio,
+            'state': 'failed' if fallidos else 'done',
+        })
+        self.env.cr.commit()
+        return log
+
+    def _procesar_lote(self, creditos):
+        """Recalcula un lote con lecturas en bloque; regresa los valores de las líneas de bitácora."""
+        self.ensure_one()
+        hoy = fields.Date.today()
+        try:
+            with self.env.cr.savepoint():
+                creditos._prefetch_interes()
+        except Exception:
+            # Sin precarga cada crédito lee lo suyo; el error se verá en su línea.
+            _logger.exception("No se pudo precargar el lote de créditos %s", creditos.ids[:1])
+        pagos_por_credito, cortes = creditos._datos_interes(hoy)
+        lineas = []
+        for credito in creditos:
+            t0 = time.perf_counter()
+            error = False
+            try:
+                with self.env.cr.savepoint():
+                    credito.write(credito._valores_interes(
+                        hoy, pagos_por_credito.get(credito.id, []), cortes.get(credito.id)))
+            except Exception as e:
+                _logger.exception("Error al recalcular el crédito %s", credito.id)
+                error = str(e) or e.__class__.__name__
+            lineas.append({
+                'recalculo_id': self.id,
+                'credito_id': credito.id,
+                'duracion_ms': (time.perf_counter() - t0) * 1000.0,
+                'ok': not error,
+                'error': error,
+            })
+        return lineas
+
+
+class recalculo_line(models.Model):
+    _name = 'creditos.recalculo.line'
+    _description = 'Tiempo de recálculo por crédito'
+    _order = 'duracion_ms desc'
+
+    recalculo_id = fields.Many2one('creditos.recalculo', string="Ejecución", required=True, index=True, ondelete='cascade')
+    credito_id = fields.Many2one('creditos.credito', string="Crédito", ondelete='cascade')
+    duracion_ms = fields.Float(string="Duración (ms)", digits=(12, 2))
+    ok = fields.Boolean(string="Correcto", default=True)
+    error = fields.Text(string="Error")
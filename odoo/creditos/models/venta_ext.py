@@ -0,0 +1,40 @@
+from odoo import models, fields, api
+
+
+class venta_ext(models.Model):
+    _inherit = 'ventas.venta'
+
+    # Campos que mueven el capital del crédito en el cálculo de intereses.
+    _CAMPOS_INTERES = ('fecha', 'importe', 'state', 'contrato', 'detalle_venta')
+
+    def _invalidar_cortes_interes(self, desde=None):
+        for rec in self:
+            fecha = desde or rec.fecha
+            if desde and rec.fecha:
+                fecha = min(desde, rec.fecha)
+            rec.contrato._invalidar_cortes_interes(fecha)
+
+    # `importe`/`total` se recalculan (stored compute) cuando cambian las líneas de detalle,
+    # sin pasar por write(): los cortes de la venta con contrato se invalidan aquí.
+    def _add_detalles(self):
+        super(venta_ext, self)._add_detalles()
+        self.filtered(lambda r: r.contrato and r.fecha)._invalidar_cortes_interes()
+
+    @api.model
+    def create(self, vals):
+        rec = super(venta_ext, self).create(vals)
+        if rec.contrato and rec.fecha:
+            rec._invalidar_cortes_interes()
+        return rec
+
+    def write(self, vals):
+        if any(f in vals for f in self._CAMPOS_INTERES):
+            self._invalidar_cortes_interes(fields.Date.to_date(vals.get('fecha')))
+        res = super(venta_ext, self).write(vals)
+        if 'contrato' in vals:
+            self._invalidar_cortes_interes()
+        return res
+
+    def unlink(self):
+        self._invalidar_cortes_interes()
+        return super(venta_ext, self).unlink()
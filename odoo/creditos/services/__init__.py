@@ -0,0 +1,7 @@
+"""Services for creditos module.
+
+Helpers de cálculo que no dependen del ORM: reciben datos ya leídos
+de los modelos y devuelven los importes a escribir.
+"""
+
+from . import interes_engine
@@ -9,7 +9,7 @@
     ''',
     'author': 'Safinsa',
     'category': 'Tools',
-    'depends': ['base', 'web'],
+    'depends': ['base', 'web', 'accesos'],
     'data': [
         'security/ir.model.access.csv',
         'views/dashboard.xml',
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -47,8 +47,84 @@ ODOO_MODELS_BLACKLIST = {
     'mail.activity',
 }
 
+_VERSION_CR_KEY = 'dashboard.version'
+
+
+# Versión de las tarjetas del Panel Principal. create/write/unlink de accesos.acceso,
+# permisos.modulo, ir.ui.menu y dashboard.module la suben (dashboard.version.mixin); las
+# tarjetas se cachean por usuario, idioma y versión. El valor sale de una secuencia (no se
+# repite aunque la transacción se revierta) y vive en una fila normal: los demás workers ven
+# la versión nueva sólo tras el commit, sin vaciar la caché del registro.
+class DashboardVersion(models.Model):
+    _name = 'dashboard.version'
+    _description = 'Versión de las tarjetas del Panel Principal'
+    _log_access = False
+
+    version = fields.Integer(required=True, default=0)
+
+    def init(self):
+        cr = self.env.cr
+        cr.execute("CREATE SEQUENCE IF NOT EXISTS dashboard_version_seq")
+        cr.execute("""
+            INSERT INTO dashboard_version (version)
+            SELECT nextval('dashboard_version_seq')
+            WHERE NOT EXISTS (SELECT 1 FROM dashboard_version)
+        """)
+
+    # Versión vigente para esta transacción (una consulta por petición, cr.cache).
+    @api.model
+    def _current(self):
+        cache = self.env.cr.cache
+        if _VERSION_CR_KEY not in cache:
+            self.env.cr.execute("SELECT max(version) FROM dashboard_version")
+            cache[_VERSION_CR_KEY] = self.env.cr.fetchone()[0] or 0
+        return cache[_VERSION_CR_KEY]
+
+    @api.model
+    def _bump(self):
+        self.env.cr.execute("UPDATE dashboard_version SET version = nextval('dashboard_version_seq')")
+        self.env.cr.cache.pop(_VERSION_CR_KEY, None)
+
+
+class DashboardVersionMixin(models.AbstractModel):
+    _name = 'dashboard.version.mixin'
+    _description = 'Sube la versión del Panel Principal al modificar registros'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        recs = super().create(vals_list)
+        self.env['dashboard.version']._bump()
+        return recs
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env['dashboard.version']._bump()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['dashboard.version']._bump()
+        return res
+
+
+class IrUiMenu(models.Model):
+    _name = 'ir.ui.menu'
+    _inherit = ['ir.ui.menu', 'dashboard.version.mixin']
+
+
+class AccesosAcceso(models.Model):
+    _name = 'accesos.acceso'
+    _inherit = ['accesos.acceso', 'dashboard.version.mixin']
+
+
+class PermisosModulo(models.Model):
+    _name = 'permisos.modulo'
+    _inherit = ['permisos.modulo', 'dashboard.version.mixin']
+
+
 class DashboardModule(models.Model):
     _name = 'dashboard.module'
+    _inherit = ['dashboard.version.mixin']
     _description = 'Dashboard Module Configuration'
     _order = 'sequence, name'
 
@@ -208,7 +284,23 @@ class DashboardModule(models.Model):
         """
         Devuelve las tarjetas que verá el usuario en el Panel Principal.
         SOLO módulos con acceso en accesos.acceso + show_in_dashboard=True.
+
+        Las tarjetas se cachean por usuario, idioma y versión (dashboard.version); un
+        cambio en accesos, permisos.modulo, ir.ui.menu o dashboard.module sube la versión y
+        la siguiente carga las recalcula.
         """
+        cards = self._dashboard_cards(self.env.uid, self.env.lang, self.env['dashboard.version']._current())
+        return [dict(card) for card in cards]
+
+    @api.model
+    @tools.ormcache('uid', 'lang', 'version')
+    def _dashboard_cards(self, uid, lang, version):
+        # Tupla de tuplas (inmutable): el resultado se comparte entre peticiones del worker
+        cards = self.with_user(uid).with_context(lang=lang)._build_dashboard_modules()
+        return tuple(tuple(card.items()) for card in cards)
+
+    @api.model
+    def _build_dashboard_modules(self):
         user = self.env.user
         Acceso = self.env['accesos.acceso'].sudo()
         Menu = self.env['ir.ui.menu'].sudo()
@@ -237,64 +329,56 @@ class DashboardModule(models.Model):
             ('active', '=', True),
         ])
 
-        _logger.info(
-            "DASHBOARD: usuario=%s accesos=%s",
-            user.id,
-            [(a.modulo_id.code, a.modulo_id.show_in_dashboard, a.modulo_id.menu_ids.ids) for a in accesos],
-        )
-
         for acceso in accesos:
             modulo = acceso.modulo_id
 
-            _logger.info(
-                "DASHBOARD: evaluando modulo code=%s name=%s show_in_dashboard=%s menu_ids=%s",
-                modulo.code,
-                modulo.name,
-                modulo.show_in_dashboard,
-                modulo.menu_ids.ids,
-            )
-
             # Solo módulos marcados para mostrarse en el panel
             if not modulo.show_in_dashboard:
-                _logger.info(
-                    "DASHBOARD: SKIP modulo %s -> show_in_dashboard=False",
-                    modulo.code,
-                )
+                _logger.debug("DASHBOARD: SKIP modulo %s -> show_in_dashboard=False", modulo.code)
                 continue
 
             # Elegir UN menú para la tarjeta
             menu = self._select_dashboard_menu(modulo)
             if not menu:
-                _logger.info(
-                    "DASHBOARD: SKIP modulo %s -> _select_dashboard_menu devolvió vacío",
-                    modulo.code,
-                )
+                _logger.debug("DASHBOARD: SKIP modulo %s -> _select_dashboard_menu devolvió vacío",
+                              modulo.code)
                 continue
 
             if menu.id in seen_menu_ids:
-                _logger.info(
-                    "DASHBOARD: SKIP menu id=%s name=%s -> ya estaba en seen_menu_ids",
-                    menu.id,
-                    menu.name,
-                )
+                _logger.debug("DASHBOARD: SKIP menu id=%s -> ya estaba en seen_menu_ids", menu.id)
                 continue
 
-            _logger.info(
-                "DASHBOARD: ADD card para menu id=%s name=%s modulo=%s",
-                menu.id,
-                menu.name,
-                modulo.code,
-            )
             modules.append(self._build_menu_payload(menu))
             seen_menu_ids.add(menu.id)
 
-        _logger.info(
+        _logger.debug(
             "DASHBOARD: modules resultantes para user=%s -> %s",
             user.id,
             [(m['name'], m['menu_id'], m['category']) for m in modules],
         )
         return modules
-    
+
+    # Benchmark para `odoo shell`: carga en frío (sin caché) contra carga desde caché.
+    #     env['dashboard.module']._bench_dashboard(n=200)
+    @api.model
+    def _bench_dashboard(self, n=200):
+        import time
+        cr = self.env.cr
+
+        def _run(fn, times):
+            q0, t0 = cr.sql_log_count, time.monotonic()
+            for _i in range(times):
+                fn()
+            dt = time.monotonic() - t0
+            return round(dt / times * 1000, 3), (cr.sql_log_count - q0) / times
+
+        cold = _run(self._build_dashboard_modules, max(1, n // 10))
+        self.get_dashboard_modules()
+        warm = _run(self.get_dashboard_modules, n)
+        report = {'cold_ms': cold[0], 'cold_queries': cold[1], 'cached_ms': warm[0], 'cached_queries': warm[1]}
+        _logger.info("DASHBOARD BENCH | %s", report)
+        return report
+
     def _is_odoo_menu(self, menu):
         """
         Determina si un menú es de Odoo (core) basándose en:
@@ -393,7 +477,7 @@ class DashboardModule(models.Model):
         # 1) custom_menu_id explícito (nuevo campo para menú propio)
         if hasattr(modulo, 'custom_menu_id') and modulo.custom_menu_id:
             if not exclude_odoo or not self._is_odoo_menu(modulo.custom_menu_id):
-                _logger.info(
+                _logger.debug(
                     "[%s] usando custom_menu_id: %s",
                     modulo.code, modulo.custom_menu_id.name
                 )
@@ -402,7 +486,7 @@ class DashboardModule(models.Model):
         # 2) dashboard_menu_id explícito
         if hasattr(modulo, 'dashboard_menu_id') and modulo.dashboard_menu_id:
             if not exclude_odoo or not self._is_odoo_menu(modulo.dashboard_menu_id):
-                _logger.info(
+                _logger.debug(
                     "[%s] usando dashboard_menu_id: %s",
                     modulo.code, modulo.dashboard_menu_id.name
                 )
@@ -415,7 +499,7 @@ class DashboardModule(models.Model):
         ], limit=1)
         if dash_rec and dash_rec.menu_id:
             if not exclude_odoo or not self._is_odoo_menu(dash_rec.menu_id):
-                _logger.info(
+                _logger.debug(
                     "[%s] usando dashboard.module: %s",
                     modulo.code, dash_rec.menu_id.name
                 )
@@ -428,7 +512,7 @@ class DashboardModule(models.Model):
                 if not self._is_odoo_menu(menu):
                     valid_menus |= menu
                 else:
-                    _logger.info(
+                    _logger.debug(
                         "[%s] excluyendo menú de Odoo: %s",
                         modulo.code, menu.name
                     )
@@ -446,7 +530,7 @@ class DashboardModule(models.Model):
         # 5) Menú raíz con acción
         root_with_action = valid_menus.filtered(lambda m: not m.parent_id and m.action)
         if root_with_action:
-            _logger.info(
+            _logger.debug(
                 "[%s] usando menú raíz con acción: %s",
                 modulo.code, root_with_action[0].name
             )
@@ -455,7 +539,7 @@ class DashboardModule(models.Model):
         # 6) Cualquier menú con acción
         with_action = valid_menus.filtered('action')
         if with_action:
-            _logger.info(
+            _logger.debug(
                 "[%s] usando primer menú con acción: %s",
                 modulo.code, with_action[0].name
             )
@@ -463,7 +547,7 @@ class DashboardModule(models.Model):
 
         # 7) El primero disponible (solo si hay válidos)
         if valid_menus:
-            _logger.info(
+            _logger.debug(
                 "[%s] usando primer menú disponible: %s",
                 modulo.code, valid_menus[0].name
             )
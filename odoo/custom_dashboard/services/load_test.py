@@ -0,0 +1,126 @@
+# custom_dashboard/services/load_test.py
+"""Prueba de carga del Panel Principal (sólo stdlib, sin ORM; no lo importa el módulo).
+
+Inicia sesión con uno o varios usuarios (/web/session/authenticate) y llama en paralelo
+a dashboard.module.get_dashboard_modules por /web/dataset/call_kw, igual que el panel
+al cargar. Reporta peticiones por segundo, latencias p50/p95/máx y errores.
+
+Uso (consola):
+    python load_test.py --url http://127.0.0.1:8069 --db pruebas \
+        --user admin:admin --user cajero:secreto --threads 8 --duration 30
+Cada hilo usa la sesión de un usuario (en rueda). Con --warmup se hace una llamada por
+sesión antes de medir para que la caché de tarjetas ya esté caliente.
+"""
+import argparse
+import http.cookiejar
+import json
+import statistics
+import threading
+import time
+import urllib.request
+
+_ROUTE = '/web/dataset/call_kw/dashboard.module/get_dashboard_modules'
+
+
+class Session:
+    """Sesión HTTP de Odoo con su cookie."""
+
+    def __init__(self, url, db, login, password, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        res = self._rpc('/web/session/authenticate',
+                        {'db': db, 'login': login, 'password': password})
+        if not (res.get('result') or {}).get('uid'):
+            raise RuntimeError('No se pudo iniciar sesión como %s: %s' % (login, res.get('error')))
+        self.login = login
+
+    def _rpc(self, path, params):
+        data = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': params}).encode('utf-8')
+        req = urllib.request.Request(self.url + path, data=data,
+                                     headers={'Content-Type': 'application/json'})
+        with self.opener.open(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    def dashboard(self):
+        res = self._rpc(_ROUTE, {'model': 'dashboard.module', 'method': 'get_dashboard_modules',
+                                 'args': [], 'kwargs': {}})
+        if 'error' in res:
+            raise RuntimeError(res['error'].get('message') or 'error')
+        return res['result']
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def run(sessions, threads=4, duration=10.0, warmup=True):
+    """Corre la carga y regresa un dict con rps, latencias (ms) y errores."""
+    if warmup:
+        for s in sessions:
+            s.dashboard()
+    lock = threading.Lock()
+    latencies, errors = [], []
+    stop_at = time.monotonic() + duration
+
+    def _worker(session):
+        local, local_err = [], []
+        while time.monotonic() < stop_at:
+            t0 = time.monotonic()
+            try:
+                session.dashboard()
+                local.append((time.monotonic() - t0) * 1000.0)
+            except Exception as e:
+                local_err.append(str(e))
+        with lock:
+            latencies.extend(local)
+            errors.extend(local_err)
+
+    workers = [threading.Thread(target=_worker, args=(sessions[i % len(sessions)],), daemon=True)
+               for i in range(threads)]
+    t0 = time.monotonic()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.monotonic() - t0
+    return {
+        'threads': threads,
+        'users': len(sessions),
+        'seconds': round(elapsed, 2),
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 50), 1),
+        'p95_ms': round(_percentile(latencies, 95), 1),
+        'max_ms': round(max(latencies), 1) if latencies else 0.0,
+        'mean_ms': round(statistics.fmean(latencies), 1) if latencies else 0.0,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Prueba de carga del Panel Principal')
+    p.add_argument('--url', default='http://127.0.0.1:8069')
+    p.add_argument('--db', required=True)
+    p.add_argument('--user', action='append', required=True, metavar='LOGIN:PASSWORD',
+                   help='Usuario para la prueba; se puede repetir')
+    p.add_argument('--threads', type=int, default=4)
+    p.add_argument('--duration', type=float, default=10.0, help='Segundos de carga')
+    p.add_argument('--no-warmup', dest='warmup', action='store_false')
+    args = p.parse_args(argv)
+
+    sessions = []
+    for cred in args.user:
+        login, _sep, password = cred.partition(':')
+        sessions.append(Session(args.url, args.db, login, password))
+    report = run(sessions, threads=args.threads, duration=args.duration, warmup=args.warmup)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -113,6 +113,11 @@ class empresa(models.Model):
         res = super().write(vals)
         if set(vals).intersection({'nombre','razonsocial','rfc','telefono','calle','numero','cp','regimen_fiscal','auto_sync_cfdi'}):
             self._validate_fiscal()
+        if set(vals).intersection({'rfc', 'cfdi_sw_cer_file', 'cfdi_sw_key_file', 'cfdi_sw_key_password'}):
+            # Certificado/RFC distinto → la presencia del CSD en SW se vuelve a consultar
+            provider = self.env.get('mx.cfdi.engine.provider.sw')
+            if provider is not None:
+                provider._cert_cache_invalidate(self.ids)
         return res
 
     
@@ -10,9 +10,12 @@
   ],
   "data": [
     "security/permisos_security_data.xml",
+    "data/cron_tx_factura_backfill.xml",
+    "data/cron_cancel_job.xml",
     "views/wizards_views.xml",      # define acciones de los wizards que usa el form
     "views/factura_views.xml",      # define la acción principal action_facturas_ui
     "views/transaccion_vista.xml", # vista de transacciones (lista y formulario)
+    "views/cancel_job_views.xml",  # lotes de cancelación masiva
     "views/menu.xml",               # el menú la referencia (debe ir al final)
   ],
   "assets": {
@@ -1,3 +1,4 @@
 from . import factura
 from . import transaccion_flags
-from . import account_move_inherit
\ No newline at end of file
+from . import account_move_inherit
+from . import cancel_job
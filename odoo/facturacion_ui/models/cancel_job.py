@@ -0,0 +1,220 @@
+# models/cancel_job.py
+# Lote de cancelación masiva procesado por cron (cierre de mes).
+# Cientos de cancelaciones no caben en una petición HTTP (a 5 cancelaciones/seg, 500 facturas
+# son 100 s sólo de PAC): el wizard crea el lote y el cron lo procesa por bloques. En cada
+# bloque el resultado del PAC se confirma (commit) antes de los efectos internos, así la BD
+# nunca pierde una cancelación que el SAT ya aceptó aunque el worker se corte.
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+LINE_STATUS = [
+    ('pending', 'Pendiente'),
+    ('pac_sent', 'Enviada al PAC'),
+    ('local_pending', 'Pendiente interna'),
+    ('canceled', 'Cancelada (PAC + interna)'),
+    ('local', 'Sólo interna'),
+    ('pac_only', 'PAC cancelado, interna pendiente'),
+    ('pac_error', 'Rechazada por PAC'),
+    ('invalid', 'No cancelable'),
+    ('error', 'Error interno'),
+]
+
+
+class FacturaCancelJob(models.Model):
+    _name = 'facturas.cancel.job'
+    _description = 'Lote de cancelación masiva de facturas'
+    _order = 'id desc'
+
+    name = fields.Char(string='Lote', readonly=True, default=lambda s: _('Cancelación masiva'))
+    user_id = fields.Many2one('res.users', string='Solicitó', default=lambda s: s.env.user, readonly=True)
+    motivo = fields.Char(string='Motivo SAT', readonly=True)
+    continue_on_pac_error = fields.Boolean(string='Cancelar internamente aunque falle el PAC', readonly=True)
+    state = fields.Selection([('queued', 'En cola'), ('running', 'Procesando'), ('done', 'Terminado')],
+                             default='queued', index=True, readonly=True)
+    line_ids = fields.One2many('facturas.cancel.job.line', 'job_id', string='Facturas', readonly=True)
+    started_at = fields.Datetime(string='Inicio', readonly=True)
+    finished_at = fields.Datetime(string='Fin', readonly=True)
+    pending_count = fields.Integer(compute='_compute_counts', string='Pendientes')
+    canceled_count = fields.Integer(compute='_compute_counts', string='Canceladas')
+    local_count = fields.Integer(compute='_compute_counts', string='Sólo internas')
+    pac_only_count = fields.Integer(compute='_compute_counts', string='PAC cancelado, interna pendiente')
+    failed_count = fields.Integer(compute='_compute_counts', string='No canceladas')
+
+    @api.depends('line_ids.status')
+    def _compute_counts(self):
+        for job in self:
+            status = job.line_ids.mapped('status')
+            job.pending_count = sum(status.count(s) for s in ('pending', 'pac_sent', 'local_pending'))
+            job.canceled_count = status.count('canceled')
+            job.local_count = status.count('local')
+            job.pac_only_count = status.count('pac_only')
+            job.failed_count = (len(status) - job.pending_count - job.canceled_count
+                                - job.local_count - job.pac_only_count)
+
+    # Crea el lote. Los E/P van en la etapa 0 y los Ingresos en la 1: un Ingreso cuyos hijos
+    # van en el mismo lote se procesa cuando éstos ya se cancelaron.
+    @api.model
+    def _create_for(self, facturas, motivo='02', continue_on_pac_error=False):
+        if not facturas:
+            raise UserError(_('Selecciona al menos una factura.'))
+        job = self.create({
+            'name': _('Cancelación masiva %s') % fields.Datetime.to_string(fields.Datetime.now()),
+            'motivo': motivo or '02',
+            'continue_on_pac_error': continue_on_pac_error,
+            'line_ids': [(0, 0, {
+                'factura_id': f.id,
+                'uuid': f.uuid or '',
+                'stage': 0 if f.tipo in ('E', 'P') else 1,
+            }) for f in facturas],
+        })
+        self._trigger_cron()
+        return job
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref('facturacion_ui.ir_cron_facturas_cancel_job', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    # Cron: procesa lotes por bloques (facturacion_ui.bulk_cancel_chunk, default 20) hasta
+    # agotar facturacion_ui.bulk_cancel_time_budget (seg, default 60); si queda trabajo se
+    # vuelve a disparar. Cada bloque confirma el PAC y después la parte interna.
+    @api.model
+    def _cron_process(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        chunk = max(1, int(ICP.get_param('facturacion_ui.bulk_cancel_chunk', 20) or 20))
+        budget = max(5.0, float(ICP.get_param('facturacion_ui.bulk_cancel_time_budget', 60) or 60))
+        deadline = time.monotonic() + budget
+        for job in self.search([('state', 'in', ('queued', 'running'))], order='id'):
+            while True:
+                if time.monotonic() >= deadline:
+                    self._trigger_cron()
+                    return True
+                if not job._process_next(chunk):
+                    break
+        return True
+
+    # Procesa el siguiente bloque del lote; False si ya no hay trabajo (y cierra el lote).
+    def _process_next(self, chunk):
+        self.ensure_one()
+        cr = self.env.cr
+        if self.state == 'queued':
+            self.write({'state': 'running', 'started_at': fields.Datetime.now()})
+            cr.commit()
+        Line = self.env['facturas.cancel.job.line']
+        # Primero lo que ya pasó por el PAC (p.ej. un corte entre el commit del PAC y la
+        # parte interna); luego la siguiente etapa pendiente.
+        lines = Line.search([('job_id', '=', self.id), ('status', '=', 'local_pending')],
+                            order='stage, id', limit=chunk)
+        if lines:
+            lines._run_local()
+            cr.commit()
+            return True
+        todo = Line.search([('job_id', '=', self.id), ('status', 'in', ('pending', 'pac_sent'))],
+                           order='stage, id', limit=1)
+        if not todo:
+            self.write({'state': 'done', 'finished_at': fields.Datetime.now()})
+            cr.commit()
+            return False
+        lines = Line.search([('job_id', '=', self.id), ('status', 'in', ('pending', 'pac_sent')),
+                             ('stage', '=', todo.stage)], order='id', limit=chunk)
+        # Marca antes de llamar al PAC: si el worker se corta, se sabe que el bloque salió.
+        # Reenviar una cancelación ya aceptada es seguro (el PAC responde que ya estaba cancelado).
+        lines.write({'status': 'pac_sent'})
+        cr.commit()
+        lines._run_pac(self.motivo, self.continue_on_pac_error)
+        cr.commit()
+        lines.filtered(lambda l: l.status == 'local_pending')._run_local()
+        cr.commit()
+        return True
+
+    # Botón: reintenta la parte interna de las facturas que el PAC ya canceló.
+    def action_retry_local(self):
+        lines = self.line_ids.filtered(lambda l: l.status == 'pac_only')
+        if lines:
+            lines.write({'status': 'local_pending', 'message': False})
+            self.filtered(lambda j: j.state == 'done').write({'state': 'running'})
+            self._trigger_cron()
+        return True
+
+    def action_refresh(self):
+        return True
+
+    def action_open_facturas(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Facturas del lote'),
+            'res_model': 'facturas.factura',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', self.line_ids.factura_id.ids)],
+        }
+
+
+class FacturaCancelJobLine(models.Model):
+    _name = 'facturas.cancel.job.line'
+    _description = 'Factura en lote de cancelación masiva'
+    _order = 'stage, id'
+
+    job_id     = fields.Many2one('facturas.cancel.job', required=True, ondelete='cascade', index=True)
+    factura_id = fields.Many2one('facturas.factura', string='Factura', required=True, readonly=True)
+    uuid       = fields.Char(string='UUID', readonly=True)
+    stage      = fields.Integer(default=1, readonly=True)
+    status     = fields.Selection(LINE_STATUS, string='Estado', default='pending', index=True, readonly=True)
+    pac_ok     = fields.Boolean(string='Cancelado en PAC', readonly=True)
+    pac_status = fields.Char(string='Respuesta PAC', readonly=True)
+    message    = fields.Text(string='Detalle', readonly=True)
+    elapsed    = fields.Float(string='PAC (seg)', digits=(16, 2), readonly=True)
+
+    # Validación + PAC del bloque. Las que siguen a la parte interna quedan 'local_pending'
+    # (con pac_ok si el PAC las canceló); el llamador confirma antes de _run_local.
+    # engine.cancel_cfdi_many aísla sus escrituras posteriores al PAC; si aun así algo falla,
+    # las que el PAC ya canceló conservan pac_ok/pac_status y siguen a la parte interna.
+    def _run_pac(self, motivo, continue_on_pac_error):
+        results = {l.factura_id.id: {'factura_id': l.factura_id.id, 'uuid': l.uuid, 'status': 'invalid',
+                                     'pac_status': False, 'message': '', 'elapsed': 0.0} for l in self}
+        try:
+            todo = self.factura_id._cancel_batch_pac(results, motivo, continue_on_pac_error)
+        except Exception as e:
+            _logger.exception("CANCEL JOB | bloque falló durante el PAC")
+            self.env.cr.rollback()
+            for line in self:
+                res = results[line.factura_id.id]
+                if res['status'] == 'canceled':
+                    line.write({'status': 'local_pending', 'pac_ok': True,
+                                'pac_status': res['pac_status'], 'elapsed': res['elapsed']})
+                else:
+                    line.write({'status': 'error', 'message': str(e) or repr(e)})
+            return
+        for line in self:
+            res = results[line.factura_id.id]
+            vals = {'pac_status': res['pac_status'], 'elapsed': res['elapsed'],
+                    'message': res['message'] or False, 'pac_ok': res['status'] == 'canceled'}
+            vals['status'] = 'local_pending' if line.factura_id in todo else res['status']
+            line.write(vals)
+
+    # Cancelación interna de las que ya pasaron el PAC.
+    def _run_local(self):
+        results = {l.factura_id.id: {'factura_id': l.factura_id.id, 'uuid': l.uuid,
+                                     'status': 'canceled' if l.pac_ok else 'local',
+                                     'pac_status': l.pac_status, 'message': l.message or '',
+                                     'elapsed': l.elapsed} for l in self}
+        try:
+            self.factura_id._cancel_batch_local(results)
+        except Exception as e:
+            _logger.exception("CANCEL JOB | falló la cancelación interna del bloque")
+            self.env.cr.rollback()
+            for line in self:
+                line.write({
+                    'status': 'pac_only' if line.pac_ok else 'error',
+                    'message': (_('El PAC canceló el CFDI pero falló la cancelación interna: %s')
+                                if line.pac_ok else '%s') % (str(e) or repr(e)),
+                })
+            return
+        for line in self:
+            res = results[line.factura_id.id]
+            line.write({'status': res['status'], 'message': res['message'] or False})
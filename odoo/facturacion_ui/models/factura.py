@@ -6,6 +6,11 @@ import logging
 _logger = logging.getLogger(__name__)
 import base64
 from odoo.osv.expression import OR
+import re
+from odoo.addons.mx_cfdi_core.services.cfdi_taxes import Conceptos
+
+# Token con que las transacciones referencian a la factura que las creó (ver _own_ref_token).
+_FUI_TOKEN_RE = re.compile(r'\[FUI#(\d+)\]', re.IGNORECASE)
 
 class FacturaUI(models.Model):
     _name = 'facturas.factura'
@@ -63,6 +68,14 @@ class FacturaUI(models.Model):
     uuid         = fields.Char(copy=False, index=True, tracking=True)
     move_id      = fields.Many2one('account.move', string='Factura contable', copy=False)
     attachment_count = fields.Integer(compute='_compute_attachment_count')
+    # Estado en la cola de timbrado asíncrono (mx.cfdi.document)
+    stamp_queue_state = fields.Selection([('to_stamp', 'En cola'), ('error', 'Error de timbrado')],
+                                         string='Cola de timbrado', compute='_compute_stamp_queue')
+    stamp_queue_error = fields.Text(string='Error de timbrado', compute='_compute_stamp_queue')
+    # Descarga diferida del XML timbrado (cuando el PAC no lo regresa al timbrar)
+    xml_download_state = fields.Selection([('pending', 'Descargando XML'), ('done', 'XML disponible'),
+                                           ('failed', 'XML no disponible')],
+                                          string='XML timbrado', compute='_compute_xml_download_state')
     currency_id = fields.Many2one('res.currency', compute='_compute_currency', store=True, readonly=True)
     # === Pago (tipo P) ===
     pago_importe = fields.Monetary(string='Importe del pago', currency_field='currency_id', default=0.0)
@@ -255,8 +268,8 @@ class FacturaUI(models.Model):
     
         invoice_company = move.company_id  # solo para log/diagnóstico
     
-        # Conceptos CFDI
-        conceptos = self.line_ids._to_cfdi_conceptos()
+        # Conceptos CFDI (en columnas)
+        conceptos = self.line_ids._to_cfdi_columnas()
     
         # Extras: Información Global para PÚBLICO EN GENERAL
         rec = move.partner_id
@@ -274,9 +287,15 @@ class FacturaUI(models.Model):
             "CFDI FLOW | EMISOR | empresa=%s (cp=%s) invoice_company=%s",
             self.empresa_id.display_name, (self.empresa_id.cp or ''), invoice_company.id
         )
-        # Serializar por empresa para evitar colisiones
+        # Serializar por empresa para evitar colisiones, con la misma llave en los dos caminos.
+        # El timbrado interactivo toma el lock exclusivo; la cola toma el compartido, así los
+        # slots de la cola (ya acotados por mx_cfdi.queue_per_empresa) corren en paralelo entre
+        # sí, pero nunca junto con un timbrado interactivo de la misma empresa.
         try:
-            self.env.cr.execute("SELECT pg_advisory_xact_lock(%s)", [self.empresa_id.id])
+            if self.env.context.get('cfdi_queue_slot') is None:
+                self.env.cr.execute("SELECT pg_advisory_xact_lock(%s)", [self.empresa_id.id])
+            else:
+                self.env.cr.execute("SELECT pg_advisory_xact_lock_shared(%s)", [self.empresa_id.id])
         except Exception:
             pass
         self.env.cr.execute("SET LOCAL lock_timeout TO '30s'")
@@ -313,7 +332,7 @@ class FacturaUI(models.Model):
 
         # (opcional) log de verificación
         try:
-            sub = round(sum(c.get('importe', 0.0) for c in conceptos), 2)
+            sub = conceptos.subtotal()
             self._logger.info("CFDI FLOW | CHECK | tipo=%s subtotal_conceptos=%.2f move_amount_untaxed=%.2f",
                               self.tipo, sub, getattr(move, 'amount_untaxed', 0.0))
         except Exception:
@@ -696,6 +715,46 @@ class FacturaUI(models.Model):
 
 
 
+    # Encola el timbrado (mx.cfdi.document 'to_stamp') y regresa de inmediato; el cron
+    # de la cola ejecuta action_build_and_stamp en segundo plano.
+    def action_enqueue_stamp(self):
+        pending = self.filtered(lambda r: r.state in ('draft', 'ready'))
+        for r in pending:
+            r._check_consistency()
+        self.env['mx.cfdi.document']._enqueue(self._name, [
+            {'origin_id': r.id, 'empresa_id': r.empresa_id.id, 'tipo': r.tipo} for r in pending
+        ])
+        return {'type': 'ir.actions.client', 'tag': 'display_notification',
+                'params': {'title': _('Timbrado'),
+                           'message': _('%s factura(s) en cola de timbrado.') % len(pending),
+                           'type': 'info', 'sticky': False}}
+
+    # Punto de entrada de la cola de timbrado. Idempotente: si ya quedó timbrada no hace nada.
+    def _cfdi_stamp_from_queue(self):
+        for r in self:
+            if r.state == 'stamped' and (r.uuid or '').strip():
+                continue
+            r.action_build_and_stamp()
+        return True
+
+    def _compute_stamp_queue(self):
+        docs = self.env['mx.cfdi.document'].sudo().search([
+            ('origin_model', '=', self._name),
+            ('origin_id', 'in', self.ids),
+            ('state', 'in', ['to_stamp', 'error']),
+        ], order='id')
+        by_origin = {d.origin_id: d for d in docs}
+        for r in self:
+            doc = by_origin.get(r.id)
+            r.stamp_queue_state = doc.state if doc else False
+            r.stamp_queue_error = doc.last_error if doc else False
+
+    def _compute_xml_download_state(self):
+        uuids = [u for u in self.mapped('uuid') if u]
+        status = self.env['mx.cfdi.document'].sudo().get_xml_status(uuids) if uuids else {}
+        for r in self:
+            r.xml_download_state = (status.get(r.uuid) or {}).get('xml_state') or False
+
     # === Helpers post-operación ===
     # R<esolver compañía contable destino ===
     def _resolve_inv_company(self):
@@ -874,6 +933,7 @@ class FacturaUI(models.Model):
                         'cantidad': -take,                         # negativa → importe negativo
                         'precio': l.precio or 0.0,                 # positivo
                         'referencia': ref,
+                        'factura_id': self.id,
                         'sucursal_id': self.sucursal_id.id,
                         'tipo': '6',                               # Dev de Cliente (Entrada lógica)
                         # helpers
@@ -902,6 +962,7 @@ class FacturaUI(models.Model):
                         'cantidad': -need_qty,
                         'precio': l.precio or 0.0,
                         'referencia': ref,
+                        'factura_id': self.id,
                         'sucursal_id': self.sucursal_id.id,
                         'tipo': '6',
                         'empresa_id_helper': self.empresa_id.id,
@@ -943,6 +1004,7 @@ class FacturaUI(models.Model):
                         'cantidad': -qty_part,                     # negativa
                         'precio': l.precio or 0.0,
                         'referencia': ref,
+                        'factura_id': self.id,
                         'sucursal_id': self.sucursal_id.id,
                         'tipo': '10',                              # sin efecto de stock
                         'empresa_id_helper': self.empresa_id.id,
@@ -978,6 +1040,7 @@ class FacturaUI(models.Model):
                             'cantidad': -qty_part,
                             'precio': l.precio or 0.0,
                             'referencia': ref,
+                            'factura_id': self.id,
                             'sucursal_id': self.sucursal_id.id,
                             'tipo': '10',
                             'empresa_id_helper': self.empresa_id.id,
@@ -1007,6 +1070,7 @@ class FacturaUI(models.Model):
                             'cantidad': -qty_part,
                             'precio': l.precio or 0.0,
                             'referencia': ref,
+                            'factura_id': self.id,
                             'sucursal_id': self.sucursal_id.id,
                             'tipo': '10',
                             'empresa_id_helper': self.empresa_id.id,
@@ -1088,6 +1152,7 @@ class FacturaUI(models.Model):
                 'cantidad': 1.0,
                 'precio': -(self.pago_importe or 0.0),
                 'referencia': referencia,
+                'factura_id': self.id,
                 'sucursal_id': (venta.sucursal_id.id if venta else origin.sucursal_id.id),
                 'tipo': '11',  # sin efecto de stock
                 'empresa_id_helper': self.empresa_id.id,
@@ -1356,6 +1421,11 @@ class FacturaUI(models.Model):
         self.ensure_one()
         Att = self.env['ir.attachment']
 
+        # 0) Resolver indexado (una consulta); la cascada queda para adjuntos anteriores
+        hit = self._resolve_cfdi_xml()
+        if hit and hit['attachment_id']:
+            return Att.browse(hit['attachment_id'])
+
         # 1) Anexos del MOVE (preferido)
         if self.move_id:
             att = Att.search([
@@ -1408,13 +1478,31 @@ class FacturaUI(models.Model):
 
         return self.env['ir.attachment']  # vacío
 
-    # Fuerza la descarga del XML CFDI hallado por _find_cfdi_xml_attachment(). Valida que exista uuid.
+    # Documento/adjunto CFDI de esta factura vía mx.cfdi.document._resolve_xml: el origen es el
+    # account.move (I) o la propia FacturaUI (E/P, o sin move). Una sola consulta indexada.
+    def _resolve_cfdi_xml(self):
+        self.ensure_one()
+        keys = []
+        if self.move_id:
+            keys.append(('account.move', self.move_id.id, self.tipo))
+        keys.append((self._name, self.id, self.tipo))
+        hits = self.env['mx.cfdi.document']._resolve_xml(keys=keys)
+        for k in keys:
+            if k in hits:
+                return hits[k]
+        return None
+
+    # Fuerza la descarga del XML CFDI (resolver indexado; si no, _find_cfdi_xml_attachment()). Valida que exista uuid.
     def action_download_xml(self):
         """Forzar descarga del XML CFDI (igual que ventas.action_download_cfdi)."""
         self.ensure_one()
         if not self.uuid:
             raise ValidationError(_("Aún no hay UUID. Timbra o recupera el XML primero."))
 
+        hit = self._resolve_cfdi_xml()
+        if hit and hit['blob_id']:
+            return self.env['mx.cfdi.document']._xml_download_action(hit)
+
         att = self._find_cfdi_xml_attachment()
         if not att:
             raise ValidationError(_("No hay XML adjunto para esta factura."))
@@ -1437,10 +1525,16 @@ class FacturaUI(models.Model):
         engine = self.env['mx.cfdi.engine'].with_context(empresa_id=self.empresa_id.id)
         provider = engine._get_provider()
 
-        data = provider.download_xml_by_uuid(self.uuid, tries=10, delay=1.0)
+        data = provider.download_xml_by_uuid(self.uuid, tries=10, delay=1.0, max_wait=15.0)
         if not data or not data.get('xml'):
             raise UserError(_('SW no devolvió XML para el UUID %s.') % self.uuid)
 
+        # Si el documento CFDI esperaba la descarga diferida, queda completo con este XML
+        self.env['mx.cfdi.document'].sudo().search([
+            ('uuid', '=', self.uuid), ('xml_state', 'in', ('pending', 'failed')),
+        ]).write({'blob_id': self.env['mx.cfdi.blob']._store(data['xml']).id, 'xml_state': 'done',
+                  'xml_next_try': False, 'xml_error': False})
+
         Att = self.env['ir.attachment']
 
         # A) Adjuntar al MOVE si existe
@@ -1511,6 +1605,61 @@ class FacturaUI(models.Model):
         if hijos:
             raise ValidationError(_('Cancela primero los Egresos/Pagos relacionados antes de cancelar la factura principal.'))
 
+    def _revert_stock_on_cancel(self):
+        """Revierte el movimiento de stock del timbrado (I: regresa; E dev: vuelve a retirar)."""
+        self.ensure_one()
+        if self.state != 'stamped':
+            return
+        Stock = self.env['stock.sucursal.producto'].sudo()
+        if self.tipo == 'I':
+            # Regresar lo que se descontó al timbrar
+            move = Stock.add_stock
+        elif self.tipo == 'E' and (self.egreso_tipo or '') == 'dev':
+            # Si fue devolución, retirar lo que se había regresado
+            move = Stock.remove_stock
+        else:
+            return
+        for l in self.line_ids:
+            if not l.producto_id or self._is_service_line(l):
+                continue
+            qty = l.cantidad or 0.0
+            if qty > 0:
+                move(self.sucursal_id, l.producto_id, qty)
+
+    def _restore_origin_on_cancel(self, refresh=True):
+        """Repone en la factura origen los contadores que consumió este E/P.
+        Con refresh=False no fuerza el recompute de la origen (el lote lo hace una vez)."""
+        self.ensure_one()
+        origin = self.origin_factura_id
+        if not origin:
+            return
+        try:
+            if self.tipo == 'P':
+                self._restore_amount_counters_on_origin(self.pago_importe)
+            elif self.tipo == 'E':
+                if (self.egreso_tipo or '') == 'dev':
+                    self._restore_dev_counters_on_origin()
+                else:  # 'nc'
+                    self._restore_amount_counters_on_origin(self.importe_total)
+        except Exception as e:
+            self._logger.warning("No se pudieron restaurar contadores en origen: %s", e)
+        if refresh:
+            origin._refresh_after_child_cancel()
+
+    def _refresh_after_child_cancel(self):
+        """Fuerza el recompute de saldo de las facturas (como al timbrar) y refresca sus ventas."""
+        for state in set(self.mapped('state')):
+            try:
+                self.filtered(lambda f: f.state == state).write({'state': state})
+            except Exception:
+                pass
+        ventas = self.venta_ids | self.line_ids.sale_id
+        for state in set(ventas.mapped('state')):
+            try:
+                ventas.filtered(lambda v: v.state == state).write({'state': state})
+            except Exception:
+                pass
+
     def _pac_cancel(self, motivo='02', folio_sustitucion=None):
         self.ensure_one()
         if self.state != 'stamped' or not (self.uuid or '').strip():
@@ -1578,51 +1727,23 @@ class FacturaUI(models.Model):
         except KeyError:
             return
     
-        # 1) Búsqueda precisa por token
+        # 1) Búsqueda precisa: liga factura_id (índice) o token aún sin backfill (trigram)
         token = self._own_ref_token()
-        dom = [('referencia', 'ilike', token)]
-        if 'sucursal_id' in Tx._fields and self.sucursal_id:
-            dom.append(('sucursal_id', '=', self.sucursal_id.id))
-        if 'empresa_id_helper' in Tx._fields:
-            dom.append(('empresa_id_helper', '=', self.empresa_id.id))
-        if 'tipo' in Tx._fields:
-            if self.tipo == 'P':
-                dom.append(('tipo', '=', '11'))
-            elif self.tipo == 'E':
-                dom.append(('tipo', '=', '6' if (self.egreso_tipo or '') == 'dev' else '10'))
-    
-        txs = Tx.search(dom, limit=200)
+        own = self._tx_own_domain([self.id], [token])
+        txs = Tx.search(own + self._tx_scope_domain(Tx))
         count_token = len(txs)
     
         if not txs:
-            txs = Tx.search([('referencia', 'ilike', token)], limit=200)
+            txs = Tx.search(own)
             count_token = len(txs)
     
         # 2) Fallback LEGACY (si no traían token)
         if not txs:
-            refs = []
-            if self.move_id and getattr(self.move_id, 'name', False):
-                refs.append(self.move_id.name)
-                refs.append('Pago a factura %s' % self.move_id.name)
-            if (self.uuid or '').strip():
-                refs.append(self.uuid)
-    
             legacy_dom = [('id', '=', 0)]
-            for r in refs:
+            for r in self._tx_legacy_refs():
                 legacy_dom = OR([legacy_dom, [('referencia', 'ilike', r)]])
-            tight = []
-            if 'sucursal_id' in Tx._fields and self.sucursal_id:
-                tight.append(('sucursal_id', '=', self.sucursal_id.id))
-            if 'empresa_id_helper' in Tx._fields:
-                tight.append(('empresa_id_helper', '=', self.empresa_id.id))
-            if 'tipo' in Tx._fields:
-                if self.tipo == 'P':
-                    tight.append(('tipo', '=', '11'))
-                elif self.tipo == 'E':
-                    tight.append(('tipo', '=', '6' if (self.egreso_tipo or '') == 'dev' else '10'))
-    
-            legacy_dom = tight + legacy_dom
-            txs = Tx.search(legacy_dom, limit=200)
+            legacy_dom = self._tx_scope_domain(Tx) + legacy_dom
+            txs = Tx.search(legacy_dom)
             count_legacy = len(txs)
             used_legacy = True
     
@@ -1639,6 +1760,52 @@ class FacturaUI(models.Model):
         )
     
         # 3) Neutralizar impacto en estado de cuenta (sin borrar)
+        self._tx_neutralize(txs)
+        self._logger.info("CANCEL TX | disabled/neutralized=%s", len(txs))
+
+
+
+
+    def _tx_scope_domain(self, Tx):
+        """Acota la búsqueda de transacciones propias a sucursal, empresa y tipo del documento."""
+        self.ensure_one()
+        dom = []
+        if 'sucursal_id' in Tx._fields and self.sucursal_id:
+            dom.append(('sucursal_id', '=', self.sucursal_id.id))
+        if 'empresa_id_helper' in Tx._fields:
+            dom.append(('empresa_id_helper', '=', self.empresa_id.id))
+        if 'tipo' in Tx._fields:
+            if self.tipo == 'P':
+                dom.append(('tipo', '=', '11'))
+            elif self.tipo == 'E':
+                dom.append(('tipo', '=', '6' if (self.egreso_tipo or '') == 'dev' else '10'))
+        return dom
+
+    @api.model
+    def _tx_own_domain(self, factura_ids, tokens):
+        """Transacciones de las facturas: por factura_id o, si aún no se ligaron (backfill
+        pendiente), por token en la referencia."""
+        return ['|', ('factura_id', 'in', list(factura_ids)),
+                '&', ('factura_id', '=', False),
+                OR([[('referencia', 'ilike', t)] for t in tokens])]
+
+    def _tx_legacy_refs(self):
+        """Referencias con que se creaban las transacciones antes del token [FUI#id]."""
+        self.ensure_one()
+        refs = []
+        if self.move_id and getattr(self.move_id, 'name', False):
+            refs.append(self.move_id.name)
+            refs.append('Pago a factura %s' % self.move_id.name)
+        if (self.uuid or '').strip():
+            refs.append(self.uuid)
+        return refs
+
+    @api.model
+    def _tx_neutralize(self, txs):
+        """Quita el efecto en estado de cuenta de `txs` (sin borrar) con un solo write."""
+        if not txs:
+            return
+        Tx = txs.browse()
         neutral_vals = {}
         # a) Desactivar o marcar como canceladas
         if 'active' in Tx._fields:
@@ -1684,10 +1851,6 @@ class FacturaUI(models.Model):
         except Exception:
             pass
         
-        self._logger.info("CANCEL TX | disabled/neutralized=%s", len(txs))
-
-
-
 
     def _release_sales_after_cancel(self):
         """Pone ventas ligadas en estado facturable y limpia vínculos mínimos."""
@@ -1714,6 +1877,196 @@ class FacturaUI(models.Model):
             ventas.write(vals)
         except Exception as e:
             self._logger.warning("No se pudo actualizar ventas tras cancelación: %s", e)
+
+    def _disable_own_transactions_many(self):
+        """Versión por lote de _disable_own_transactions: una búsqueda por token para todas las
+        facturas, una búsqueda legacy para las que no traían token y un solo write.
+        Regresa {factura_id: número de transacciones neutralizadas}."""
+        try:
+            Tx = self.env['transacciones.transaccion'].sudo()
+        except KeyError:
+            return {}
+        if not self:
+            return {}
+
+        def _in_scope(fac, tx):
+            for fname, op, value in fac._tx_scope_domain(Tx):
+                cur = tx[fname]
+                if (cur.id if isinstance(cur, models.BaseModel) else cur) != value:
+                    return False
+            return True
+
+        # 1) factura_id / token [FUI#id]: una búsqueda para todo el lote, se reparte en Python
+        by_fac = {f.id: Tx.browse() for f in self}
+        own = self._tx_own_domain(self.ids, [f._own_ref_token() for f in self])
+        for tx in Tx.search(own):
+            if tx.factura_id.id in by_fac:
+                by_fac[tx.factura_id.id] |= tx
+                continue
+            for fid in _FUI_TOKEN_RE.findall(tx.referencia or ''):
+                if int(fid) in by_fac:
+                    by_fac[int(fid)] |= tx
+        for fac in self:
+            scoped = by_fac[fac.id].filtered(lambda t: _in_scope(fac, t))
+            if scoped:
+                by_fac[fac.id] = scoped
+
+        # 2) Fallback LEGACY para las que no traían token
+        legacy = self.filtered(lambda f: not by_fac[f.id])
+        refs = {f.id: [r.lower() for r in f._tx_legacy_refs()] for f in legacy}
+        all_refs = sorted({r for rs in refs.values() for r in rs})
+        if all_refs:
+            legacy_dom = OR([[('referencia', 'ilike', r)] for r in all_refs])
+            cand = Tx.search(legacy_dom)
+            for fac in legacy:
+                by_fac[fac.id] = cand.filtered(
+                    lambda t: _in_scope(fac, t)
+                    and any(r in (t.referencia or '').lower() for r in refs[fac.id]))
+
+        # 3) Neutralizar todo en un solo write
+        txs = Tx.browse()
+        for found in by_fac.values():
+            txs |= found
+        self._tx_neutralize(txs)
+        self._logger.info("CANCEL TX LOTE | facturas=%s legacy=%s disabled/neutralized=%s",
+                          len(self), len(legacy), len(txs))
+        return {fid: len(found) for fid, found in by_fac.items()}
+
+    # Cancelación por lote (cierre de mes). Igual que action_cancel pero:
+    #   - Valida todas las facturas y sigue con las válidas (las demás quedan en el resultado).
+    #   - Cancela primero los E/P y después los Ingresos, para que un Ingreso cuyos hijos van
+    #     en el mismo lote pase la validación de hijos vigentes.
+    #   - Las llamadas al PAC van en paralelo con límite de tasa (engine.cancel_cfdi_many).
+    #   - Transacciones, asientos, ventas y estado se escriben por conjunto.
+    # Con continue_on_pac_error=True, un fallo del PAC no impide la cancelación interna
+    # (como action_cancel); por default la factura se queda como estaba.
+    # Regresa [{'factura_id', 'uuid', 'status', 'pac_status', 'message', 'elapsed'}] con
+    # status en: canceled (PAC + interno), local (sólo interno), pac_only (el PAC canceló pero
+    # falló la cancelación interna), pac_error, invalid, error.
+    # Todo corre en la transacción actual: para lotes grandes usar facturas.cancel.job, que
+    # confirma el resultado del PAC por bloque antes de los efectos internos.
+    def _cancel_batch(self, motivo='02', continue_on_pac_error=False):
+        results = {f.id: {'factura_id': f.id, 'uuid': f.uuid or '', 'status': 'invalid',
+                          'pac_status': False, 'message': '', 'elapsed': 0.0} for f in self}
+        for group in (self.filtered(lambda f: f.tipo in ('E', 'P')),
+                      self.filtered(lambda f: f.tipo not in ('E', 'P'))):
+            if group:
+                group._cancel_batch_round(results, motivo, continue_on_pac_error)
+        return [results[f.id] for f in self]
+
+    def _cancel_batch_round(self, results, motivo, continue_on_pac_error):
+        todo = self._cancel_batch_pac(results, motivo, continue_on_pac_error)
+        if todo:
+            todo._cancel_batch_local(results)
+
+    # Pasos 1-2 del lote: validaciones y PAC. Deja en `results` el status 'canceled' (PAC ok)
+    # o 'local' (sin PAC) para las que siguen a la cancelación interna y las regresa.
+    def _cancel_batch_pac(self, results, motivo, continue_on_pac_error):
+        # 1) Validaciones (ventana de 30 días e hijos vigentes)
+        valid = self.browse()
+        for fac in self:
+            res = results[fac.id]
+            if fac.state not in ('ready', 'stamped'):
+                res['message'] = _('La factura no está lista ni timbrada (estado: %s).') % fac.state
+                continue
+            try:
+                fac._ensure_cancel_window_30d()
+                fac._check_no_children_before_cancel()
+            except (ValidationError, UserError) as e:
+                res['message'] = str(e)
+                continue
+            valid |= fac
+
+        # 2) PAC en paralelo para las timbradas
+        to_pac = valid.filtered(lambda f: f.state == 'stamped' and (f.uuid or '').strip())
+        pac = {}
+        if to_pac:
+            pac = self.env['mx.cfdi.engine'].cancel_cfdi_many([{
+                'uuid': f.uuid,
+                'empresa_id': f.empresa_id.id,
+                'origin_model': 'account.move' if f.move_id else self._name,
+                'origin_id': f.move_id.id if f.move_id else f.id,
+                'motivo': motivo or '02',
+            } for f in to_pac])
+        todo = self.browse()
+        for fac in valid:
+            res = results[fac.id]
+            if fac not in to_pac:
+                res['status'] = 'local'
+                todo |= fac
+                continue
+            out = pac.get(fac.uuid) or {'ok': False, 'error': _('Sin respuesta del PAC.')}
+            res['pac_status'] = out.get('status') or False
+            res['elapsed'] = out.get('elapsed') or 0.0
+            if out.get('ok'):
+                res['status'] = 'canceled'
+                todo |= fac
+            else:
+                res['message'] = out.get('error') or ''
+                if continue_on_pac_error:
+                    res['status'] = 'local'
+                    todo |= fac
+                else:
+                    res['status'] = 'pac_error'
+        return todo
+
+    # Pasos 3-5 del lote: cancelación interna de las facturas que dejó _cancel_batch_pac.
+    # Si falla una factura que el PAC ya canceló, queda como 'pac_only' (conserva pac_status):
+    # el SAT la tiene cancelada y falta la parte interna.
+    def _cancel_batch_local(self, results):
+        # 3) Efectos por factura que no tienen forma por conjunto (stock, contadores en origen)
+        done = self.browse()
+        for fac in self:
+            try:
+                with self.env.cr.savepoint():
+                    fac._revert_stock_on_cancel()
+                    fac._restore_origin_on_cancel(refresh=False)
+                done |= fac
+            except Exception as e:
+                res = results[fac.id]
+                if res['status'] == 'canceled':
+                    res.update(status='pac_only', message=_(
+                        'El PAC canceló el CFDI pero falló la cancelación interna: %s') % (str(e) or repr(e)))
+                else:
+                    res.update(status='error', message=str(e) or repr(e))
+        if not done:
+            return
+        stamped = done.filtered(lambda f: f.state == 'stamped')
+
+        # 4) Efectos por conjunto
+        try:
+            with self.env.cr.savepoint():
+                stamped.filtered(lambda f: f.tipo in ('E', 'P'))._disable_own_transactions_many()
+        except Exception as e:
+            self._logger.warning("CANCEL LOTE | no se pudieron deshabilitar transacciones: %s", e)
+        done.origin_factura_id._refresh_after_child_cancel()
+        moves = done.move_id.filtered(lambda m: m.state != 'cancel')
+        try:
+            with self.env.cr.savepoint():
+                moves.button_cancel()
+        except Exception:
+            for fac in done.filtered(lambda f: f.move_id in moves):
+                fac._cancel_account_move()
+        done.write({'state': 'canceled'})
+        try:
+            done.filtered(lambda f: f.tipo == 'I')._release_sales_after_cancel()
+        except Exception as e:
+            self._logger.warning("No se pudieron liberar ventas: %s", e)
+
+        # 5) Bitácora por factura
+        for fac in done:
+            res = results[fac.id]
+            if res['status'] == 'canceled':
+                body = _('CFDI cancelado en PAC (lote). Respuesta: %s') % res['pac_status']
+            elif res['message']:
+                body = _('Cancelación interna (lote); el PAC falló: %s') % res['message']
+            else:
+                body = _('Cancelación interna (lote).')
+            fac.message_post(body=body)
+        self._logger.info(
+            "CFDI FLOW | CANCELED LOTE | facturas=%s ok_pac=%s",
+            len(done), sum(1 for f in done if results[f.id]['status'] == 'canceled'))
+
     # ======================== /Cancel Helpers ========================
 
 
@@ -1781,65 +2134,17 @@ class FacturaUI(models.Model):
             # raise
             self._logger.warning("PAC cancel falló (se continuará con cancelación interna): %s", e)
         # 4) Revertir stock según tipo
-        Stock = self.env['stock.sucursal.producto'].sudo()
-        if self.state == 'stamped':
-            if self.tipo == 'I':
-                # Regresar lo que se descontó al timbrar
-                for l in self.line_ids:
-                    if not l.producto_id or self._is_service_line(l):
-                        continue
-                    qty = l.cantidad or 0.0
-                    if qty > 0:
-                        Stock.add_stock(self.sucursal_id, l.producto_id, qty)
-            elif self.tipo == 'E':
-                # Si fue devolución, retirar lo que se había regresado
-                if (self.egreso_tipo or '') == 'dev':
-                    for l in self.line_ids:
-                        if not l.producto_id or self._is_service_line(l):
-                            continue
-                        qty = l.cantidad or 0.0
-                        if qty > 0:
-                            Stock.remove_stock(self.sucursal_id, l.producto_id, qty)
-                # Además: deshabilitar transacciones creadas por este egreso
-                try:
-                    self._disable_own_transactions()
-                except Exception as e:
-                    self._logger.warning("No se pudieron deshabilitar transacciones del egreso: %s", e)
-            elif self.tipo == 'P':
-                # Pago: deshabilitar transacción de pago (tipo 11) creada por este registro
-                try:
-                    self._disable_own_transactions()
-                except Exception as e:
-                    self._logger.warning("No se pudieron deshabilitar transacciones del pago: %s", e)
-
-        # --- NUEVO: reponer contadores en la factura origen ---
-        origin = self.origin_factura_id
-        if origin:
+        self._revert_stock_on_cancel()
+        if self.state == 'stamped' and self.tipo in ('E', 'P'):
+            # Egreso/Pago: deshabilitar transacciones creadas por este registro
             try:
-                if self.tipo == 'P':
-                    self._restore_amount_counters_on_origin(self.pago_importe)
-                elif self.tipo == 'E':
-                    if (self.egreso_tipo or '') == 'dev':
-                        self._restore_dev_counters_on_origin()
-                    else:  # 'nc'
-                        self._restore_amount_counters_on_origin(self.importe_total)
+                self._disable_own_transactions()
             except Exception as e:
-                self._logger.warning("No se pudieron restaurar contadores en origen: %s", e)
-    
-            # Forzar recompute de saldo en la origen (como haces al timbrar)
-            try:
-                origin.write({'state': origin.state})
-            except Exception:
-                pass
-            # (opcional) refresca ventas ligadas
-            ventas_orig = origin.venta_ids | self.env['ventas.venta'].browse(
-                list({l.sale_id.id for l in origin.line_ids if l.sale_id})
-            )
-            if ventas_orig:
-                try:
-                    ventas_orig.write({'state': ventas_orig[0].state})
-                except Exception:
-                    pass
+                self._logger.warning("No se pudieron deshabilitar transacciones del %s: %s",
+                                     'egreso' if self.tipo == 'E' else 'pago', e)
+
+        # --- reponer contadores en la factura origen ---
+        self._restore_origin_on_cancel()
 
         # 5) Cancelar el asiento contable si existe (I/E)
         try:
@@ -1924,8 +2229,28 @@ class FacturaUI(models.Model):
         related='origin_factura_id.move_id', store=True, readonly=True
     )
 
+    # Egresos y Pagos que apuntan a esta factura como origen
+    credit_child_ids = fields.One2many('facturas.factura', 'origin_factura_id', string='Egresos/Pagos aplicados')
+    applied_credits_total = fields.Monetary(
+        string='Créditos aplicados', currency_field='currency_id',
+        compute='_compute_applied_credits_total', store=True,
+        help="Suma de Egresos (NC/DEV) y Pagos timbrados que apuntan a esta factura.",
+    )
+
+    # Se recalcula sólo en los orígenes cuyos hijos se timbran, cancelan, cambian o se eliminan.
+    @api.depends('credit_child_ids.state', 'credit_child_ids.tipo',
+                 'credit_child_ids.pago_importe', 'credit_child_ids.importe_total')
+    def _compute_applied_credits_total(self):
+        for r in self:
+            total = 0.0
+            for e in r.credit_child_ids:
+                if e.state != 'stamped' or e.tipo not in ('E', 'P'):
+                    continue
+                total += (e.pago_importe or 0.0) if e.tipo == 'P' else (e.importe_total or 0.0)
+            r.applied_credits_total = total
+
     # Calcula importes por encabezado (suma de líneas) y, para I/E con PPD, el saldo = importe total.
-    @api.depends('line_ids.total', 'metodo', 'tipo', 'state', 'pago_importe')
+    @api.depends('line_ids.total', 'metodo', 'tipo', 'state', 'pago_importe', 'applied_credits_total')
     def _compute_totales(self):
         for r in self:
             total_lineas = sum((l.total or 0.0) for l in r.line_ids)
@@ -1937,7 +2262,7 @@ class FacturaUI(models.Model):
                 base = r.importe_total if (r.metodo or '').upper() == 'PPD' else 0.0
                 # Restar créditos aplicados (E y P) SIEMPRE, también en PUE (puede quedar negativo)
                 try:
-                    base -= (r._applied_credits_total() or 0.0)
+                    base -= (r.applied_credits_total or 0.0)
                 except Exception:
                     # no rompas el compute si algo falla, deja el base
                     pass
@@ -1952,19 +2277,63 @@ class FacturaUI(models.Model):
     def _applied_credits_total(self):
         """Total de Egresos (NC/DEV) y Pagos timbrados/aplicados que impactan a esta factura."""
         self.ensure_one()
-        E = self.env['facturas.factura']
-        aplicados = E.search([
-            ('tipo', 'in', ['E', 'P']),
-            ('state', '=', 'stamped'),
-            ('origin_factura_id', '=', self.id),
-        ])
-        total = 0.0
-        for e in aplicados:
-            if e.tipo == 'P':
-                total += (e.pago_importe or 0.0)
-            else:
-                total += (e.importe_total or 0.0)
-        return total
+        return self.applied_credits_total or 0.0
+
+    def _applied_credits_totals(self):
+        """{factura_id: total} de E/P timbrados aplicados a estas facturas, en una sola consulta."""
+        totals = {fid: 0.0 for fid in self.ids if isinstance(fid, int)}
+        if not totals:
+            return totals
+        groups = self.env['facturas.factura']._read_group(
+            [('tipo', 'in', ['E', 'P']), ('state', '=', 'stamped'), ('origin_factura_id', 'in', list(totals))],
+            ['origin_factura_id', 'tipo'],
+            ['pago_importe:sum', 'importe_total:sum'],
+        )
+        for origin, tipo, pago_importe, importe_total in groups:
+            totals[origin.id] += (pago_importe if tipo == 'P' else importe_total) or 0.0
+        return totals
+
+    @api.model
+    def _check_applied_credits_consistency(self, fix=False, batch_size=1000):
+        """Recalcula en bloque `applied_credits_total` desde la BD y reporta diferencias.
+
+        Regresa la lista de (factura_id, almacenado, recalculado). Con `fix=True` corrige
+        el campo almacenado (y con ello el saldo) de las facturas con diferencias.
+        """
+        drift = []
+        ids = self.search([('tipo', '=', 'I')], order='id').ids
+        for i in range(0, len(ids), batch_size):
+            batch = self.browse(ids[i:i + batch_size])
+            totals = batch._applied_credits_totals()
+            for r in batch:
+                stored = r.applied_credits_total or 0.0
+                expected = totals.get(r.id, 0.0)
+                if abs(stored - expected) > 0.005:
+                    drift.append((r.id, stored, expected))
+        if drift:
+            self._logger.warning("applied_credits_total con diferencias en %s facturas: %s", len(drift), drift[:50])
+            if fix:
+                to_fix = self.browse([d[0] for d in drift])
+                self.env.add_to_compute(self._fields['applied_credits_total'], to_fix)
+                to_fix.flush_recordset(['applied_credits_total', 'saldo'])
+        else:
+            self._logger.info("applied_credits_total consistente en %s facturas.", len(ids))
+        return drift
+
+    def action_check_applied_credits(self):
+        """Acción de servidor: revisa (y corrige) los créditos aplicados almacenados."""
+        drift = self._check_applied_credits_consistency(fix=True)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Créditos aplicados'),
+                'message': (_('%s facturas con diferencias; se corrigieron.') % len(drift)) if drift
+                           else _('Sin diferencias.'),
+                'type': 'warning' if drift else 'success',
+                'sticky': bool(drift),
+            },
+        }
 
 
 
@@ -2376,39 +2745,34 @@ class FacturaUILine(models.Model):
                 r.cliente_id = r.factura_id.cliente_id.id
         return res
     
-    # Mapea la línea UI a dicts “concepto” para el engine CFDI (clave SAT, unidad, descripción,
-    # cantidades, valores, objeto de impuesto y tasas).
-    def _to_cfdi_conceptos(self):
-        conceptos = []
+    # Mapea las líneas UI a conceptos para el engine CFDI (clave SAT, unidad, descripción,
+    # cantidades, valores, objeto de impuesto y tasas), en columnas
+    # (mx_cfdi_core.services.cfdi_taxes.Conceptos): el engine calcula los impuestos agrupados
+    # sin convertir dict por dict.
+    def _to_cfdi_columnas(self):
+        cols = {name: [] for name in Conceptos.COLUMNS}
         for l in self:
-            iva_factor = None
-            # ejemplo: si iva_ratio == 0 puedes decidir basado en producto o UI
-            if l.iva_ratio == 0.0:
-                # setea 'Exento' o 'Tasa' según tu regla/UI
-                iva_factor = getattr(l.producto_id, 'iva_factor', None)  # o desde la línea
-
-            clave_sat = (getattr(l.producto_id.codigosat, 'code', '') or '').strip()
-            clave_unidad = (getattr(l.producto_id, 'unidad', '') or '').strip()
+            prod = l.producto_id
+            iva_factor = getattr(prod, 'iva_factor', None) if l.iva_ratio == 0.0 else None
+            clave_sat = (getattr(prod.codigosat, 'code', '') or '').strip()
+            clave_unidad = (getattr(prod, 'unidad', '') or '').strip()
             if not clave_sat:
-                raise UserError(_("Línea %s: el producto '%s' no tiene Código SAT (campo 'codigosat').") % (l.id, l.producto_id.display_name))
+                raise UserError(_("Línea %s: el producto '%s' no tiene Código SAT (campo 'codigosat').") % (l.id, prod.display_name))
             if not clave_unidad:
-                raise UserError(_("Línea %s: el producto '%s' no tiene ClaveUnidad (campo 'unidad').") % (l.id, l.producto_id.display_name))
-
-
-            conceptos.append({
-                'clave_sat': (getattr(l.producto_id.codigosat, 'code', '') or '').strip(),
-                'clave_unidad': (getattr(l.producto_id, 'unidad', '') or '').strip(),
-                'no_identificacion': getattr(l.producto_id, 'codigo', None) or getattr(l.producto_id, 'default_code', None) or str(l.producto_id.id),
-                'descripcion': l.descripcion or (getattr(l.producto_id, 'name', None) or l.producto_id.display_name or 'Producto'),
-                'cantidad': l.cantidad or 1.0,
-                'valor_unitario': l.precio or 0.0,
-                'importe': round((l.cantidad or 0.0)*(l.precio or 0.0), 2),
-                'objeto_imp': '02' if (l.iva_ratio or l.ieps_ratio or iva_factor) else '01',
-                'iva': float(l.iva_ratio or 0.0),
-                'ieps': float(l.ieps_ratio or 0.0),
-                'iva_factor': iva_factor,   # 'Tasa' o 'Exento' si lo conoces
-            })
-        return conceptos
+                raise UserError(_("Línea %s: el producto '%s' no tiene ClaveUnidad (campo 'unidad').") % (l.id, prod.display_name))
+            iva, ieps = float(l.iva_ratio or 0.0), float(l.ieps_ratio or 0.0)
+            cols['qty'].append(float(l.cantidad or 1.0))
+            cols['vu'].append(float(l.precio or 0.0))
+            cols['iva'].append(iva)
+            cols['ieps'].append(ieps)
+            cols['iva_factor'].append((iva_factor or '').title())
+            cols['objeto_imp'].append('02' if (iva or ieps or iva_factor) else '01')
+            cols['clave_sat'].append(clave_sat)
+            cols['clave_unidad'].append(clave_unidad)
+            cols['no_ident'].append(str(getattr(prod, 'codigo', None) or getattr(prod, 'default_code', None) or prod.id))
+            cols['descripcion'].append(l.descripcion or (getattr(prod, 'name', None) or prod.display_name or 'Producto'))
+            cols['has_vu'].append(True)
+        return Conceptos(**cols)
 
     # Tras timbrar: crea el vínculo ventas.transaccion.invoice.link por cada línea con transacción,
     # valida concurrencia (no sobre-facturar) y recomputa estado de facturación si aplica.
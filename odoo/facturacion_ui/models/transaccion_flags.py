@@ -1,5 +1,7 @@
 # models/transaccion_flags.py
 from odoo import models, fields, api
+import logging
+_logger = logging.getLogger(__name__)
 
 class TxInvoiceLink(models.Model):
     _name = 'ventas.transaccion.invoice.link'
@@ -32,6 +34,13 @@ class TxInvoiceLink(models.Model):
 class Transaccion(models.Model):
     _inherit = 'transacciones.transaccion'
 
+    # Factura (FacturaUI) que generó la transacción (Egresos/Pagos). La cancelación busca por
+    # aquí; las transacciones anteriores se ligan con el cron de backfill a partir del token
+    # [FUI#id] de la referencia. El índice trigram acelera los ilike de referencias legacy.
+    factura_id = fields.Many2one('facturas.factura', string='Factura origen', readonly=True,
+                                 index='btree_not_null', ondelete='set null')
+    referencia = fields.Char(index='trigram')
+
     link_ids = fields.One2many('ventas.transaccion.invoice.link', 'transaccion_id', string='Facturas ligadas')
     qty_invoiced = fields.Float(compute='_compute_inv_stats', store=True, string="Cantidad facturada")
     qty_available = fields.Float(compute='_compute_inv_stats', store=True, string="Cantidad disponible")
@@ -71,6 +80,43 @@ class Transaccion(models.Model):
         """Método auxiliar para forzar recálculo"""
         self._compute_inv_stats()
 
+    # Cron: liga factura_id en transacciones anteriores leyendo el token [FUI#id] de la
+    # referencia. Avanza por id desde facturacion_ui.tx_factura_backfill_last_id (así las
+    # referencias con token de facturas ya borradas no se vuelven a leer) en lotes de
+    # facturacion_ui.tx_factura_backfill_batch (default 5000), con commit por lote.
+    @api.model
+    def _cron_backfill_factura_id(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        batch = max(1, int(ICP.get_param('facturacion_ui.tx_factura_backfill_batch', 5000) or 5000))
+        last_id = int(ICP.get_param('facturacion_ui.tx_factura_backfill_last_id', 0) or 0)
+        cr = self.env.cr
+        linked = 0
+        while True:
+            cr.execute("""
+                SELECT id, substring(referencia from '(?i)\\[FUI#([0-9]+)\\]')::int
+                  FROM transacciones_transaccion
+                 WHERE id > %s AND factura_id IS NULL AND referencia ILIKE %s
+                 ORDER BY id
+                 LIMIT %s
+            """, [last_id, '%[FUI#%', batch])
+            rows = cr.fetchall()
+            if not rows:
+                break
+            cr.execute("""
+                UPDATE transacciones_transaccion t
+                   SET factura_id = v.factura_id
+                  FROM unnest(%s::int[], %s::int[]) AS v(id, factura_id)
+                  JOIN facturas_factura f ON f.id = v.factura_id
+                 WHERE t.id = v.id
+            """, [[r[0] for r in rows], [r[1] for r in rows]])
+            linked += cr.rowcount
+            last_id = rows[-1][0]
+            ICP.set_param('facturacion_ui.tx_factura_backfill_last_id', str(last_id))
+            cr.commit()
+        self.invalidate_model(['factura_id'])
+        _logger.info("TX BACKFILL | factura_id ligadas=%s last_id=%s", linked, last_id)
+        return linked
+
 
 class Venta(models.Model):
     _inherit = 'ventas.venta'
@@ -1,3 +1,5 @@
 from . import add_from_sales
 from . import add_from_lines
 from . import add_from_charges
+from . import bulk_invoice
+from . import bulk_cancel
@@ -88,40 +88,47 @@ class WizAddSales(models.TransientModel):
         created_lines = []
         for v in self.venta_ids:
             venta_cli = self._to_cliente(getattr(v, 'cliente', False)) or fac.cliente_id
-            
-            for ln in getattr(v, 'detalle', []):
-                # Verificar estado de facturación de la transacción
-                if getattr(ln, 'invoice_status', '') == 'full':
-                    continue
-                    
-                # Calcular cantidad disponible
-                qty_available = getattr(ln, 'qty_available', 0.0)
-                if not qty_available:
-                    qty_available = (getattr(ln, 'cantidad', 0.0) or 0.0) - (getattr(ln, 'qty_invoiced', 0.0) or 0.0)
-                
-                if qty_available <= 0:
-                    continue
-
-                new_line = fac.line_ids.create({
-                    'factura_id': fac.id,
-                    'empresa_id': v.empresa_id.id,
-                    'cliente_id': venta_cli.id if venta_cli else False,
-                    'line_type': 'sale',
-                    'source_model': 'transacciones.transaccion',
-                    'source_id': ln.id,
-                    'sale_id': v.id,
-                    'transaccion_id': ln.id,
-                    'producto_id': ln.producto_id.id,
-                    'descripcion': ln.producto_id.name,
-                    'cantidad': qty_available,  # Solo cantidad disponible
-                    'precio': ln.precio or 0.0,
-                    'iva_ratio': ln.iva or 0.0,
-                    'ieps_ratio': ln.ieps or 0.0,
-                    'qty_to_invoice': qty_available,
-                })
-                created_lines.append(new_line)
+            for vals in self._prepare_sale_line_vals(fac, v, venta_cli):
+                created_lines.append(fac.line_ids.create(vals))
 
         if not created_lines:
             raise ValidationError(_('No se agregó ninguna línea. Verifica que haya cantidades disponibles para facturar.'))
 
-        return {'type': 'ir.actions.act_window_close'}
\ No newline at end of file
+        return {'type': 'ir.actions.act_window_close'}
+
+    # Valores de líneas de factura para lo pendiente de facturar de una venta
+    # (también lo usa el wizard de facturación masiva).
+    @api.model
+    def _prepare_sale_line_vals(self, fac, v, venta_cli):
+        res = []
+        for ln in getattr(v, 'detalle', []):
+            # Verificar estado de facturación de la transacción
+            if getattr(ln, 'invoice_status', '') == 'full':
+                continue
+
+            # Calcular cantidad disponible
+            qty_available = getattr(ln, 'qty_available', 0.0)
+            if not qty_available:
+                qty_available = (getattr(ln, 'cantidad', 0.0) or 0.0) - (getattr(ln, 'qty_invoiced', 0.0) or 0.0)
+
+            if qty_available <= 0:
+                continue
+
+            res.append({
+                'factura_id': fac.id,
+                'empresa_id': v.empresa_id.id,
+                'cliente_id': venta_cli.id if venta_cli else False,
+                'line_type': 'sale',
+                'source_model': 'transacciones.transaccion',
+                'source_id': ln.id,
+                'sale_id': v.id,
+                'transaccion_id': ln.id,
+                'producto_id': ln.producto_id.id,
+                'descripcion': ln.producto_id.name,
+                'cantidad': qty_available,  # Solo cantidad disponible
+                'precio': ln.precio or 0.0,
+                'iva_ratio': ln.iva or 0.0,
+                'ieps_ratio': ln.ieps or 0.0,
+                'qty_to_invoice': qty_available,
+            })
+        return res
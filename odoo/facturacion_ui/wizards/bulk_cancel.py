@@ -0,0 +1,49 @@
+# wizards/bulk_cancel.py
+# Cancelación masiva de CFDI (limpieza de cierre de mes). El resultado auditable por UUID
+# queda en el lote (models/cancel_job.py).
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+CANCEL_REASONS = [
+    ('01', '01 - Comprobante emitido con errores con relación'),
+    ('02', '02 - Comprobante emitido con errores sin relación'),
+    ('03', '03 - No se llevó a cabo la operación'),
+    ('04', '04 - Operación nominativa relacionada en una factura global'),
+]
+
+
+class WizBulkCancel(models.TransientModel):
+    _name = 'facturas.wiz.bulk.cancel'
+    _description = 'Cancelación masiva de facturas'
+
+    factura_ids = fields.Many2many('facturas.factura', string='Facturas',
+                                   domain="[('state', 'in', ('ready', 'stamped'))]")
+    motivo = fields.Selection(CANCEL_REASONS, string='Motivo SAT', default='02', required=True)
+    continue_on_pac_error = fields.Boolean(
+        string='Cancelar internamente aunque falle el PAC',
+        help='Si el PAC rechaza la cancelación, la factura se cancela de todos modos en el sistema '
+             '(como el botón Cancelar). Si no se marca, la factura se queda como estaba.')
+
+    @api.model
+    def default_get(self, fields_list):
+        vals = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'facturas.factura' and 'factura_ids' in fields_list:
+            ids = self.env.context.get('active_ids') or []
+            vals['factura_ids'] = [(6, 0, ids)]
+        return vals
+
+    # Encola el lote (facturas.cancel.job) y abre su seguimiento; el cron lo procesa por bloques.
+    def action_cancel(self):
+        self.ensure_one()
+        if not self.factura_ids:
+            raise UserError(_('Selecciona al menos una factura.'))
+        job = self.env['facturas.cancel.job']._create_for(
+            self.factura_ids, motivo=self.motivo, continue_on_pac_error=self.continue_on_pac_error)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Cancelación masiva'),
+            'res_model': 'facturas.cancel.job',
+            'res_id': job.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
@@ -0,0 +1,237 @@
+# wizards/bulk_invoice.py
+# Facturación masiva de cierre de día: una factura por venta confirmada pendiente de facturar.
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import calendar
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class WizBulkInvoice(models.TransientModel):
+    _name = 'facturas.wiz.bulk.invoice'
+    _description = 'Facturación masiva de ventas'
+
+    # Filtro
+    empresa_id  = fields.Many2one('empresas.empresa', string='Empresa', required=True)
+    sucursal_id = fields.Many2one('sucursales.sucursal', string='Sucursal',
+                                  domain="[('empresa', '=', empresa_id)]")
+    fecha_desde = fields.Date(string='Desde', default=fields.Date.context_today)
+    fecha_hasta = fields.Date(string='Hasta', default=fields.Date.context_today)
+    venta_ids   = fields.Many2many('ventas.venta', string='Ventas')
+    # Encabezado común
+    uso_cfdi = fields.Selection(selection=lambda s: s.env['facturas.factura']._fields['uso_cfdi'].selection,
+                                string='Uso CFDI', default='G03', required=True)
+    mode = fields.Selection([
+        ('queue', 'En segundo plano (cola de timbrado)'),
+        ('now', 'Inmediato (en esta petición)'),
+    ], string='Timbrado', default='queue', required=True)
+    # Resultado
+    state = fields.Selection([('draft', 'Selección'), ('done', 'Enviado')], default='draft')
+    result_ids = fields.One2many('facturas.wiz.bulk.invoice.result', 'wizard_id', string='Resultado')
+    started_at = fields.Float(string='Inicio (epoch)')
+    build_seconds = fields.Float(string='Armado (seg)', readonly=True)
+    stamped_count = fields.Integer(compute='_compute_progress', string='Timbradas')
+    error_count = fields.Integer(compute='_compute_progress', string='Con error')
+    pending_count = fields.Integer(compute='_compute_progress', string='Pendientes')
+    invoices_per_minute = fields.Float(compute='_compute_progress', string='Facturas / minuto', digits=(16, 1))
+
+    def _sale_domain(self):
+        self.ensure_one()
+        domain = [
+            ('state', '=', 'confirmed'),
+            ('invoice_status2', 'in', ('none', 'partial')),
+            ('empresa_id', '=', self.empresa_id.id),
+        ]
+        if self.sucursal_id:
+            domain.append(('sucursal_id', '=', self.sucursal_id.id))
+        if self.fecha_desde:
+            domain.append(('fecha', '>=', self.fecha_desde))
+        if self.fecha_hasta:
+            domain.append(('fecha', '<=', self.fecha_hasta))
+        return domain
+
+    def _reopen(self):
+        return {'type': 'ir.actions.act_window', 'res_model': self._name, 'res_id': self.id,
+                'view_mode': 'form', 'target': 'new'}
+
+    def action_load(self):
+        self.ensure_one()
+        self.venta_ids = self.env['ventas.venta'].search(self._sale_domain(), order='id')
+        return self._reopen()
+
+    # Arma en lote encabezados y líneas (una factura por venta) y los manda a timbrar.
+    # El modo inmediato timbra en esta petición: se limita a facturacion_ui.bulk_invoice_now_max
+    # ventas (default 20); lotes mayores van por la cola de timbrado.
+    def action_invoice(self):
+        self.ensure_one()
+        ventas = self.venta_ids.filtered(lambda v: v.state == 'confirmed'
+                                         and v.invoice_status2 in ('none', 'partial'))
+        if not ventas:
+            raise UserError(_('No hay ventas confirmadas pendientes de facturar en la selección.'))
+        if self.mode == 'now':
+            cap = int(self.env['ir.config_parameter'].sudo().get_param(
+                'facturacion_ui.bulk_invoice_now_max', 20) or 20)
+            if len(ventas) > cap:
+                raise UserError(_('El timbrado inmediato admite hasta %(cap)s ventas (seleccionaste %(n)s). '
+                                  'Usa el timbrado en segundo plano.') % {'cap': cap, 'n': len(ventas)})
+        self._build_invoices(ventas)
+        if self.mode == 'queue':
+            self._enqueue_invoices()
+        else:
+            self._stamp_invoices_now()
+        return self._reopen()
+
+    # Crea facturas y líneas por lote. Las ventas sin líneas facturables (todo facturado o sin
+    # cantidad disponible) no generan factura: quedan en el resultado con su motivo.
+    def _build_invoices(self, ventas):
+        t0 = time.time()
+        AddSales = self.env['facturas.wiz.add.sales']
+        lines_by_sale = {v.id: AddSales._prepare_sale_line_vals(self.env['facturas.factura'], v, v.cliente)
+                         for v in ventas}
+        empty = ventas.filtered(lambda v: not lines_by_sale[v.id])
+        ventas -= empty
+
+        facturas = self.env['facturas.factura'].create([{
+            'empresa_id': v.empresa_id.id,
+            'sucursal_id': v.sucursal_id.id,
+            'cliente_id': v.cliente.id,
+            'tipo': 'I',
+            'uso_cfdi': self.uso_cfdi,
+            'metodo': v.metododepago or 'PPD',
+            'forma': (v.formadepago or '01') if v.metododepago == 'PUE' else '99',
+            'venta_ids': [(6, 0, v.ids)],
+        } for v in ventas])
+
+        line_vals = []
+        for fac, v in zip(facturas, ventas):
+            line_vals += [dict(vals, factura_id=fac.id) for vals in lines_by_sale[v.id]]
+        if line_vals:
+            self.env['facturas.factura.line'].create(line_vals)
+
+        results = [{'venta_id': v.id, 'factura_id': fac.id} for fac, v in zip(facturas, ventas)]
+        results += [{'venta_id': v.id, 'error': _('La venta no tiene líneas pendientes de facturar.')}
+                    for v in empty]
+        self.write({'result_ids': [(0, 0, r) for r in results], 'started_at': t0,
+                    'build_seconds': time.time() - t0, 'state': 'done'})
+        return facturas
+
+    def _enqueue_invoices(self):
+        ready = self.env['facturas.factura']
+        for res in self.result_ids.filtered('factura_id'):
+            try:
+                with self.env.cr.savepoint():
+                    res.factura_id._check_consistency()
+                ready |= res.factura_id
+            except Exception as e:
+                res.error = str(e) or repr(e)
+        ready.action_enqueue_stamp()
+
+    def _stamp_invoices_now(self):
+        # Traza CFDI resuelta una vez para todo el lote
+        trace_cfg = self.env['mx.cfdi.engine']._trace_config()
+        for res in self.result_ids.filtered('factura_id'):
+            try:
+                with self.env.cr.savepoint():
+                    res.factura_id.with_context(cfdi_trace_cfg=trace_cfg).action_build_and_stamp()
+            except Exception as e:
+                res.error = str(e) or repr(e)
+
+    # Benchmark de facturación masiva (armado + timbrado inmediato) contra el proveedor dummy
+    # (mx.cfdi.engine.provider.dummy en Ajustes; no se llama a ningún PAC). Desde `odoo shell`:
+    #     env['facturas.wiz.bulk.invoice']._bench_bulk_invoice(empresa_id=1, n=50)
+    # Toma hasta n ventas confirmadas pendientes de facturar; todo corre en un savepoint que se
+    # revierte (rollback=True). Regresa y loguea: ventas, facturas, sin líneas, errores, segundos
+    # de armado y de timbrado, facturas por minuto y queries por factura.
+    @api.model
+    def _bench_bulk_invoice(self, *, empresa_id, n=50, rollback=True):
+        provider = (self.env['ir.config_parameter'].sudo().get_param('mx_cfdi_engine.provider') or '').strip()
+        if provider != 'mx.cfdi.engine.provider.dummy':
+            raise UserError(_('El benchmark usa el proveedor dummy; está configurado %s.') % (provider or '-'))
+        cr = self.env.cr
+        sp = cr.savepoint(flush=True)
+        try:
+            wiz = self.create({'empresa_id': empresa_id, 'fecha_desde': False, 'fecha_hasta': False,
+                               'mode': 'now'})
+            ventas = self.env['ventas.venta'].search(wiz._sale_domain(), order='id', limit=max(1, int(n)))
+            q0, t0 = cr.sql_log_count, time.monotonic()
+            facturas = wiz._build_invoices(ventas)
+            self.env.flush_all()
+            t1 = time.monotonic()
+            wiz._stamp_invoices_now()
+            self.env.flush_all()
+            t2 = time.monotonic()
+            wiz.invalidate_recordset(['result_ids'])
+            status = wiz.result_ids.mapped('status')
+            report = {
+                'ventas': len(ventas),
+                'facturas': len(facturas),
+                'sin_lineas': len(ventas) - len(facturas),
+                'timbradas': status.count('stamped'),
+                'errores': status.count('error') - (len(ventas) - len(facturas)),
+                'build_s': round(t1 - t0, 2),
+                'stamp_s': round(t2 - t1, 2),
+                'per_minute': round(status.count('stamped') * 60.0 / (t2 - t0), 1) if t2 > t0 else 0.0,
+                'queries_per_invoice': round((cr.sql_log_count - q0) / len(facturas), 1) if facturas else 0.0,
+                'first_error': next((r.error for r in wiz.result_ids if r.factura_id and r.error), ''),
+            }
+        finally:
+            sp.close(rollback=rollback)
+        _logger.info("BULK INVOICE BENCH | %s", report)
+        return report
+
+    def action_refresh(self):
+        return self._reopen()
+
+    def action_open_facturas(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Facturas generadas'),
+            'res_model': 'facturas.factura',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', self.result_ids.factura_id.ids)],
+        }
+
+    # Progreso y rendimiento (facturas timbradas por minuto desde que se lanzó el lote).
+    @api.depends('result_ids.status')
+    def _compute_progress(self):
+        for w in self:
+            status = w.result_ids.mapped('status')
+            w.stamped_count = status.count('stamped')
+            w.error_count = status.count('error')
+            w.pending_count = status.count('pending')
+            end = time.time()
+            if not w.pending_count:
+                # Lote terminado: mide hasta el último timbrado, no hasta ahora
+                done = w.result_ids.filtered(lambda r: r.status == 'stamped').factura_id
+                if done:
+                    end = calendar.timegm(max(done.mapped('write_date')).utctimetuple())
+            elapsed = (end - w.started_at) if w.started_at else 0.0
+            w.invoices_per_minute = (w.stamped_count * 60.0 / elapsed) if elapsed > 0 else 0.0
+
+
+class WizBulkInvoiceResult(models.TransientModel):
+    _name = 'facturas.wiz.bulk.invoice.result'
+    _description = 'Resultado de facturación masiva por venta'
+
+    wizard_id  = fields.Many2one('facturas.wiz.bulk.invoice', required=True, ondelete='cascade')
+    venta_id   = fields.Many2one('ventas.venta', string='Venta', readonly=True)
+    factura_id = fields.Many2one('facturas.factura', string='Factura', readonly=True)
+    uuid       = fields.Char(related='factura_id.uuid', string='UUID')
+    error      = fields.Text(string='Error de armado')
+    status = fields.Selection([('pending', 'Pendiente'), ('stamped', 'Timbrada'), ('error', 'Error')],
+                              compute='_compute_status', string='Estado')
+    message = fields.Text(compute='_compute_status', string='Detalle')
+
+    @api.depends('factura_id.state', 'factura_id.uuid', 'error')
+    def _compute_status(self):
+        for r in self:
+            fac = r.factura_id
+            if fac.state == 'stamped' and fac.uuid:
+                r.status, r.message = 'stamped', fac.uuid
+            elif r.error or fac.stamp_queue_state == 'error':
+                r.status, r.message = 'error', r.error or fac.stamp_queue_error
+            else:
+                r.status, r.message = 'pending', False
@@ -10,7 +10,11 @@
         #"security/ir.model.access.csv",
         "views/res_config_settings_views.xml",
         "views/cfdi_document_views.xml",
+        "views/cfdi_xml_export_views.xml",
         "data/ir_config_parameter.xml",
+        "data/cron_stamp_queue.xml",
+        "data/cron_xml_download.xml",
+        "data/cron_xml_blobs.xml",
     ],
     "installable": True,
     "application": False,
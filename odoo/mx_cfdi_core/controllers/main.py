@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from odoo import http, api
+from odoo.http import request, content_disposition
+from odoo.modules.registry import Registry
+
+from ..services import cfdi_zip
+
+
+class CfdiXmlController(http.Controller):
+
+    @http.route('/mx_cfdi/xml_zip', type='http', auth='user')
+    def xml_zip(self, empresa_id=None, date_from=None, date_to=None, tipo=None, **kw):
+        """ZIP con los XML CFDI del rango; se arma y envía en flujo, por lotes."""
+        Doc = request.env['mx.cfdi.document']
+        # Sólo ids (respeta reglas de acceso); el contenido se lee después, lote por lote.
+        ids = Doc.search(Doc._export_domain(empresa_id, date_from, date_to, tipo), order='id').ids
+        dbname, uid, context = request.env.cr.dbname, request.env.uid, dict(request.env.context)
+
+        def _stream():
+            # El cursor de la petición ya se cerró cuando werkzeug consume el generador.
+            with Registry(dbname).cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                yield from cfdi_zip.iter_zip(env['mx.cfdi.document'].browse(ids)._iter_xml_export())
+
+        name = 'cfdi_%s_%s.zip' % (date_from or 'inicio', date_to or 'hoy')
+        response = request.make_response(_stream(), headers=[
+            ('Content-Type', 'application/zip'),
+            ('Content-Disposition', content_disposition(name)),
+        ])
+        response.direct_passthrough = True
+        return response
@@ -2,5 +2,7 @@ from . import engine
 from . import provider_base
 from . import provider_dummy
 from . import document
+from . import blob
+from . import ir_attachment
 from . import res_config_settings
 from . import res_partner_regimen
\ No newline at end of file
@@ -0,0 +1,140 @@
+# mx_cfdi_core/models/blob.py
+from odoo import models, fields, api
+from datetime import timedelta
+import hashlib
+import zlib
+import logging
+import psycopg2
+_logger = logging.getLogger(__name__)
+"""
+Almacén de XML CFDI direccionado por contenido (SHA-256).
+    - Un mismo XML se guarda una sola vez: mx.cfdi.document.blob_id y los adjuntos del origen
+      (ir.attachment.cfdi_blob_id) apuntan al mismo blob.
+    - El contenido vive en un ir.attachment propio del blob (escrito con `raw`, sin base64).
+    - El cron de archivo comprime con zlib los blobs con más de mx_cfdi.blob_archive_days días
+      (default 90) y desprende del filestore los adjuntos de origen que los referencian: a partir
+      de ahí su contenido se sirve desde el blob (ver ir_attachment._compute_raw).
+"""
+
+
+class CfdiBlob(models.Model):
+    _name = "mx.cfdi.blob"
+    _description = "Contenido XML CFDI (direccionado por SHA-256)"
+    _rec_name = "sha256"
+
+    sha256       = fields.Char(required=True, readonly=True)
+    size         = fields.Integer(string='Tamaño', readonly=True)
+    stored_size  = fields.Integer(string='Tamaño almacenado', readonly=True)
+    compression  = fields.Selection([('none', 'Sin comprimir'), ('zlib', 'zlib')],
+                                    default='none', required=True, readonly=True)
+    store_id     = fields.Many2one('ir.attachment', string='Almacenamiento', readonly=True,
+                                   ondelete='restrict')
+
+    _sql_constraints = [
+        ('sha256_uniq', 'unique(sha256)', 'Ya existe un blob con ese SHA-256.'),
+    ]
+
+    # Regresa el blob de `data` (bytes/str), creándolo si no existe. Seguro ante concurrencia:
+    # si otro worker lo insertó primero, la violación del unique se resuelve releyendo.
+    @api.model
+    def _store(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not data:
+            return self.browse()
+        digest = hashlib.sha256(data).hexdigest()
+        Blob = self.sudo()
+        blob = Blob.search([('sha256', '=', digest)], limit=1)
+        if blob:
+            return blob
+        try:
+            with self.env.cr.savepoint():
+                blob = Blob.create({'sha256': digest, 'size': len(data)})
+                blob._write_payload(data, 'none')
+        except psycopg2.IntegrityError:
+            blob = Blob.search([('sha256', '=', digest)], limit=1)
+        return blob
+
+    # Contenido original (descomprimido) del blob.
+    def _read(self):
+        self.ensure_one()
+        payload = self.sudo().store_id.raw or b''
+        if self.compression == 'zlib':
+            return zlib.decompress(payload)
+        return payload
+
+    def _write_payload(self, payload, compression):
+        self.ensure_one()
+        old = self.store_id
+        att = self.env['ir.attachment'].sudo().create({
+            'name': f"{self.sha256}.xml" + ('.z' if compression == 'zlib' else ''),
+            'res_model': self._name,
+            'res_id': self.id,
+            'type': 'binary',
+            'raw': payload,
+            'mimetype': 'application/zlib' if compression == 'zlib' else 'application/xml',
+        })
+        self.write({'store_id': att.id, 'compression': compression, 'stored_size': len(payload)})
+        if old:
+            old.unlink()
+
+    # Comprime los blobs y desprende del filestore los adjuntos de origen que los referencian.
+    def _archive(self):
+        Att = self.env['ir.attachment'].sudo()
+        for blob in self.filtered(lambda b: b.compression == 'none'):
+            data = blob._read()
+            blob._write_payload(zlib.compress(data, 9), 'zlib')
+        atts = Att.search([('cfdi_blob_id', 'in', self.ids), ('type', '=', 'binary'),
+                           '|', ('store_fname', '!=', False), ('db_datas', '!=', False)])
+        atts._cfdi_detach_content()
+        return True
+
+    # Pasa al almacén los XML de documentos anteriores (adjunto propio del campo xml).
+    @api.model
+    def _migrate_legacy_documents(self, limit):
+        cr = self.env.cr
+        cr.execute("""
+            SELECT a.id, d.id
+              FROM ir_attachment a
+              JOIN mx_cfdi_document d ON d.id = a.res_id
+             WHERE a.res_model = 'mx.cfdi.document' AND a.res_field = 'xml'
+               AND d.blob_id IS NULL
+             ORDER BY a.id
+             LIMIT %s
+        """, [limit])
+        rows = cr.fetchall()
+        Att = self.env['ir.attachment'].sudo()
+        Doc = self.env['mx.cfdi.document'].sudo()
+        for att_id, doc_id in rows:
+            att = Att.browse(att_id)
+            blob = self._store(att.raw)
+            if blob:
+                Doc.browse(doc_id).write({'blob_id': blob.id})
+                Att.search([('cfdi_blob_id', '=', False), ('checksum', '=', att.checksum),
+                            ('res_model', '!=', 'mx.cfdi.blob'),
+                            ('mimetype', 'in', ['application/xml', 'text/xml'])]).write(
+                    {'cfdi_blob_id': blob.id})
+            att.unlink()
+        return len(rows)
+
+    # Cron diario: migra documentos anteriores y archiva (comprime) blobs viejos.
+    # Parámetros: mx_cfdi.blob_archive_days (default 90), mx_cfdi.blob_archive_batch (default 500).
+    @api.model
+    def _cron_archive_blobs(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        days = int(ICP.get_param('mx_cfdi.blob_archive_days', 90) or 90)
+        batch = max(1, int(ICP.get_param('mx_cfdi.blob_archive_batch', 500) or 500))
+        migrated = self._migrate_legacy_documents(batch)
+        self.env.cr.commit()
+        limit = fields.Datetime.now() - timedelta(days=days)
+        archived = 0
+        while True:
+            blobs = self.sudo().search([('compression', '=', 'none'), ('create_date', '<', limit)],
+                                       limit=batch, order='id')
+            if not blobs:
+                break
+            blobs._archive()
+            self.env.cr.commit()
+            archived += len(blobs)
+        _logger.info("CFDI BLOB | migrados=%s archivados=%s", migrated, archived)
+        return archived
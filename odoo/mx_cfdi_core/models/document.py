@@ -1,10 +1,32 @@
 # mx_cfdi_engine/models/document.py
-from odoo import models, fields
+from odoo import models, fields, api, _
+from odoo.tools import human_size, split_every
+from odoo.tools.sql import create_index
+from datetime import datetime, time, timedelta
+import base64
+import pytz
+import random
+import logging
+_logger = logging.getLogger(__name__)
 """
 Modelo de relación entre un CFDI y el documento/origen que lo generó.
     - Guarda la empresa emisora, el modelo/ID de origen (account.move, etc.), el tipo de CFDI (I/E/P), el UUID, el estado del ciclo (stamped/canceled) y el XML timbrado.
     - Este registro lo crea el engine en generate_and_stamp() y puede usarse para auditoría, búsquedas por UUID y para recuperar/descargar el XML.
+    - También funciona como cola de timbrado asíncrono: un documento 'to_stamp' apunta al origen
+      que debe timbrarse (p.ej. facturas.factura); el cron lo procesa y el engine lo completa
+      (uuid/xml/state) en lugar de crear otro documento.
+    - El XML no se guarda aquí: blob_id apunta al almacén direccionado por contenido
+      (mx.cfdi.blob), compartido con el adjunto del origen; `xml` se calcula del blob.
+    - Si el PAC timbra sin regresar el XML, el documento queda con xml_state='pending' y un cron
+      lo descarga por UUID con backoff exponencial y jitter (el timbrado no espera a SW).
 """
+
+# Espacio de llaves para pg_try_advisory_lock(int, int) de los slots por empresa.
+_QUEUE_LOCK_NS = 0x43464449  # 'CFDI'
+_QUEUE_MAX_SLOTS = 64
+_RECEIPT_CR_KEY = 'mx_cfdi.stamp_receipts'  # {document_id: uuid} guardados en este cursor
+
+
 class CfdiDocument(models.Model):
     _name = "mx.cfdi.document"
     _description = "Relación CFDI ↔ Origen"
@@ -16,6 +38,539 @@ class CfdiDocument(models.Model):
     uuid         = fields.Char(index=True, copy=False)
     state        = fields.Selection([
         ('to_stamp','Por timbrar'),('stamped','Timbrado'),
-        ('to_cancel','Por cancelar'),('canceled','Cancelado')
-    ], default='stamped')
-    xml          = fields.Binary(attachment=True)
\ No newline at end of file
+        ('to_cancel','Por cancelar'),('canceled','Cancelado'),
+        ('error','Error de timbrado'),
+    ], default='stamped', index=True)
+    stamped_at   = fields.Datetime(string='Timbrado el', readonly=True, copy=False)
+    blob_id      = fields.Many2one('mx.cfdi.blob', string='Contenido XML', index='btree_not_null',
+                                   copy=False, readonly=True)
+    xml          = fields.Binary(compute='_compute_xml', inverse='_inverse_xml')
+    # === Cola de timbrado ===
+    attempts     = fields.Integer(string='Intentos', default=0, copy=False)
+    next_try     = fields.Datetime(string='Siguiente intento', copy=False)
+    last_error   = fields.Text(string='Último error', copy=False)
+    # === Descarga diferida del XML timbrado ===
+    xml_state    = fields.Selection([
+        ('pending', 'Descargando XML'), ('done', 'XML disponible'), ('failed', 'XML no disponible'),
+    ], string='XML timbrado', index=True, copy=False)
+    xml_attempts = fields.Integer(string='Intentos de descarga', default=0, copy=False)
+    xml_next_try = fields.Datetime(string='Siguiente descarga', copy=False)
+    xml_error    = fields.Text(string='Error de descarga', copy=False)
+    # Traza del timbrado (anillo acotado, sólo si mx_cfdi_core.trace_level lo habilita)
+    trace_log    = fields.Text(string='Traza', copy=False)
+
+    def init(self):
+        super().init()
+        # Resolver de XML por origen (_resolve_xml) y exportación por empresa/rango de fechas
+        create_index(self._cr, 'mx_cfdi_document_origin_tipo_idx', self._table,
+                     ['origin_model', 'origin_id', 'tipo', 'id DESC'])
+        # La exportación filtra por stamped_at (hora del timbrado, no del encolado); los
+        # documentos anteriores al campo toman su create_date.
+        self._cr.execute("""
+            UPDATE mx_cfdi_document SET stamped_at = create_date
+             WHERE stamped_at IS NULL AND uuid IS NOT NULL AND state IN ('stamped', 'canceled')
+        """)
+        self._cr.execute("DROP INDEX IF EXISTS mx_cfdi_document_empresa_date_idx")
+        create_index(self._cr, 'mx_cfdi_document_empresa_stamped_idx', self._table,
+                     ['empresa_id', 'stamped_at'])
+
+    # Contenido desde el blob; documentos anteriores al almacén aún pueden tener el adjunto
+    # propio del campo (res_field='xml') hasta que el cron de archivo los migre.
+    @api.depends('blob_id')
+    @api.depends_context('bin_size')
+    def _compute_xml(self):
+        bin_size = self.env.context.get('bin_size')
+        legacy = {}
+        pending = self.filtered(lambda d: not d.blob_id and isinstance(d.id, int))
+        if pending:
+            legacy = {a.res_id: a for a in self.env['ir.attachment'].sudo().with_context(bin_size=bin_size).search([
+                ('res_model', '=', self._name), ('res_field', '=', 'xml'), ('res_id', 'in', pending.ids),
+            ])}
+        for d in self:
+            if d.blob_id:
+                d.xml = (human_size(d.blob_id.size) if bin_size
+                         else base64.b64encode(d.blob_id._read()))
+            elif d.id in legacy:
+                d.xml = legacy[d.id].datas
+            else:
+                d.xml = False
+
+    def _inverse_xml(self):
+        Blob = self.env['mx.cfdi.blob']
+        for d in self:
+            d.blob_id = Blob._store(base64.b64decode(d.xml)) if d.xml else False
+
+    # Encola el timbrado de los orígenes indicados. Idempotente: si el origen ya tiene un
+    # documento en cola (o en error) lo reactiva en vez de duplicarlo.
+    # `origins` es una lista de dicts {origin_id, empresa_id, tipo}. Regresa los documentos.
+    @api.model
+    def _enqueue(self, origin_model, origins):
+        docs = self.browse()
+        if not origins:
+            return docs
+        existing = {
+            d.origin_id: d for d in self.sudo().search([
+                ('origin_model', '=', origin_model),
+                ('origin_id', 'in', [o['origin_id'] for o in origins]),
+                ('state', 'in', ['to_stamp', 'error']),
+            ])
+        }
+        to_create = []
+        for o in origins:
+            doc = existing.get(o['origin_id'])
+            if doc:
+                doc.write({'state': 'to_stamp', 'attempts': 0, 'next_try': False, 'last_error': False})
+                docs |= doc
+            else:
+                to_create.append({
+                    'origin_model': origin_model,
+                    'origin_id': o['origin_id'],
+                    'empresa_id': o['empresa_id'],
+                    'tipo': o['tipo'],
+                    'state': 'to_stamp',
+                })
+        if to_create:
+            docs |= self.sudo().create(to_create)
+        self._trigger_queue()
+        return docs
+
+    @api.model
+    def _trigger_queue(self):
+        cron = self.env.ref('mx_cfdi_core.ir_cron_cfdi_stamp_queue', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    # Cron de la cola. La ejecución principal dispara un cron por worker
+    # (mx_cfdi.queue_workers, default 2); cada worker toma documentos con
+    # FOR UPDATE SKIP LOCKED y respeta mx_cfdi.queue_per_empresa timbrados simultáneos
+    # por empresa (default 1) mediante advisory locks.
+    @api.model
+    def _cron_stamp_queue(self, worker=None):
+        ICP = self.env['ir.config_parameter'].sudo()
+        workers = max(1, int(ICP.get_param('mx_cfdi.queue_workers', 2) or 1))
+        if worker is None and workers > 1:
+            self._despachar_queue(workers)
+            return True
+        self._procesar_queue()
+        return True
+
+    @api.model
+    def _despachar_queue(self, workers):
+        """Dispara (y crea si falta) un cron por worker de la cola de timbrado."""
+        Cron = self.env['ir.cron'].sudo()
+        model = self.env['ir.model']._get(self._name)
+        for worker in range(workers):
+            code = "model._cron_stamp_queue(worker=%d)" % worker
+            cron = Cron.search([('model_id', '=', model.id), ('code', '=', code)], limit=1)
+            if not cron:
+                cron = Cron.create({
+                    'name': "Cola de timbrado CFDI (worker %s/%s)" % (worker + 1, workers),
+                    'model_id': model.id,
+                    'state': 'code',
+                    'code': code,
+                    'interval_number': 1,
+                    'interval_type': 'days',
+                    # Sólo corre cuando la ejecución principal lo dispara.
+                    'nextcall': fields.Datetime.now() + timedelta(days=36500),
+                    'user_id': self.env.ref('base.user_root').id,
+                })
+            cron._trigger()
+
+    # Procesa documentos hasta vaciar la cola o agotar mx_cfdi.queue_batch (default 50).
+    # Cada documento se confirma en su propia transacción.
+    @api.model
+    def _procesar_queue(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        per_empresa = min(_QUEUE_MAX_SLOTS, max(1, int(ICP.get_param('mx_cfdi.queue_per_empresa', 1) or 1)))
+        batch = max(1, int(ICP.get_param('mx_cfdi.queue_batch', 50) or 50))
+        # Configuración de traza resuelta una vez para todo el lote
+        self = self.with_context(cfdi_trace_cfg=self.env['mx.cfdi.engine']._trace_config())
+        self.env['mx.cfdi.stamp.receipt']._gc_stamp_receipts()
+        self.env.cr.commit()
+        done = 0
+        while done < batch:
+            claimed = self._claim_next(per_empresa)
+            if not claimed:
+                break
+            doc, slot = claimed
+            try:
+                doc._stamp_queued(slot)
+            finally:
+                self.env.cr.commit()
+                self._release_slot(doc.empresa_id.id, slot)
+            done += 1
+        if done >= batch:
+            # Queda trabajo pendiente: vuelve a correr sin esperar al intervalo.
+            self._trigger_queue()
+        return done
+
+    # Toma el siguiente documento listo de una empresa con slot libre.
+    # Regresa (doc, slot) con el renglón bloqueado y el slot tomado, o None.
+    @api.model
+    def _claim_next(self, per_empresa):
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        cr.execute("""
+            SELECT DISTINCT empresa_id FROM mx_cfdi_document
+             WHERE state = 'to_stamp' AND (next_try IS NULL OR next_try <= %s)
+        """, [now])
+        for (empresa_id,) in cr.fetchall():
+            for slot in range(per_empresa):
+                cr.execute("SELECT pg_try_advisory_lock(%s, %s)",
+                           [_QUEUE_LOCK_NS, empresa_id * _QUEUE_MAX_SLOTS + slot])
+                if not cr.fetchone()[0]:
+                    continue
+                cr.execute("""
+                    SELECT id FROM mx_cfdi_document
+                     WHERE state = 'to_stamp' AND empresa_id = %s
+                       AND (next_try IS NULL OR next_try <= %s)
+                     ORDER BY id
+                     LIMIT 1
+                       FOR UPDATE SKIP LOCKED
+                """, [empresa_id, now])
+                row = cr.fetchone()
+                if row:
+                    return self.sudo().browse(row[0]), slot
+                self._release_slot(empresa_id, slot)
+                break
+        return None
+
+    @api.model
+    def _release_slot(self, empresa_id, slot):
+        self.env.cr.execute("SELECT pg_advisory_unlock(%s, %s)",
+                            [_QUEUE_LOCK_NS, empresa_id * _QUEUE_MAX_SLOTS + slot])
+
+    # Timbra un documento en cola. El origen debe implementar _cfdi_stamp_from_queue();
+    # el engine completa este mismo documento (ver cfdi_queue_doc_id en generate_and_stamp).
+    # Si falla se deshace todo lo del origen y se reprograma con backoff exponencial
+    # (mx_cfdi.queue_backoff, seg; default 60) hasta mx_cfdi.queue_max_attempts (default 5).
+    # Si el PAC ya había timbrado, su acuse (mx.cfdi.stamp.receipt) sobrevive al rollback y
+    # el reintento sólo repite los pasos locales con ese UUID: no se vuelve a llamar al PAC.
+    def _stamp_queued(self, slot=0):
+        self.ensure_one()
+        origin = self.env[self.origin_model].sudo().browse(self.origin_id).exists()
+        try:
+            if not origin:
+                raise ValueError(_('El origen %s,%s ya no existe.') % (self.origin_model, self.origin_id))
+            with self.env.cr.savepoint():
+                origin.with_context(empresa_id=self.empresa_id.id, cfdi_queue_doc_id=self.id,
+                                    cfdi_queue_slot=slot)._cfdi_stamp_from_queue()
+        except Exception as e:
+            self.env.invalidate_all()
+            ICP = self.env['ir.config_parameter'].sudo()
+            max_attempts = int(ICP.get_param('mx_cfdi.queue_max_attempts', 5) or 5)
+            backoff = int(ICP.get_param('mx_cfdi.queue_backoff', 60) or 60)
+            attempts = self.attempts + 1
+            pac_uuid = (self.env.cr.cache.get(_RECEIPT_CR_KEY, {}).get(self.id)
+                        or self.env['mx.cfdi.stamp.receipt']._for_document(self.id).uuid)
+            error = str(e) or repr(e)
+            if pac_uuid:
+                error = _('Timbrado en el PAC (UUID %s); falta completar el registro local: %s') % (
+                    pac_uuid, error)
+            _logger.warning("CFDI QUEUE | doc=%s origin=%s,%s intento=%s error: %s",
+                            self.id, self.origin_model, self.origin_id, attempts, error)
+            self.write({
+                'attempts': attempts,
+                'last_error': error,
+                'state': 'error' if attempts >= max_attempts else 'to_stamp',
+                'next_try': fields.Datetime.now() + timedelta(seconds=backoff * 2 ** (attempts - 1)),
+            })
+            return False
+        if self.state == 'to_stamp':
+            # El origen ya estaba timbrado (reintento tras éxito previo): nada que timbrar.
+            self.write({'state': 'stamped', 'last_error': False,
+                        'stamped_at': self.stamped_at or fields.Datetime.now()})
+        _logger.info("CFDI QUEUE | doc=%s origin=%s,%s uuid=%s", self.id, self.origin_model,
+                     self.origin_id, self.uuid)
+        return True
+
+    # Botón: reintentar documentos en error.
+    def action_retry_stamp(self):
+        docs = self.filtered(lambda d: d.state == 'error')
+        docs.write({'state': 'to_stamp', 'attempts': 0, 'next_try': False})
+        self._trigger_queue()
+        return True
+
+    # ===================== Descarga diferida del XML =====================
+
+    # Parámetros de la descarga (se leen una vez por lote):
+    # mx_cfdi.download_backoff (seg, default 2), mx_cfdi.download_backoff_max (default 300),
+    # mx_cfdi.download_max_attempts (default 12), mx_cfdi.download_batch (default 50).
+    @api.model
+    def _download_params(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        return {
+            'backoff': max(0.5, float(ICP.get_param('mx_cfdi.download_backoff', 2) or 2)),
+            'backoff_max': max(1.0, float(ICP.get_param('mx_cfdi.download_backoff_max', 300) or 300)),
+            'max_attempts': max(1, int(ICP.get_param('mx_cfdi.download_max_attempts', 12) or 12)),
+            'batch': max(1, int(ICP.get_param('mx_cfdi.download_batch', 50) or 50)),
+        }
+
+    # Espera antes del intento `attempts` (0 = primero): backoff exponencial con tope y
+    # "equal jitter" (mitad fija, mitad aleatoria) para no sincronizar consultas a SW.
+    @api.model
+    def _download_delay(self, attempts, params):
+        wait = min(params['backoff_max'], params['backoff'] * 2 ** attempts)
+        return wait / 2 + random.uniform(0, wait / 2)
+
+    # Programa la descarga del XML de estos documentos y despierta el cron en ese momento.
+    def _schedule_download(self, params=None):
+        if not self:
+            return
+        params = params or self._download_params()
+        next_try = fields.Datetime.now() + timedelta(seconds=self._download_delay(0, params))
+        self.sudo().write({'xml_state': 'pending', 'xml_attempts': 0, 'xml_next_try': next_try,
+                           'xml_error': False})
+        self._trigger_download(next_try)
+
+    @api.model
+    def _trigger_download(self, at=None):
+        cron = self.env.ref('mx_cfdi_core.ir_cron_cfdi_xml_download', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger(at=at)
+
+    # Cron de descarga: toma documentos pendientes vencidos con FOR UPDATE SKIP LOCKED (varios
+    # workers no se pisan), confirma cada uno en su propia transacción y se reprograma para el
+    # siguiente vencimiento en vez de esperar al intervalo.
+    @api.model
+    def _cron_download_xml(self):
+        params = self._download_params()
+        cr = self.env.cr
+        done = 0
+        while done < params['batch']:
+            cr.execute("""
+                SELECT id FROM mx_cfdi_document
+                 WHERE xml_state = 'pending' AND (xml_next_try IS NULL OR xml_next_try <= %s)
+                 ORDER BY xml_next_try NULLS FIRST, id
+                 LIMIT 1
+                   FOR UPDATE SKIP LOCKED
+            """, [fields.Datetime.now()])
+            row = cr.fetchone()
+            if not row:
+                break
+            try:
+                self.sudo().browse(row[0])._download_xml(params)
+            finally:
+                cr.commit()
+            done += 1
+        if done >= params['batch']:
+            self._trigger_download()
+        else:
+            cr.execute("SELECT MIN(xml_next_try) FROM mx_cfdi_document WHERE xml_state = 'pending'")
+            nxt = cr.fetchone()[0]
+            if nxt:
+                self._trigger_download(nxt)
+        return done
+
+    # Un intento de descarga. Si SW ya expone el XML lo guarda en el documento y lo adjunta
+    # al origen (más el acuse); si no, reprograma con backoff o marca 'failed' al agotar intentos.
+    def _download_xml(self, params):
+        self.ensure_one()
+        data, err = None, False
+        try:
+            provider = self.env['mx.cfdi.engine'].with_context(
+                empresa_id=self.empresa_id.id)._get_provider().with_context(empresa_id=self.empresa_id.id)
+            with self.env.cr.savepoint():
+                data = provider._fetch_stamped_xml(self.uuid)
+                if data and data.get('xml'):
+                    self._complete_download(data)
+                    return True
+        except Exception as e:
+            self.env.invalidate_all()
+            err = str(e) or repr(e)
+        attempts = self.xml_attempts + 1
+        if attempts >= params['max_attempts']:
+            self.write({'xml_state': 'failed', 'xml_attempts': attempts, 'xml_next_try': False,
+                        'xml_error': err or _('El PAC no expuso el XML tras %s intentos.') % attempts})
+            _logger.warning("CFDI XML | doc=%s uuid=%s sin XML tras %s intentos: %s",
+                            self.id, self.uuid, attempts, err)
+            return False
+        delay = self._download_delay(attempts, params)
+        self.write({'xml_attempts': attempts, 'xml_error': err,
+                    'xml_next_try': fields.Datetime.now() + timedelta(seconds=delay)})
+        _logger.info("CFDI XML | doc=%s uuid=%s aún sin XML (intento %s, siguiente en %.1fs)",
+                     self.id, self.uuid, attempts, delay)
+        return False
+
+    def _complete_download(self, data):
+        self.ensure_one()
+        xml = data['xml']
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        self.write({'blob_id': self.env['mx.cfdi.blob']._store(xml).id, 'xml_state': 'done',
+                    'xml_next_try': False, 'xml_error': False})
+        engine = self.env['mx.cfdi.engine'].with_context(empresa_id=self.empresa_id.id)
+        engine._attach_xml(self.origin_model, self.origin_id, xml, self)
+        if data.get('acuse'):
+            self.env['ir.attachment'].sudo().create({
+                'name': f"acuse-{self.uuid}.xml",
+                'res_model': self.origin_model,
+                'res_id': self.origin_id,
+                'type': 'binary',
+                'datas': base64.b64encode(data['acuse']).decode('ascii'),
+                'mimetype': 'application/xml',
+                'description': _('Acuse CFDI %s (SW DW)') % (self.uuid,),
+            })
+        _logger.info("CFDI XML | doc=%s uuid=%s descargado", self.id, self.uuid)
+
+    # Botón: volver a intentar la descarga de documentos sin XML.
+    def action_retry_download(self):
+        self.filtered(lambda d: d.uuid and d.xml_state in ('pending', 'failed'))._schedule_download()
+        return True
+
+    # Estado de la descarga por UUID para que la UI lo consulte (orm.call desde el cliente).
+    @api.model
+    def get_xml_status(self, uuids):
+        docs = self.search([('uuid', 'in', list(uuids or []))])
+        return {d.uuid: {'xml_state': d.xml_state or False,
+                         'attempts': d.xml_attempts,
+                         'next_try': d.xml_next_try and fields.Datetime.to_string(d.xml_next_try),
+                         'error': d.xml_error or False}
+                for d in docs}
+
+    # ===================== Resolución / exportación del XML =====================
+
+    # Resolver indexado del XML en una sola consulta (índice origin_model, origin_id, tipo).
+    # keys: [(origin_model, origin_id, tipo|None), ...]  o  uuids: [uuid, ...].
+    # Regresa {llave: {'document_id', 'uuid', 'blob_id', 'attachment_id'}} con el documento
+    # timbrado/cancelado más reciente por llave; attachment_id es el adjunto del origen con ese
+    # mismo contenido (o False si sólo está en el documento).
+    @api.model
+    def _resolve_xml(self, keys=(), uuids=()):
+        cr = self.env.cr
+        lateral = """
+            LEFT JOIN LATERAL (
+                SELECT a.id FROM ir_attachment a
+                 WHERE a.res_model = d.origin_model AND a.res_id = d.origin_id
+                   AND a.cfdi_blob_id = d.blob_id
+                 ORDER BY a.id DESC LIMIT 1
+            ) att ON TRUE
+        """
+        res = {}
+        if keys:
+            keys = list(keys)
+            cr.execute("""
+                SELECT DISTINCT ON (k.origin_model, k.origin_id, k.tipo)
+                       k.origin_model, k.origin_id, k.tipo, d.id, d.uuid, d.blob_id, att.id
+                  FROM unnest(%s::varchar[], %s::int[], %s::varchar[]) AS k(origin_model, origin_id, tipo)
+                  JOIN mx_cfdi_document d
+                    ON d.origin_model = k.origin_model AND d.origin_id = k.origin_id
+                   AND (k.tipo IS NULL OR d.tipo = k.tipo)
+                   AND d.state IN ('stamped', 'canceled')
+                """ + lateral + """
+                 ORDER BY k.origin_model, k.origin_id, k.tipo, d.id DESC
+            """, [[k[0] for k in keys], [k[1] for k in keys], [k[2] if len(k) > 2 else None for k in keys]])
+            for model, oid, tipo, doc_id, uuid, blob_id, att_id in cr.fetchall():
+                res[(model, oid, tipo)] = {'document_id': doc_id, 'uuid': uuid,
+                                           'blob_id': blob_id, 'attachment_id': att_id or False}
+        uuids = [u for u in (uuids or ()) if u]
+        if uuids:
+            cr.execute("""
+                SELECT DISTINCT ON (d.uuid) d.uuid, d.id, d.blob_id, att.id
+                  FROM mx_cfdi_document d
+                """ + lateral + """
+                 WHERE d.uuid = ANY(%s) AND d.state IN ('stamped', 'canceled')
+                 ORDER BY d.uuid, d.id DESC
+            """, [uuids])
+            for uuid, doc_id, blob_id, att_id in cr.fetchall():
+                res[uuid] = {'document_id': doc_id, 'uuid': uuid,
+                             'blob_id': blob_id, 'attachment_id': att_id or False}
+        return res
+
+    # Acción de descarga para un resultado de _resolve_xml: el adjunto del origen si existe,
+    # si no el campo xml del documento (servido desde el blob).
+    @api.model
+    def _xml_download_action(self, hit):
+        if hit.get('attachment_id'):
+            url = f"/web/content/{hit['attachment_id']}?download=true"
+        else:
+            url = (f"/web/content/{self._name}/{hit['document_id']}/xml"
+                   f"?download=true&filename={hit.get('uuid') or hit['document_id']}.xml")
+        return {'type': 'ir.actions.act_url', 'url': url, 'target': 'self'}
+
+    # Dominio de exportación por empresa / rango de fechas de timbrado / tipo.
+    # Las fechas son días locales del usuario (tz); stamped_at se guarda en UTC.
+    @api.model
+    def _export_domain(self, empresa_id=None, date_from=None, date_to=None, tipo=None):
+        domain = [('state', 'in', ['stamped', 'canceled']), ('uuid', '!=', False)]
+        if empresa_id:
+            domain.append(('empresa_id', '=', int(empresa_id)))
+        if date_from:
+            domain.append(('stamped_at', '>=', self._local_day_start_utc(date_from)))
+        if date_to:
+            domain.append(('stamped_at', '<', self._local_day_start_utc(date_to, days=1)))
+        if tipo:
+            domain.append(('tipo', '=', tipo))
+        return domain
+
+    # Inicio (00:00 en la zona del usuario, más `days` días) del día indicado, en UTC ingenuo.
+    @api.model
+    def _local_day_start_utc(self, day, days=0):
+        tz = pytz.timezone(self.env.context.get('tz') or self.env.user.tz or 'UTC')
+        start = datetime.combine(fields.Date.to_date(day) + timedelta(days=days), time.min)
+        return fields.Datetime.to_string(tz.localize(start).astimezone(pytz.utc).replace(tzinfo=None))
+
+    # Recorre (nombre, bytes) de los documentos en lotes, liberando caché entre lotes para que
+    # la exportación no acumule todo el contenido en memoria.
+    def _iter_xml_export(self, batch=200):
+        for chunk in split_every(batch, self.ids):
+            docs = self.browse(chunk).sudo()
+            for d in docs:
+                if d.blob_id:
+                    data = d.blob_id._read()
+                else:
+                    b64 = d.with_context(bin_size=False).xml
+                    data = base64.b64decode(b64) if b64 else None
+                if data:
+                    yield "%s/%s.xml" % (d.tipo, d.uuid or d.id), data
+            self.env.invalidate_all()
+
+
+# Acuse del PAC para un documento de la cola. Se guarda en un cursor propio en cuanto el PAC
+# timbra, antes de los pasos locales del origen (póliza, transacciones, stock...): si éstos
+# fallan y el intento se revierte, el reintento retoma este UUID en vez de timbrar otra vez.
+# document_id es entero (sin FK) porque la cola tiene el renglón del documento bloqueado
+# FOR UPDATE y un FK esperaría a esa misma transacción. Se borran al quedar el documento
+# fuera de la cola (ver _gc_stamp_receipts).
+class CfdiStampReceipt(models.Model):
+    _name = "mx.cfdi.stamp.receipt"
+    _description = "Acuse de timbrado pendiente de completar"
+
+    document_id = fields.Integer(required=True, index=True)
+    uuid        = fields.Char(required=True)
+    xml         = fields.Text()
+
+    _sql_constraints = [
+        ('document_uniq', 'unique(document_id)', 'Sólo un acuse por documento.'),
+    ]
+
+    @api.model
+    def _for_document(self, document_id):
+        return self.sudo().search([('document_id', '=', document_id)], limit=1)
+
+    @api.model
+    def _record(self, document_id, uuid, xml=None):
+        if isinstance(xml, bytes):
+            xml = xml.decode('utf-8')
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                INSERT INTO mx_cfdi_stamp_receipt (document_id, uuid, xml, create_uid, create_date,
+                                                   write_uid, write_date)
+                VALUES (%s, %s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+                ON CONFLICT (document_id) DO UPDATE SET uuid = EXCLUDED.uuid, xml = EXCLUDED.xml,
+                                                        write_date = EXCLUDED.write_date
+            """, [document_id, uuid, xml or None, self.env.uid, self.env.uid])
+        # La transacción actual no ve el renglón (snapshot previo); se anota en el cursor para
+        # que _stamp_queued lo reporte si los pasos locales fallan en este mismo intento.
+        self.env.cr.cache.setdefault(_RECEIPT_CR_KEY, {})[document_id] = uuid
+        _logger.info("CFDI QUEUE | doc=%s acuse PAC guardado uuid=%s", document_id, uuid)
+
+    # Acuses de documentos que ya salieron de la cola (timbrados, cancelados o borrados).
+    # Los de documentos en 'error' se conservan: el reintento manual los retoma.
+    @api.model
+    def _gc_stamp_receipts(self):
+        self.env.cr.execute("""
+            DELETE FROM mx_cfdi_stamp_receipt r
+             WHERE NOT EXISTS (SELECT 1 FROM mx_cfdi_document d
+                                WHERE d.id = r.document_id AND d.state IN ('to_stamp', 'error'))
+        """)
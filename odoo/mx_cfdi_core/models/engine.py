@@ -1,17 +1,32 @@
 # mx_cfdi_core/models/engine.py
-from odoo import models, api, _, fields
+from odoo import models, api, _, fields, tools
 from odoo.exceptions import UserError
 import base64
-from xml.etree.ElementTree import Element, SubElement, tostring
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
 import logging
+import time
 _logger = logging.getLogger(__name__)
-from xml.etree.ElementTree import Element, SubElement, tostring, register_namespace
+from xml.etree.ElementTree import register_namespace
 register_namespace('cfdi', 'http://www.sat.gob.mx/cfd/4')
 register_namespace('xsi',  'http://www.w3.org/2001/XMLSchema-instance')
 register_namespace('pago20', 'http://www.sat.gob.mx/Pagos20')
-import hashlib
 import re, unicodedata
+from ..services import cfdi_xml, cfdi_taxes, cfdi_trace
+
+_RE_CLAVE_SAT = re.compile(r'^\d{8}$')
+_RE_CLAVE_UNIDAD = re.compile(r'^[A-Z0-9]{2,5}$')
+
+PM_CODES = {'601','603','620','623','624','628'}
+PF_CODES = {'605','606','607','608','611','612','614','615','616'}
+
+# Datos del emisor ya validados/normalizados + metadatos del CSD (ver _emisor_profile).
+# `error` trae el primer problema de configuración como (código, parámetros) o False; se
+# traduce y lanza al construir el XML (_emisor_error_message).
+EmisorProfile = namedtuple('EmisorProfile', [
+    'empresa_id', 'rfc', 'regimen', 'nombre', 'lugar_expedicion', 'is_moral', 'error',
+    'cer_pem', 'cer_serial', 'cer_not_before', 'cer_not_after', 'cer_error',
+])
 
 
 class CfdiEngine(models.AbstractModel):
@@ -23,13 +38,15 @@ class CfdiEngine(models.AbstractModel):
     1) Construye el XML con _build_xml().
     2) Obtiene el proveedor PAC con _get_provider() y loguea CSD.
     3) Intenta timbrar; si detecta “305 (vigencia CSD)” reintenta con fecha UTC.
-    4) Si el PAC no regresa XML, lo descarga por UUID.
+    4) Si el PAC no regresa XML, difiere la descarga por UUID (mx.cfdi.document, xml_state='pending').
     5) Crea mx.cfdi.document y adjunta el XML al origen con _attach_xml().
     Parámetros clave (kwargs-only): origin_model, origin_id, empresa_id, tipo, receptor_id,
     uso_cfdi, metodo, forma, relacion_tipo, relacion_moves, conceptos, moneda, serie, folio,
     fecha, extras.
-    Retorna: dict {'uuid', 'attachment_id', 'document_id'}.
-    Efectos colaterales: crea/adjunta ir.attachment y mx.cfdi.document; escribe logs.
+    Retorna: dict {'uuid', 'attachment_id', 'document_id', 'xml_state'}; attachment_id es False
+    mientras el XML está pendiente de descarga.
+    Efectos colaterales: crea/adjunta ir.attachment y mx.cfdi.document; traza opcional
+    (ver _trace_config / services/cfdi_trace.py).
     Lanza: UserError si falta empresa_id o si el PAC no devuelve UUID.
     """
 
@@ -42,54 +59,115 @@ class CfdiEngine(models.AbstractModel):
             empresa_id = self.env.context.get('empresa_id')
         if not empresa_id:
             raise UserError(_('Se requiere empresa_id para timbrar'))
-        
+
         # Asegurar que el contexto tenga empresa_id
         self = self.with_context(empresa_id=empresa_id)
+        trace = cfdi_trace.start(self._trace_config(), "%s,%s" % (origin_model, origin_id))
+        with cfdi_trace.activate(trace):
+            try:
+                return self._generate_and_stamp(
+                    trace, origin_model=origin_model, origin_id=origin_id, empresa_id=empresa_id,
+                    tipo=tipo, receptor_id=receptor_id, uso_cfdi=uso_cfdi, metodo=metodo, forma=forma,
+                    relacion_tipo=relacion_tipo, relacion_moves=relacion_moves, conceptos=conceptos,
+                    moneda=moneda, serie=serie, folio=folio, fecha=fecha, extras=extras)
+            except Exception as e:
+                if trace:
+                    trace.event('error', '%s', e)
+                raise
+
+    def _generate_and_stamp(self, trace, *, origin_model, origin_id, empresa_id, tipo, receptor_id,
+                            uso_cfdi, metodo, forma, relacion_tipo, relacion_moves,
+                            conceptos, moneda, serie, folio, fecha, extras):
+        # Desde la cola, un intento anterior pudo timbrar en el PAC y fallar después (póliza,
+        # transacciones, stock...). Su acuse quedó en mx.cfdi.stamp.receipt: se retoma ese UUID
+        # en vez de volver a timbrar (evita CFDI duplicados ante el SAT).
+        queue_doc_id = self.env.context.get("cfdi_queue_doc_id")
+        Receipt = self.env["mx.cfdi.stamp.receipt"]
+        receipt = Receipt._for_document(queue_doc_id) if queue_doc_id else Receipt
+        if receipt:
+            stamped = {"uuid": receipt.uuid, "xml_timbrado": receipt.xml or None}
+            if trace:
+                trace.event('resume', 'uuid=%s (acuse de un intento previo)', receipt.uuid)
+        else:
+            stamped = self._pac_stamp(
+                trace, origin_model=origin_model, origin_id=origin_id,
+                tipo=tipo, receptor_id=receptor_id, uso_cfdi=uso_cfdi, metodo=metodo, forma=forma,
+                relacion_tipo=relacion_tipo, relacion_moves=relacion_moves, conceptos=conceptos,
+                moneda=moneda, serie=serie, folio=folio, fecha=fecha, extras=extras)
+            if queue_doc_id:
+                Receipt._record(queue_doc_id, stamped["uuid"], stamped.get("xml_timbrado"))
+
+        # 4) Si el PAC no regresó el XML no se espera aquí: el documento queda con
+        #    xml_state='pending' y el cron de descarga lo completa (backoff con jitter).
+        xml_bytes = stamped.get("xml_timbrado")
+        if isinstance(xml_bytes, str):
+            xml_bytes = xml_bytes.encode("utf-8")
+
+        # 5) Guardar (la traza registra hash/contenido y el TFD según nivel)
+        if trace:
+            trace.set_key("%s,%s uuid=%s" % (origin_model, origin_id, stamped["uuid"]))
+            if xml_bytes:
+                trace.xml('TIMBRADO XML', xml_bytes)
+                trace.event('tfd', '%s', self._tfd_attrs(xml_bytes))
+            else:
+                trace.event('xml_deferred', 'provider keys=%s', list(stamped.keys()))
+
+        doc_vals = {
+            "empresa_id": empresa_id,
+            "origin_model": origin_model,
+            "origin_id": origin_id,
+            "tipo": tipo,
+            "uuid": stamped["uuid"],
+            "blob_id": self.env["mx.cfdi.blob"]._store(xml_bytes).id if xml_bytes else False,
+            "xml_state": "done" if xml_bytes else "pending",
+            "state": "stamped",
+            "stamped_at": fields.Datetime.now(),
+        }
+        if trace:
+            trace.event('stamped', 'uuid=%s', stamped["uuid"])
+            dump = trace.dump()
+            if dump:
+                doc_vals["trace_log"] = dump
+        # Timbrado desde la cola: se completa el documento encolado en vez de crear otro
+        doc = self.env["mx.cfdi.document"].sudo().browse(queue_doc_id).exists() if queue_doc_id else None
+        if doc and doc.state == "to_stamp":
+            doc_vals["last_error"] = False
+            doc.write(doc_vals)
+        else:
+            doc = self.env["mx.cfdi.document"].create(doc_vals)
+
+        if not xml_bytes:
+            doc._schedule_download()
+            return {"uuid": doc.uuid, "attachment_id": False, "document_id": doc.id,
+                    "xml_state": doc.xml_state}
+        att = self._attach_xml(origin_model, origin_id, xml_bytes, doc)
+        return {"uuid": doc.uuid, "attachment_id": att.id, "document_id": doc.id,
+                "xml_state": doc.xml_state}
+
+
+    # Pasos 1-3: construye el XML y lo timbra en el PAC (con reintento 305).
+    # Regresa el dict del provider con 'uuid' (y 'xml_timbrado' si lo mandó).
+    def _pac_stamp(self, trace, *, origin_model, origin_id, **build_kw):
         # 1) Construir XML
-        xml = self._build_xml(
-            tipo=tipo, receptor_id=receptor_id, conceptos=conceptos,
-            uso_cfdi=uso_cfdi, metodo=metodo, forma=forma,
-            relacion_tipo=relacion_tipo, relacion_moves=relacion_moves,
-            moneda=moneda, serie=serie, folio=folio, fecha=fecha,
-            extras=extras
-        )
+        xml = self._build_xml(**build_kw)
 
-        # 2) Obtener provider y loggear cfg/vigencia CSD
+        # 2) Obtener provider; cfg/vigencia CSD sólo si hay traza
         provider = self._get_provider()
-        try:
-            provider._debug_cfg()
-            self._log_csd_validity()
-        except Exception as e:
-            _logger.warning("CFDI DEBUG | No se pudo loggear cfg/vigencia CSD: %s", e)
+        if trace:
+            try:
+                trace.event('provider', '%s cfg=%s', provider._name,
+                            provider._debug_cfg() if hasattr(provider, '_debug_cfg') else None)
+                self._log_csd_validity()
+                # La verificación del CSD en el PAC la hace el propio provider al timbrar
+                # (con caché); aquí sólo se registra lo que ya se sabe, sin peticiones extra.
+                if hasattr(provider, '_has_cert_cached'):
+                    trace.event('csd', 'en PAC -> %s', provider._has_cert_cached())
+            except Exception as e:
+                trace.event('provider', 'no se pudo leer cfg/vigencia CSD: %s', e)
 
         # 3) Timbrar (con retry 305)
         stamped, saw_305 = None, False
         try:
-            #==============================Log cfdi 4.0==============================
-            try:
-                txt = xml.decode("utf-8", errors="ignore") if isinstance(xml, (bytes, bytearray)) else str(xml)
-                max_bytes = 8192  # 8 KB de preview; ajusta a tu gusto
-                head = txt[:max_bytes]
-                tail_note = f"\n...[truncated {len(txt) - max_bytes} bytes]" if len(txt) > max_bytes else ""
-                _logger.info(
-                    "CFDI OUT | PRE-STAMP XML | len=%s | sha256=%s\n%s%s",
-                    len(xml),
-                    hashlib.sha256(xml if isinstance(xml, (bytes, bytearray)) else txt.encode("utf-8")).hexdigest(),
-                    head,
-                    tail_note,
-                )
-            except Exception as e:
-                _logger.warning("CFDI OUT | No se pudo loggear preview del XML: %s", e)
-
-            try:
-                cfg = provider._debug_cfg()  # ya loggea sandbox/base/rfc/token_fp
-                # Verifica que el PAC ve el CSD del RFC activo
-                has = provider._has_cert()
-                _logger.warning("CFDI DEBUG | _has_cert(rfc=%s) -> %s", cfg.get('rfc'), has)
-            except Exception as e:
-                _logger.warning("CFDI DEBUG | provider precheck failed: %s", e)
-
-            #=============================FIN Log cfdi 4.0=============================
             stamped = provider._stamp_xml(xml)
         except Exception as e:
             try:
@@ -102,14 +180,12 @@ class CfdiEngine(models.AbstractModel):
                 raise
 
         if saw_305 or self._is_305(payload=stamped):
+            # Mismo comprobante con Fecha en UTC: se parcha el atributo, sin reconstruir el XML
             fecha_utc = fields.Datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-            xml = self._build_xml(
-                tipo=tipo, receptor_id=receptor_id, conceptos=conceptos,
-                uso_cfdi=uso_cfdi, metodo=metodo, forma=forma,
-                relacion_tipo=relacion_tipo, relacion_moves=relacion_moves,
-                moneda=moneda, serie=serie, folio=folio, fecha=fecha_utc,
-                extras=extras
-            )
+            xml = cfdi_xml.patch_fecha(xml, fecha_utc)
+            if trace:
+                trace.event('retry_305', 'Fecha=%s', fecha_utc)
+                trace.xml('PRE-STAMP XML (305)', xml)
             stamped = provider._stamp_xml(xml)
 
         if not stamped or not stamped.get("uuid"):
@@ -119,63 +195,7 @@ class CfdiEngine(models.AbstractModel):
                 pass
             raise UserError(_("El PAC no devolvió un UUID."))
 
-        # 4) Descargar XML por UUID si no vino en respuesta
-        if not stamped.get("xml_timbrado"):
-            try:
-                dl = provider.download_xml_by_uuid(stamped['uuid'], tries=10, delay=1.0)
-                stamped['xml_timbrado'] = dl.get('xml')
-                if dl.get('acuse'):
-                    self.env['ir.attachment'].sudo().create({
-                        'name': f"acuse-{stamped['uuid']}.xml",
-                        'res_model': origin_model,
-                        'res_id': origin_id,
-                        'type': 'binary',
-                        'datas': base64.b64encode(dl['acuse']).decode('ascii'),
-                        'mimetype': 'application/xml',
-                        'description': _('Acuse CFDI %s (SW DW)') % (stamped['uuid'],),
-                    })
-                    
-            except Exception as e:
-                _logger.info("CFDI DEBUG | provider returned keys=%s", list(stamped.keys()))
-
-        # 5) Guardar y log extra (TFD)
-        xml_bytes = stamped.get("xml_timbrado")
-        if isinstance(xml_bytes, str):
-            xml_bytes = xml_bytes.encode("utf-8")
-        self._debug_dump_xml(xml_bytes, label="TIMBRADO XML",
-                             param_key="mx_cfdi_core.log_xml_timbrado_full", limit_kb=256)
-
-        try:
-            import xml.etree.ElementTree as ET
-            ns_cfdi = "http://www.sat.gob.mx/cfd/4"
-            ns_tfd = "http://www.sat.gob.mx/TimbreFiscalDigital"
-            root = ET.fromstring(xml_bytes)
-            tfd = None
-            for comp in root.findall(f".//{{{ns_cfdi}}}Complemento"):
-                tfd = comp.find(f".//{{{ns_tfd}}}TimbreFiscalDigital")
-                if tfd is not None:
-                    break
-            if tfd is not None:
-                attrs = dict(tfd.attrib)
-            else:
-                _logger.info("CFDI DEBUG | TFD no encontrado en XML timbrado.")
-        except Exception as e:
-            _logger.warning("CFDI DEBUG | Error leyendo TFD: %s", e)
-        
-        xml_b64 = base64.b64encode(xml_bytes).decode("ascii")
-        doc = self.env["mx.cfdi.document"].create({
-            "empresa_id": empresa_id,
-            "origin_model": origin_model,
-            "origin_id": origin_id,
-            "tipo": tipo,
-            "uuid": stamped["uuid"],
-            "xml": xml_b64,
-            "state": "stamped",
-        })
-
-        att = self._attach_xml(origin_model, origin_id, stamped.get("xml_timbrado"), doc)
-        return {"uuid": doc.uuid, "attachment_id": att.id, "document_id": doc.id}
-
+        return stamped
 
     """
     Arma el <cfdi:Comprobante Version="4.0"> completo listo para timbrar:
@@ -223,40 +243,18 @@ class CfdiEngine(models.AbstractModel):
         if not empresa_id:
             raise UserError(_('Se requiere empresa_id para generar CFDI'))
 
-        empresa = self.env['empresas.empresa'].browse(empresa_id)
-        if not empresa.exists():
-            raise UserError(_('Empresa no encontrada'))
-
-        # Usar datos directamente de empresa
-        cpostal = (empresa.cp or '').strip()
-        if not (cpostal.isdigit() and len(cpostal) == 5):
-            raise UserError(_("Configura el C.P. de la compañía (5 dígitos) para LugarExpedicion."))
-
-        self._debug_dates(fecha, cpostal)
+        # Emisor ya validado y normalizado (caché por empresa, ver _emisor_profile)
+        profile = self._emisor_profile(empresa_id)
+        if profile.error:
+            raise UserError(self._emisor_error_message(profile.error))
+        cpostal = profile.lugar_expedicion
 
-        emisor_rfc = (empresa.rfc or '').upper()
-        if not emisor_rfc:
-            raise UserError(_("Configura el RFC Emisor (cfdi_sw_rfc o VAT)."))
 
-        is_moral = self._is_moral_rfc(emisor_rfc)
-        reg_cfg = (empresa.regimen_fiscal or '').strip()
-        if not reg_cfg:
-            raise UserError(_("Falta el Régimen Fiscal de la empresa emisora."))
-        _logger.info("CFDI EMISOR | regimen_efectivo=%s (fuente=empresas.empresa)", reg_cfg)
-
-
-        PM_CODES = {'601','603','620','623','624','628'}
-        PF_CODES = {'605','606','607','608','611','612','614','615','616'}
-        if is_moral and reg_cfg in PF_CODES:
-            raise UserError(_("El RFC %(rfc)s es de Persona Moral pero el régimen %(reg)s es de PF.") % {'rfc': emisor_rfc, 'reg': reg_cfg})
-        if (not is_moral) and reg_cfg in PM_CODES:
-            raise UserError(_("El RFC %(rfc)s es de Persona Física pero el régimen %(reg)s es de PM.") % {'rfc': emisor_rfc, 'reg': reg_cfg})
-
-        emisor_regimen = reg_cfg
-        emisor_nombre = (empresa.razonsocial or '').strip()
-        if not emisor_nombre:
-            raise UserError(_("Configura el nombre/razón social del emisor."))
-        emisor_nombre = ' '.join(emisor_nombre.split()).upper()
+        emisor_rfc = profile.rfc
+        emisor_regimen = profile.regimen
+        trace = cfdi_trace.current()
+        if trace:
+            trace.event('emisor', 'rfc=%s regimen=%s cp=%s', emisor_rfc, emisor_regimen, cpostal)
 
         # Si es pago y no vino uso_cfdi, usar CP01 automáticamente
         if tipo == 'P' and not uso_default:
@@ -286,6 +284,28 @@ class CfdiEngine(models.AbstractModel):
         exento_bases = {}
 
         conceptos_calc = []
+        cols = (conceptos_in if isinstance(conceptos_in, cfdi_taxes.Conceptos)
+                else cfdi_taxes.Conceptos.from_dicts(conceptos_in))
+        if cols is not None:
+            # Camino columnar: bases e impuestos agrupados en una pasada (mismo redondeo por concepto)
+            calc = cfdi_taxes.calcular(cols)
+            agg_base, agg_tras, exento_bases = calc['agg_base'], calc['agg_tras'], calc['exento_bases']
+            subtotal_sum, traslados_total = calc['subtotal_sum'], calc['traslados_total']
+            for k in range(len(cols)):
+                self._check_concepto(k + 1, cols.clave_sat[k], cols.clave_unidad[k],
+                                     cols.has_vu[k], cols.descripcion[k])
+                conceptos_calc.append({
+                    'base': calc['bases'][k],
+                    'imp_obj': calc['imp_obj'][k],
+                    'qty': cols.qty[k],
+                    'vu': cols.vu[k],
+                    'clave_sat': cols.clave_sat[k],
+                    'no_ident': cols.no_ident[k] or '',
+                    'clave_unidad': cols.clave_unidad[k],
+                    'descripcion': cols.descripcion[k],
+                    'traslados': calc['traslados'][k],
+                })
+            conceptos_in = []
         for c in conceptos_in:
             qty = float(c.get('cantidad') or c.get('qty') or 1.0)
             vu  = float(c.get('valor_unitario') or c.get('price') or 0.0)
@@ -363,24 +383,9 @@ class CfdiEngine(models.AbstractModel):
 
             idx = len(conceptos_calc) + 1
             clave_sat = (c.get('clave_sat') or c.get('claveprodserv') or '').strip()
-            if not clave_sat:
-                raise UserError(_("Concepto #%s: falta ClaveProdServ (c_ClaveProdServ).") % idx)
-            # formato típico de catálogo (8 dígitos). Si manejas excepciones, quita esta verificación.
-            if not re.match(r'^\d{8}$', clave_sat):
-                raise UserError(_("Concepto #%s: ClaveProdServ debe ser 8 dígitos (catálogo c_ClaveProdServ).") % idx)
-
             clave_unidad = (c.get('clave_unidad') or c.get('claveunidad') or '').strip()
-            if not clave_unidad:
-                raise UserError(_("Concepto #%s: falta ClaveUnidad (c_ClaveUnidad).") % idx)
-            # validación básica de forma (2–5 alfanum). No es el catálogo completo.
-            if not re.match(r'^[A-Z0-9]{2,5}$', clave_unidad):
-                raise UserError(_("Concepto #%s: ClaveUnidad inválida (usa c_ClaveUnidad).") % idx)
-
-            if ('valor_unitario' not in c and 'price' not in c):
-                raise UserError(_("Concepto #%s: falta ValorUnitario.") % idx)
-
-            if not (c.get('descripcion') or '').strip():
-                raise UserError(_("Concepto #%s: falta Descripción.") % idx)
+            self._check_concepto(idx, clave_sat, clave_unidad,
+                                 ('valor_unitario' in c or 'price' in c), c.get('descripcion'))
 
             conceptos_calc.append({
                 'base': base,
@@ -403,7 +408,7 @@ class CfdiEngine(models.AbstractModel):
         if tipo == 'P':
             # En CFDI de Pago el comprobante SIEMPRE es Moneda="XXX"
             moneda = 'XXX'
-        comprobante = Element('cfdi:Comprobante', {
+        root = {
             'Version': '4.0',
             'Fecha': fecha,
             'Moneda': moneda,                     # ya forzas 'XXX' arriba si tipo == 'P'
@@ -416,52 +421,44 @@ class CfdiEngine(models.AbstractModel):
             'Sello': '',
             'Certificado': '',
             'NoCertificado': '',
-            'xmlns:cfdi': 'http://www.sat.gob.mx/cfd/4',
-            'xmlns:xsi':  'http://www.w3.org/2001/XMLSchema-instance',
-            'xsi:schemaLocation': 'http://www.sat.gob.mx/cfd/4 http://www.sat.gob.mx/sitio_internet/cfd/4/cfdv40.xsd',
-        })
+            'xmlns:cfdi': cfdi_xml.CFDI_NS,
+            'xmlns:xsi':  cfdi_xml.XSI_NS,
+            'xsi:schemaLocation': cfdi_xml.SCHEMA_CFDI,
+        }
+        doc = {'tipo': tipo, 'root': root}
 
 
         # Si es CFDI de Pago, agrega el schemaLocation del complemento Pagos 2.0
         if tipo == 'P':
-            sl = comprobante.get('xsi:schemaLocation', '').strip()
-            pagos_pair = 'http://www.sat.gob.mx/Pagos20 http://www.sat.gob.mx/sitio_internet/cfd/Pagos/Pagos20.xsd'
-            if pagos_pair not in sl:
-                comprobante.set('xsi:schemaLocation', (sl + ' ' + pagos_pair).strip())
+            root['xsi:schemaLocation'] = cfdi_xml.SCHEMA_CFDI + ' ' + cfdi_xml.SCHEMA_PAGOS
 
         ig = extras.get('informacion_global') if isinstance(extras, dict) else None
         if ig:
-            SubElement(comprobante, 'cfdi:InformacionGlobal', {
+            doc['informacion_global'] = {
                 'Periodicidad': ig['periodicidad'],  # '01'..'06'
                 'Meses': ig['meses'],                # '01'..'12'
                 'A\u00f1o': ig['anio'],              # 'Año' con ñ
-            })
+            }
 
         if serie:
-            comprobante.set('Serie', serie)
+            root['Serie'] = serie
         if folio:
-            comprobante.set('Folio', folio)
+            root['Folio'] = folio
         # TipoCambio si aplica
         # TipoCambio: solo para Ingreso/Egreso con moneda distinta a MXN (nunca para Pago/XXX)
         if tipo in ('I', 'E') and (moneda or 'MXN').upper() != 'MXN':
             tc = extras.get('tipo_cambio')
             if not tc:
                 raise UserError(_("Para moneda distinta a MXN debes informar TipoCambio en extras['tipo_cambio']."))
-            comprobante.set('TipoCambio', fmt6(tc))
+            root['TipoCambio'] = fmt6(tc)
 
         
         # Emisor
-        emisor_nombre_raw = (empresa.razonsocial or '')
-        if not emisor_nombre_raw.strip():
-            raise UserError(_("Configura el nombre/razón social del emisor."))
-        emisor_nombre = CfdiEngine._sat_norm_name(emisor_nombre_raw)
-
-        
-        SubElement(comprobante, 'cfdi:Emisor', {
+        doc['emisor'] = {
             'Rfc': emisor_rfc,
-            'Nombre': emisor_nombre,
+            'Nombre': profile.nombre,
             'RegimenFiscal': str(emisor_regimen),
-        })
+        }
 
         # Receptor
         
@@ -506,13 +503,13 @@ class CfdiEngine(models.AbstractModel):
 
 
 
-        SubElement(comprobante, 'cfdi:Receptor', {
+        doc['receptor'] = {
             'Rfc': rec_rfc,
             'Nombre': rec_nombre,
             'UsoCFDI': uso_cfdi_ok,
             'DomicilioFiscalReceptor': rec_cp,
             'RegimenFiscalReceptor': str(rec_regimen),
-        })
+        }
 
         # Relaciones
         related_uuids = list(related_uuids_kw)
@@ -521,9 +518,7 @@ class CfdiEngine(models.AbstractModel):
                 if getattr(rm, 'l10n_mx_edi_cfdi_uuid', False):
                     related_uuids.append(rm.l10n_mx_edi_cfdi_uuid)
         if relacion_tipo and related_uuids:
-            rel = SubElement(comprobante, 'cfdi:CfdiRelacionados', {'TipoRelacion': relacion_tipo})
-            for u in related_uuids:
-                SubElement(rel, 'cfdi:CfdiRelacionado', {'UUID': u})
+            doc['relacionados'] = (relacion_tipo, related_uuids)
 
         # Método/forma (solo I/E)
         if tipo in ('I','E'):
@@ -535,11 +530,11 @@ class CfdiEngine(models.AbstractModel):
                 raise UserError(_("Para PPD la FormaPago debe ser '99 - Por definir'."))
 
             if metodo:
-                comprobante.set('MetodoPago', metodo)
+                root['MetodoPago'] = metodo
             if forma:
-                comprobante.set('FormaPago', forma)
+                root['FormaPago'] = forma
 
-            cs = SubElement(comprobante, 'cfdi:Conceptos')
+            conceptos_xml = []
             for it in conceptos_calc:
                 
                 attrs_concepto = {
@@ -553,13 +548,9 @@ class CfdiEngine(models.AbstractModel):
                 }
                 if it.get('no_ident'):
                     attrs_concepto['NoIdentificacion'] = it['no_ident']
-                nodo = SubElement(cs, 'cfdi:Concepto', attrs_concepto)
-
-                if it['imp_obj'] in ('02','03') and it['traslados']:
-                    imps = SubElement(nodo, 'cfdi:Impuestos')
-                    tras = SubElement(imps, 'cfdi:Traslados')
-                    for t in it['traslados']:
-                        SubElement(tras, 'cfdi:Traslado', t)
+                traslados = it['traslados'] if it['imp_obj'] in ('02','03') else []
+                conceptos_xml.append((attrs_concepto, traslados))
+            doc['conceptos'] = conceptos_xml
 
             # ---- Impuestos globales (OBLIGATORIOS si hubo impuestos en conceptos) ----
             if agg_tras or agg_ret or exento_bases:
@@ -568,17 +559,14 @@ class CfdiEngine(models.AbstractModel):
                     attrs_imp['TotalImpuestosTrasladados'] = fmt2(traslados_total)
                 if retenciones_total:
                     attrs_imp['TotalImpuestosRetenidos'] = fmt2(retenciones_total)
-                imp_glob = SubElement(comprobante, 'cfdi:Impuestos', attrs_imp)
 
-                if agg_ret:
-                    rets = SubElement(imp_glob, 'cfdi:Retenciones')
-                    for (imp, _tf, _tasa), importe in sorted(agg_ret.items()):
-                        SubElement(rets, 'cfdi:Retencion', {'Impuesto': imp, 'Importe': fmt2(importe)})
+                retenciones = [{'Impuesto': imp, 'Importe': fmt2(importe)}
+                               for (imp, _tf, _tasa), importe in sorted(agg_ret.items())]
 
-                tras = SubElement(imp_glob, 'cfdi:Traslados')
+                traslados_glob = []
                 for key, importe in sorted(agg_tras.items()):
                     imp, tf, tasa = key
-                    SubElement(tras, 'cfdi:Traslado', {
+                    traslados_glob.append({
                         'Impuesto': imp,
                         'TipoFactor': tf,
                         'TasaOCuota': tasa or fmt6(0),
@@ -589,43 +577,32 @@ class CfdiEngine(models.AbstractModel):
                 # Si NO hubo traslados con Tasa y sí hubo EXENTOS, el SAT permite reportarlos con Base a nivel global
                 if not agg_tras and exento_bases:
                     for imp, base_sum in sorted(exento_bases.items()):
-                        SubElement(tras, 'cfdi:Traslado', {
+                        traslados_glob.append({
                             'Impuesto': imp, 'TipoFactor': 'Exento', 'Base': fmt2(base_sum),
                         })
+                doc['impuestos'] = {'attrs': attrs_imp, 'retenciones': retenciones,
+                                    'traslados': traslados_glob}
         # === Estructura para CFDI de Pago (tipo 'P') ===
         # === Estructura para CFDI de Pago (tipo 'P') ===
         if tipo == 'P':
-            # Concepto obligatorio 84111506
-            cs = SubElement(comprobante, 'cfdi:Conceptos')
-            SubElement(cs, 'cfdi:Concepto', {
-                'ClaveProdServ': '84111506',
-                'Cantidad': '1',         # ← sin decimales
-                'ClaveUnidad': 'ACT',
-                'Descripcion': 'Pago',
-                'ValorUnitario': '0',    # ← sin decimales (recomendado)
-                'Importe': '0',          # ← sin decimales (recomendado)
-                'ObjetoImp': '01',
-            })
-
-
+            # Concepto obligatorio 84111506 (fijo, ver cfdi_xml.PAGO_CONCEPTO)
             # Complemento Pagos 2.0
-            comp = SubElement(comprobante, 'cfdi:Complemento')
-            pagos = SubElement(comp, '{http://www.sat.gob.mx/Pagos20}Pagos', {'Version': '2.0'})
 
             # --- PATCH (orden correcto): primero Totales, luego los Pagos ---
             pagos_list = list((extras.get('pagos') or []))
             total_montos = sum(float(p.get('monto', 0.0)) for p in pagos_list)
 
             # 1) Totales ANTES que Pago
-            SubElement(pagos, '{http://www.sat.gob.mx/Pagos20}Totales', {
+            totales = {
                 'MontoTotalPagos': fmt2(total_montos),
                 # Si algún día agregas traslados/retenciones en el pago, agrega aquí los atributos de totales:
                 # 'TotalTrasladosBaseIVA16': fmt2(...),
                 # 'TotalTrasladosImpuestoIVA16': fmt2(...),
                 # etc.
-            })
+            }
 
             # 2) Luego cada Pago y sus Doctos
+            pagos_xml = []
             for p in pagos_list:
                 monto = float(p.get('monto', 0.0))
                 moneda_p = (p.get('moneda', 'MXN') or 'MXN').upper()
@@ -648,7 +625,7 @@ class CfdiEngine(models.AbstractModel):
                         raise UserError(_("Para MonedaP distinta de MXN debes informar TipoCambioP en el pago."))
                     attrs_pago['TipoCambioP'] = fmt6(tc_p)
 
-                pago = SubElement(pagos, '{http://www.sat.gob.mx/Pagos20}Pago', attrs_pago)
+                doctos = []
                 for d in (p.get('docs') or []):
                     attrs = {
                         'IdDocumento': d['uuid'],
@@ -664,15 +641,22 @@ class CfdiEngine(models.AbstractModel):
                         attrs['Serie'] = d['serie']
                     if d.get('folio'):
                         attrs['Folio'] = d['folio']
-                    SubElement(pago, '{http://www.sat.gob.mx/Pagos20}DoctoRelacionado', attrs)
+                    doctos.append(attrs)
+                pagos_xml.append((attrs_pago, doctos))
+            doc['pagos'] = {'totales': totales, 'pagos': pagos_xml}
             # --- /PATCH ---
 
 
-        _logger.info("CFDI RECEPTOR | RFC=%s | NombreXML='%s' | Regimen=%s | CP=%s | UsoCFDI=%s",
-             rec_rfc, rec_nombre, rec_regimen, rec_cp, uso_cfdi_ok)
+        if trace:
+            trace.event('receptor', "rfc=%s nombre='%s' regimen=%s cp=%s uso=%s",
+                        rec_rfc, rec_nombre, rec_regimen, rec_cp, uso_cfdi_ok)
 
-        xml_bytes = tostring(comprobante, encoding='utf-8', xml_declaration=True)
-        self._debug_dump_xml(xml_bytes, label="PRE-STAMP XML", param_key="mx_cfdi_core.log_xml_full", limit_kb=256)
+        # Serializador: 'etree' (ElementTree, default) o 'stream' (esqueleto precompilado por
+        # tipo, mismos bytes). Parámetro del sistema mx_cfdi_core.xml_serializer.
+        mode = (self.env['ir.config_parameter'].sudo().get_param('mx_cfdi_core.xml_serializer', 'etree') or 'etree').strip().lower()
+        xml_bytes = cfdi_xml.render(doc, mode)
+        if trace:
+            trace.xml('PRE-STAMP XML', xml_bytes)
         return xml_bytes
 
     # ======================== utils ================================
@@ -692,7 +676,12 @@ class CfdiEngine(models.AbstractModel):
     # Retorna: str PEM o cadena vacía si no se pudo obtener.
     def _empresa_cer_pem(self):
         empresa_id = self.env.context.get('empresa_id')
-        empresa = self.env['empresas.empresa'].browse(empresa_id)
+        if not empresa_id:
+            return ''
+        return self._emisor_profile(empresa_id).cer_pem
+
+    @api.model
+    def _read_empresa_cer_pem(self, empresa):
         # 1) Si tuvieras PEM en texto (opcional):
         txt = getattr(empresa, 'cfdi_sw_cer_pem', '') or ''
         if isinstance(txt, str) and txt.strip().startswith('-----BEGIN CERTIFICATE-----'):
@@ -717,6 +706,103 @@ class CfdiEngine(models.AbstractModel):
                 pass
         return ''
     
+    # Validaciones de forma de un concepto (#idx, base 1). Lanza UserError.
+    @staticmethod
+    def _check_concepto(idx, clave_sat, clave_unidad, has_vu, descripcion):
+        if not clave_sat:
+            raise UserError(_("Concepto #%s: falta ClaveProdServ (c_ClaveProdServ).") % idx)
+        # formato típico de catálogo (8 dígitos). Si manejas excepciones, quita esta verificación.
+        if not _RE_CLAVE_SAT.match(clave_sat):
+            raise UserError(_("Concepto #%s: ClaveProdServ debe ser 8 dígitos (catálogo c_ClaveProdServ).") % idx)
+
+        if not clave_unidad:
+            raise UserError(_("Concepto #%s: falta ClaveUnidad (c_ClaveUnidad).") % idx)
+        # validación básica de forma (2–5 alfanum). No es el catálogo completo.
+        if not _RE_CLAVE_UNIDAD.match(clave_unidad):
+            raise UserError(_("Concepto #%s: ClaveUnidad inválida (usa c_ClaveUnidad).") % idx)
+
+        if not has_vu:
+            raise UserError(_("Concepto #%s: falta ValorUnitario.") % idx)
+
+        if not (descripcion or '').strip():
+            raise UserError(_("Concepto #%s: falta Descripción.") % idx)
+
+    # Perfil compilado del emisor: RFC/régimen/CP validados, nombre normalizado SAT y
+    # metadatos del CSD ya parseados. Se calcula una vez por empresa y worker (ormcache); la
+    # llave lleva los datos fiscales y el write_date de la empresa, así un cambio fiscal o de
+    # certificado usa otra entrada sin limpiar la caché del registro.
+    # Sólo guarda datos: `error` es (código, parámetros) y se traduce al lanzarlo
+    # (_emisor_error_message), en el idioma de quien timbra.
+    @api.model
+    def _emisor_profile(self, empresa_id):
+        empresa = self.env['empresas.empresa'].sudo().browse(int(empresa_id))
+        if not empresa.exists():
+            raise UserError(_('Empresa no encontrada'))
+        fiscal = (empresa.rfc or '', empresa.razonsocial or '', empresa.cp or '', empresa.regimen_fiscal or '')
+        return self._compile_emisor_profile(empresa.id, empresa.write_date, fiscal)
+
+    @tools.ormcache('empresa_id', 'write_date', 'fiscal')
+    def _compile_emisor_profile(self, empresa_id, write_date, fiscal):
+        empresa = self.env['empresas.empresa'].sudo().browse(empresa_id)
+        rfc, nombre_raw, cpostal, regimen = fiscal
+        cpostal = cpostal.strip()
+        rfc = rfc.upper()
+        regimen = regimen.strip()
+        is_moral = self._is_moral_rfc(rfc)
+
+        error = False
+        if not (cpostal.isdigit() and len(cpostal) == 5):
+            error = ('cp', {})
+        elif not rfc:
+            error = ('rfc', {})
+        elif not regimen:
+            error = ('regimen', {})
+        elif is_moral and regimen in PF_CODES:
+            error = ('pm_regimen_pf', {'rfc': rfc, 'reg': regimen})
+        elif (not is_moral) and regimen in PM_CODES:
+            error = ('pf_regimen_pm', {'rfc': rfc, 'reg': regimen})
+        elif not nombre_raw.strip():
+            error = ('nombre', {})
+
+        pem = self._read_empresa_cer_pem(empresa)
+        serial = not_before = not_after = None
+        cer_error = False
+        if pem:
+            try:
+                from cryptography import x509
+                from cryptography.hazmat.backends import default_backend
+                cert = x509.load_pem_x509_certificate(pem.encode('utf-8'), default_backend())
+                serial = format(cert.serial_number, 'x')
+                # *_utc existe desde cryptography 42; antes, el valor ingenuo ya es UTC
+                not_before = getattr(cert, 'not_valid_before_utc', None) \
+                    or cert.not_valid_before.replace(tzinfo=timezone.utc)
+                not_after = getattr(cert, 'not_valid_after_utc', None) \
+                    or cert.not_valid_after.replace(tzinfo=timezone.utc)
+            except Exception as e:
+                cer_error = str(e)
+
+        return EmisorProfile(
+            empresa_id=empresa_id, rfc=rfc, regimen=regimen,
+            nombre=CfdiEngine._sat_norm_name(nombre_raw), lugar_expedicion=cpostal,
+            is_moral=is_moral, error=error, cer_pem=pem, cer_serial=serial,
+            cer_not_before=not_before, cer_not_after=not_after, cer_error=cer_error,
+        )
+
+    # Mensaje (traducido al idioma actual) de un error del perfil del emisor.
+    def _emisor_error_message(self, error):
+        code, params = error
+        if code == 'cp':
+            return _("Configura el C.P. de la compañía (5 dígitos) para LugarExpedicion.")
+        if code == 'rfc':
+            return _("Configura el RFC Emisor (cfdi_sw_rfc o VAT).")
+        if code == 'regimen':
+            return _("Falta el Régimen Fiscal de la empresa emisora.")
+        if code == 'pm_regimen_pf':
+            return _("El RFC %(rfc)s es de Persona Moral pero el régimen %(reg)s es de PF.") % params
+        if code == 'pf_regimen_pm':
+            return _("El RFC %(rfc)s es de Persona Física pero el régimen %(reg)s es de PM.") % params
+        return _("Configura el nombre/razón social del emisor.")
+
     # Resuelve y devuelve el proveedor de timbrado (modelo PAC) para la empresa en contexto.
     # Lee empresas.empresa.cfdi_provider o el parámetro del sistema 'mx_cfdi_engine.provider'.
     # Devuelve el record del proveedor con contexto empresa_id.
@@ -741,7 +827,7 @@ class CfdiEngine(models.AbstractModel):
             raise UserError(_('Se requiere que seleccione el proveedor de CFDI en Ajustes.'))
         #    provider_key = 'mx.cfdi.engine.provider.dummy'
     
-        _logger.info(
+        _logger.debug(
             "CFDI PROVIDER | resolved=%s | empresa=%s | icp=%s",
             provider_key, getattr(empresa, 'cfdi_provider', None),
             ICP.get_param('mx_cfdi_engine.provider', '')
@@ -755,6 +841,7 @@ class CfdiEngine(models.AbstractModel):
 
 
     # Crea un ir.attachment (application/xml) con el CFDI timbrado y lo enlaza al documento de origen (origin_model, origin_id). Usa el UUID para nombrar el archivo.
+    # El adjunto referencia el mismo blob que el documento (cfdi_blob_id) y se escribe con `raw` (sin base64).
     # Retorna: ir.attachment (record).
     # Lanza: UserError si no se recibió xml_bytes.
     def _attach_xml(self, origin_model, origin_id, xml_bytes, doc):
@@ -762,30 +849,38 @@ class CfdiEngine(models.AbstractModel):
             raise UserError(_("No se recibió XML desde el proveedor."))
         if isinstance(xml_bytes, str):
             xml_bytes = xml_bytes.encode('utf-8')
-        b64 = base64.b64encode(xml_bytes).decode("ascii")
+        blob = doc.blob_id or self.env['mx.cfdi.blob']._store(xml_bytes)
         name = f"{doc.uuid or 'cfdi'}-{origin_model.replace('.', '_')}-{origin_id}.xml"
         return self.env['ir.attachment'].sudo().create({
             'name': name,
             'res_model': origin_model,
             'res_id': origin_id,
             'type': 'binary',
-            'datas': b64,
+            'raw': xml_bytes,
+            'cfdi_blob_id': blob.id,
             'mimetype': 'application/xml',
             'description': _('CFDI timbrado %s') % (doc.uuid or ''),
         })
     
     # Adjunta el XML previo al timbrado (para auditoría/diagnóstico). No lanza error si falta xml_bytes; solo regresa.
+    # Si el origen ya tiene ese mismo XML (reintentos con el mismo contenido) no lo vuelve a adjuntar.
     def _attach_prestamp(self, origin_model, origin_id, xml_bytes, note="pre-stamp"):
         if not xml_bytes:
             return
         if isinstance(xml_bytes, str):
             xml_bytes = xml_bytes.encode('utf-8')
-        self.env['ir.attachment'].sudo().create({
+        Att = self.env['ir.attachment'].sudo()
+        blob = self.env['mx.cfdi.blob']._store(xml_bytes)
+        if Att.search_count([('res_model', '=', origin_model), ('res_id', '=', origin_id),
+                             ('cfdi_blob_id', '=', blob.id)], limit=1):
+            return
+        Att.create({
             'name': f'{note}-{fields.Datetime.now()}.xml',
             'res_model': origin_model,
             'res_id': origin_id,
             'type': 'binary',
-            'datas': base64.b64encode(xml_bytes).decode('ascii'),
+            'raw': xml_bytes,
+            'cfdi_blob_id': blob.id,
             'mimetype': 'application/xml',
             'description': _('XML previo a timbrado (%s)') % note,
         })
@@ -828,6 +923,73 @@ class CfdiEngine(models.AbstractModel):
             })
         return res
     
+    # Cancelación por lote (cierre de mes). items: [{'uuid', 'empresa_id', 'origin_model',
+    # 'origin_id', 'motivo', 'folio_sustitucion'}].
+    #   - Agrupa por empresa y llama provider._cancel_many (SW lo hace en paralelo con límite
+    #     de tasa); un error de un UUID no detiene al resto.
+    #   - Marca los mx.cfdi.document cancelados con un solo write y crea los acuses en un
+    #     solo create, cada uno en su savepoint: si fallan, el resultado del PAC se regresa
+    #     igual (el SAT ya canceló esos UUID) y el llamador no lo pierde.
+    # Retorna: {uuid: {'ok', 'status', 'acuse', 'error', 'elapsed'}}.
+    @api.model
+    def cancel_cfdi_many(self, items):
+        results = {}
+        by_empresa = {}
+        for it in items:
+            if it.get('uuid'):
+                by_empresa.setdefault(it.get('empresa_id'), []).append(it)
+        for empresa_id, group in by_empresa.items():
+            empresa = self.env['empresas.empresa'].browse(empresa_id).exists() if empresa_id else None
+            rfc = ((empresa and empresa.rfc) or '').upper()
+            if not rfc:
+                for it in group:
+                    results[it['uuid']] = {'ok': False, 'status': None, 'acuse': None, 'elapsed': 0.0,
+                                           'error': _('Falta el RFC del emisor (empresa).')}
+                continue
+            eng = self.with_context(empresa_id=empresa_id)
+            try:
+                results.update(eng._get_provider()._cancel_many(group, rfc=rfc))
+            except Exception as e:
+                if not isinstance(e, UserError):
+                    _logger.exception("CFDI CANCEL MANY | empresa=%s falló", empresa_id)
+                for it in group:
+                    results[it['uuid']] = {'ok': False, 'status': None, 'acuse': None,
+                                           'elapsed': 0.0, 'error': str(e) or repr(e)}
+
+        ok_uuids = [u for u, r in results.items() if r.get('ok')]
+        if ok_uuids:
+            try:
+                with self.env.cr.savepoint():
+                    self.env['mx.cfdi.document'].search([
+                        ('uuid', 'in', ok_uuids), ('state', '!=', 'canceled'),
+                    ]).write({'state': 'canceled'})
+            except Exception:
+                _logger.exception("CFDI CANCEL MANY | no se marcaron los documentos cancelados: %s", ok_uuids)
+        att_vals = []
+        for it in items:
+            res = results.get(it.get('uuid')) or {}
+            acuse = res.get('acuse')
+            if not (res.get('ok') and acuse):
+                continue
+            if isinstance(acuse, str):
+                acuse = acuse.encode('utf-8')
+            att_vals.append({
+                'name': f"cancelacion-{it['uuid']}.xml",
+                'res_model': it['origin_model'],
+                'res_id': it['origin_id'],
+                'type': 'binary',
+                'raw': acuse,
+                'mimetype': 'application/xml',
+                'description': _('Acuse de cancelación %s') % (it['uuid'],),
+            })
+        if att_vals:
+            try:
+                with self.env.cr.savepoint():
+                    self.env['ir.attachment'].sudo().create(att_vals)
+            except Exception:
+                _logger.exception("CFDI CANCEL MANY | no se guardaron %s acuses de cancelación", len(att_vals))
+        return results
+
     # Obtiene el nombre legal de un partner (l10n_mx_edi_legal_name o name).
     # Si normalize=True, aplica normalización SAT con _sat_norm_name.
     # Retorna: str (puede ser vacío).
@@ -839,54 +1001,119 @@ class CfdiEngine(models.AbstractModel):
         return CfdiEngine._sat_norm_name(raw) if normalize else raw
 
     # ======================= debugs/logs =======================
-    
-    # Loguea hash SHA256 y tamaño del XML y, opcionalmente, contenido completo/truncado.
-    # Se controla con el parámetro del sistema 'param_key' ('1/true/yes' para habilitar).
-    # No lanza; atrapa sus propias excepciones de logging.
-    def _debug_dump_xml(self, xml_bytes, *, label="XML", param_key="mx_cfdi_core.log_xml_full", limit_kb=128):
-        """Loggea el XML (completo o truncado) y su SHA256. Controlado por parámetro del sistema."""
+
+    # Benchmark del timbrado de punta a punta (generate_and_stamp con el proveedor configurado).
+    # Pensado para `odoo shell` contra el simulador de SW (mx_cfdi_provider_sw/services/sw_simulator.py)
+    # o el sandbox:
+    #     env['mx.cfdi.engine']._bench_stamp(empresa_id=1, receptor_id=7, n=50)
+    # Cada timbrado corre en un savepoint que se revierte (rollback=True) para no dejar documentos;
+    # los adjuntos del filestore los limpia el GC de Odoo. Como el rollback borra todo rastro
+    # local, sólo corre contra un proveedor de prueba (_is_test_endpoint: dummy, sandbox o
+    # simulador); allow_real_pac=True lo permite contra el PAC real.
+    # Regresa y loguea: n, ok, errors, p50/p95/max (ms), timbres por minuto, queries promedio/p95
+    # por timbrado, documentos con XML pendiente y el primer error.
+    @api.model
+    def _bench_stamp(self, *, empresa_id, receptor_id, n=20, lines=5, tipo='I',
+                     origin_model='res.partner', origin_id=None, rollback=True,
+                     allow_real_pac=False, **kw):
+        provider = self.with_context(empresa_id=empresa_id)._get_provider()
+        if not (allow_real_pac or provider._is_test_endpoint()):
+            raise UserError(_('El benchmark timbra CFDI reales con %s (no es dummy, sandbox ni el '
+                              'simulador); pasa allow_real_pac=True si es intencional.') % provider._name)
+        cr = self.env.cr
+        conceptos = kw.pop('conceptos', None) or [{
+            'cantidad': 1 + i % 3,
+            'valor_unitario': 100.0 + i,
+            'iva': 0.16,
+            'clave_sat': '01010101',
+            'clave_unidad': 'H87',
+            'descripcion': 'Concepto benchmark %s' % (i + 1),
+        } for i in range(max(1, int(lines)))]
+        kw.setdefault('uso_cfdi', 'G03')
+        kw.setdefault('metodo', 'PUE')
+        kw.setdefault('forma', '01')
+        eng = self.with_context(empresa_id=empresa_id,
+                                cfdi_trace_cfg=self.with_context(empresa_id=empresa_id)._trace_config())
+        times, queries, errors, pending = [], [], [], 0
+        t_start = time.monotonic()
+        for _i in range(max(1, int(n))):
+            sp = cr.savepoint(flush=True)
+            q0, t0 = cr.sql_log_count, time.monotonic()
+            try:
+                res = eng.generate_and_stamp(
+                    origin_model=origin_model, origin_id=origin_id or receptor_id,
+                    empresa_id=empresa_id, tipo=tipo, receptor_id=receptor_id,
+                    conceptos=conceptos, **kw)
+                self.env.flush_all()
+                times.append((time.monotonic() - t0) * 1000.0)
+                queries.append(cr.sql_log_count - q0)
+                pending += res.get('xml_state') == 'pending'
+            except Exception as e:
+                errors.append(str(e) or repr(e))
+            finally:
+                sp.close(rollback=rollback)
+        wall = time.monotonic() - t_start
+
+        def _pct(values, q):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+        report = {
+            'n': max(1, int(n)),
+            'ok': len(times),
+            'errors': len(errors),
+            'p50_ms': round(_pct(times, 0.50), 1),
+            'p95_ms': round(_pct(times, 0.95), 1),
+            'max_ms': round(max(times), 1) if times else 0.0,
+            'per_minute': round(len(times) * 60.0 / wall, 1) if wall > 0 else 0.0,
+            'queries_avg': round(sum(queries) / len(queries), 1) if queries else 0.0,
+            'queries_p95': _pct(queries, 0.95),
+            'xml_pending': pending,
+            'first_error': errors[0] if errors else '',
+        }
+        _logger.info("CFDI BENCH | %s", report)
+        return report
+
+
+    # Configuración de la traza CFDI (services/cfdi_trace.py). Los lotes (cola de timbrado,
+    # facturación masiva) la resuelven una vez y la pasan en contexto como cfdi_trace_cfg;
+    # si no viene, se lee de parámetros del sistema (mx_cfdi_core.trace_*).
+    @api.model
+    def _trace_config(self):
+        cfg = self.env.context.get('cfdi_trace_cfg')
+        if cfg is None:
+            cfg = cfdi_trace.config_from_params(self.env['ir.config_parameter'].sudo().get_param)
+        return cfg
+
+    # Atributos del TimbreFiscalDigital del XML timbrado (sólo para la traza).
+    @staticmethod
+    def _tfd_attrs(xml_bytes):
         try:
-            ICP = self.env['ir.config_parameter'].sudo()
-            on = (ICP.get_param(param_key, '0') or '').lower() in ('1', 'true', 'yes')
-            # Siempre loggeamos el hash para rastreo; el contenido solo si 'on'
-            h = hashlib.sha256(xml_bytes if isinstance(xml_bytes, (bytes, bytearray)) else str(xml_bytes).encode('utf-8')).hexdigest()
-            _logger.info("CFDI DEBUG | %s SHA256=%s | len=%s", label, h, len(xml_bytes or b""))
-            if not on:
-                return
-            txt = xml_bytes.decode('utf-8', errors='ignore') if isinstance(xml_bytes, (bytes, bytearray)) else str(xml_bytes)
-            max_bytes = limit_kb * 1024
-            if len(txt) > max_bytes:
-                _logger.info("CFDI DEBUG | %s (primeros %d KB):\n%s", label, limit_kb, txt[:max_bytes])
-            else:
-                _logger.info("CFDI DEBUG | %s FULL:\n%s", label, txt)
+            import xml.etree.ElementTree as ET
+            ns_cfdi = "http://www.sat.gob.mx/cfd/4"
+            ns_tfd = "http://www.sat.gob.mx/TimbreFiscalDigital"
+            root = ET.fromstring(xml_bytes)
+            for comp in root.findall(f".//{{{ns_cfdi}}}Complemento"):
+                tfd = comp.find(f".//{{{ns_tfd}}}TimbreFiscalDigital")
+                if tfd is not None:
+                    return dict(tfd.attrib)
+            return 'TFD no encontrado en XML timbrado'
         except Exception as e:
-            _logger.warning("CFDI DEBUG | Error en _debug_dump_xml(%s): %s", label, e)
-
+            return 'Error leyendo TFD: %s' % e
+    
     # Intenta leer el certificado CSD en PEM y cargarlo con cryptography.x509 para
     # validar que es legible (y dejar rastro en logs). No falla el flujo si no puede.
+    # Usa los metadatos ya parseados del perfil del emisor (no vuelve a decodificar el .cer).
     def _log_csd_validity(self):
-        pem = self._empresa_cer_pem()
-        if not pem:
+        empresa_id = self.env.context.get('empresa_id')
+        profile = self._emisor_profile(empresa_id) if empresa_id else None
+        if not (profile and profile.cer_pem):
             _logger.warning("CSD DEBUG | No tengo PEM del CSD; no puedo leer vigencia.")
             return
-        try:
-            from cryptography import x509
-            from cryptography.hazmat.backends import default_backend
-            cert = x509.load_pem_x509_certificate(pem.encode('utf-8'), default_backend())
-        except Exception as e:
-            _logger.warning("CSD DEBUG | No se pudo leer vigencia del CSD: %s", e)
-
-    # Utilidad de diagnóstico: compara la FECHA del XML con now_utc y registra delta (comentado) para detectar desfases. No interrumpe el flujo.
-    def _debug_dates(self, fecha_str, cpostal):
-        now_utc = fields.Datetime.now()
-        local_now = self._mx_local_now()
-        try:
-            dt_xml = fields.Datetime.from_string(fecha_str.replace('T', ' '))
-            delta = abs(now_utc - dt_xml)
-        #    _logger.info("CFDI DEBUG | delta(now_utc vs FECHA_XML)=%s", delta)
-        except Exception as e:
-            _logger.warning("CFDI DEBUG | No se pudo evaluar delta: %s", e)
-
+        if profile.cer_error:
+            _logger.warning("CSD DEBUG | No se pudo leer vigencia del CSD: %s", profile.cer_error)
 
     # =============================== Validaciones  ================================
 
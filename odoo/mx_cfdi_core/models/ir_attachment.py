@@ -0,0 +1,36 @@
+# mx_cfdi_core/models/ir_attachment.py
+from odoo import models, fields, api
+"""
+Adjuntos respaldados por el almacén de XML CFDI (mx.cfdi.blob).
+    - cfdi_blob_id liga el adjunto con el blob de su contenido.
+    - Un adjunto "desprendido" (sin store_fname ni db_datas) lee su contenido del blob; así
+      /web/content y `datas` siguen funcionando sin guardar otra copia.
+"""
+
+
+class IrAttachment(models.Model):
+    _inherit = 'ir.attachment'
+
+    cfdi_blob_id = fields.Many2one('mx.cfdi.blob', string='Blob CFDI', index='btree_not_null',
+                                   ondelete='restrict', copy=True)
+
+    @api.depends('store_fname', 'db_datas', 'cfdi_blob_id')
+    def _compute_raw(self):
+        detached = self.filtered(lambda a: a.cfdi_blob_id and not a.store_fname and not a.db_datas)
+        super(IrAttachment, self - detached)._compute_raw()
+        for att in detached:
+            att.raw = att.cfdi_blob_id._read()
+
+    # Suelta la copia propia del contenido (el blob la conserva). El archivo del filestore se
+    # marca para el GC de Odoo, que sólo lo borra si ningún otro adjunto lo usa.
+    def _cfdi_detach_content(self):
+        atts = self.filtered('cfdi_blob_id')
+        if not atts:
+            return
+        fnames = [a.store_fname for a in atts if a.store_fname]
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET store_fname = NULL, db_datas = NULL WHERE id IN %s",
+            [tuple(atts.ids)])
+        atts.invalidate_recordset(['store_fname', 'db_datas', 'raw', 'datas'])
+        for fname in fnames:
+            self._file_delete(fname)
@@ -1,6 +1,7 @@
 # mx_cfdi_engine/models/provider_base.py
 from odoo import models, api, _
 from odoo.exceptions import UserError
+import time
 
 class CfdiProviderBase(models.AbstractModel):
     _name = "mx.cfdi.engine.provider.base"
@@ -14,6 +15,36 @@ class CfdiProviderBase(models.AbstractModel):
     def _cancel(self, uuid, rfc=None, cer_pem=None, key_pem=None, password=None, **kwargs):
         raise UserError(_("Implementa _cancel en un proveedor."))
 
+    # Cancela varios UUID de la empresa en contexto. items: [{'uuid', 'motivo', 'folio_sustitucion'}].
+    # Regresa {uuid: {'ok', 'status', 'acuse', 'error', 'elapsed'}} sin lanzar por un UUID.
+    # Default secuencial; los proveedores pueden paralelizarlo.
+    @api.model
+    def _cancel_many(self, items, rfc=None):
+        results = {}
+        for it in items:
+            t0 = time.monotonic()
+            try:
+                res = self._cancel(it['uuid'], rfc=rfc, motivo=it.get('motivo') or '02',
+                                   folio_sustitucion=it.get('folio_sustitucion')) or {}
+                out = {'ok': True, 'status': res.get('status'), 'acuse': res.get('acuse'), 'error': ''}
+            except Exception as e:
+                out = {'ok': False, 'status': None, 'acuse': None, 'error': str(e) or repr(e)}
+            out['elapsed'] = time.monotonic() - t0
+            results[it['uuid']] = out
+        return results
+
+    # True si el proveedor no emite CFDI reales ante el SAT (dummy, sandbox, simulador local).
+    # Los benchmarks que timbran y revierten la transacción sólo corren contra éstos.
+    @api.model
+    def _is_test_endpoint(self):
+        return False
+
     @api.model
     def _status(self, uuid, rfc=None):
-        raise UserError(_("Implementa _status en un proveedor."))
\ No newline at end of file
+        raise UserError(_("Implementa _status en un proveedor."))
+
+    # Un intento (sin esperas) de obtener el XML timbrado por UUID.
+    # Regresa {'xml': bytes, 'acuse': bytes|None} o None si el PAC aún no lo expone.
+    @api.model
+    def _fetch_stamped_xml(self, uuid):
+        raise UserError(_("Implementa _fetch_stamped_xml en un proveedor."))
@@ -15,3 +15,6 @@ class CfdiProviderDummy(models.AbstractModel):
     # No valida ni firma el XML; solo para entornos de desarrollo/pruebas.
     def _stamp_xml(self, xml_bytes):
         return {"uuid": str(uuid.uuid4()), "xml_timbrado": xml_bytes}
+
+    def _is_test_endpoint(self):
+        return True
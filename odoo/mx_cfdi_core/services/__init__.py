@@ -0,0 +1,10 @@
+"""Services for mx_cfdi_core.
+
+Helpers sin ORM del engine CFDI (serialización del XML del Comprobante, cálculo
+agrupado de impuestos por columnas, traza del timbrado y exportación ZIP en flujo).
+"""
+
+from . import cfdi_xml
+from . import cfdi_taxes
+from . import cfdi_trace
+from . import cfdi_zip
@@ -0,0 +1,135 @@
+# mx_cfdi_core/services/cfdi_taxes.py
+"""Conceptos en columnas y cálculo agrupado de impuestos para el Comprobante.
+
+`Conceptos` guarda cada atributo como una lista paralela (cantidad, valor unitario,
+tasas de IVA/IEPS, objeto de impuesto, claves SAT...). `calcular()` recorre esas
+columnas una sola vez y regresa las bases por concepto, los traslados por concepto
+y las sumas agrupadas por (Impuesto, TipoFactor, TasaOCuota).
+
+Las reglas de redondeo son las mismas que el cálculo por concepto del engine
+(round(cantidad * valor_unitario, 2) y round(base * tasa, 2) por línea, sumas en el
+orden de los conceptos), así que el XML resultante no cambia.
+"""
+
+
+def fmt2(x):
+    return f"{float(x):.2f}"
+
+
+def fmt6(x):
+    return f"{float(x):.6f}"
+
+
+class Conceptos:
+    """Conceptos CFDI en columnas (listas paralelas del mismo largo)."""
+
+    COLUMNS = ('qty', 'vu', 'iva', 'ieps', 'iva_factor', 'objeto_imp',
+               'clave_sat', 'clave_unidad', 'no_ident', 'descripcion', 'has_vu')
+
+    __slots__ = COLUMNS
+
+    def __init__(self, **cols):
+        n = None
+        for name in self.COLUMNS:
+            col = list(cols.get(name) or [])
+            if n is None:
+                n = len(col)
+            if name in ('no_ident', 'iva_factor', 'objeto_imp', 'has_vu') and not col:
+                col = [None] * n if name != 'has_vu' else [True] * n
+            if len(col) != n:
+                raise ValueError('La columna %s no tiene %s elementos.' % (name, n))
+            setattr(self, name, col)
+
+    def __len__(self):
+        return len(self.qty)
+
+    # Convierte la lista de dicts que recibe generate_and_stamp. Regresa None si algún
+    # concepto trae su estructura de impuestos explícita (ese caso se calcula por concepto).
+    @classmethod
+    def from_dicts(cls, conceptos):
+        if any(c.get('impuestos') for c in conceptos):
+            return None
+        return cls(
+            qty=[float(c.get('cantidad') or c.get('qty') or 1.0) for c in conceptos],
+            vu=[float(c.get('valor_unitario') or c.get('price') or 0.0) for c in conceptos],
+            iva=[float(c.get('iva') or 0.0) for c in conceptos],
+            ieps=[float(c.get('ieps') or 0.0) for c in conceptos],
+            iva_factor=[(c.get('iva_factor') or '').title() for c in conceptos],
+            objeto_imp=[c.get('objeto_imp') for c in conceptos],
+            clave_sat=[(c.get('clave_sat') or c.get('claveprodserv') or '').strip() for c in conceptos],
+            clave_unidad=[(c.get('clave_unidad') or c.get('claveunidad') or '').strip() for c in conceptos],
+            no_ident=[str(c.get('no_identificacion') or c.get('no_ident') or '') for c in conceptos],
+            descripcion=[c.get('descripcion') for c in conceptos],
+            has_vu=[('valor_unitario' in c or 'price' in c) for c in conceptos],
+        )
+
+    def subtotal(self):
+        return round(sum(round(q * v, 2) for q, v in zip(self.qty, self.vu)), 2)
+
+
+def calcular(cols):
+    """Bases, traslados por concepto y agregados del Comprobante.
+
+    Regresa dict con: bases, imp_obj, traslados (lista por concepto), agg_base, agg_tras,
+    exento_bases, subtotal_sum, traslados_total.
+    """
+    bases = [round(q * v, 2) for q, v in zip(cols.qty, cols.vu)]
+    bases_s = [fmt2(b) for b in bases]
+    iva, ieps, factors = cols.iva, cols.ieps, cols.iva_factor
+    imp_obj = [o or ('02' if (i or e) else '01') for o, i, e in zip(cols.objeto_imp, iva, ieps)]
+
+    tasas = {}            # tasa -> 'x.xxxxxx' (una sola vez por tasa distinta)
+    agg_base, agg_tras, exento_bases = {}, {}, {}
+    traslados_total = 0.0
+    traslados = []
+    for k, obj in enumerate(imp_obj):
+        if obj != '02':
+            traslados.append([])
+            continue
+        base, base_s, r_iva, r_ieps = bases[k], bases_s[k], iva[k], ieps[k]
+        rows = []
+        if r_iva:
+            imp = round(base * r_iva, 2)
+            tasa = tasas.get(r_iva) or tasas.setdefault(r_iva, fmt6(r_iva))
+            key = ('002', 'Tasa', tasa)
+            agg_base[key] = agg_base.get(key, 0.0) + base
+            agg_tras[key] = agg_tras.get(key, 0.0) + imp
+            traslados_total += imp
+            rows.append({'Base': base_s, 'Impuesto': '002', 'TipoFactor': 'Tasa',
+                         'TasaOCuota': tasa, 'Importe': fmt2(imp)})
+        elif factors[k] == 'Tasa':
+            tasa = fmt6(0)
+            key = ('002', 'Tasa', tasa)
+            agg_base[key] = agg_base.get(key, 0.0) + base
+            rows.append({'Base': base_s, 'Impuesto': '002', 'TipoFactor': 'Tasa',
+                         'TasaOCuota': tasa, 'Importe': fmt2(0)})
+        elif factors[k] == 'Exento':
+            exento_bases['002'] = exento_bases.get('002', 0.0) + base
+            rows.append({'Base': base_s, 'Impuesto': '002', 'TipoFactor': 'Exento'})
+        if r_ieps:
+            imp = round(base * r_ieps, 2)
+            tasa = tasas.get(r_ieps) or tasas.setdefault(r_ieps, fmt6(r_ieps))
+            key = ('003', 'Tasa', tasa)
+            agg_base[key] = agg_base.get(key, 0.0) + base
+            agg_tras[key] = agg_tras.get(key, 0.0) + imp
+            traslados_total += imp
+            rows.append({'Base': base_s, 'Impuesto': '003', 'TipoFactor': 'Tasa',
+                         'TasaOCuota': tasa, 'Importe': fmt2(imp)})
+        if not rows:
+            exento_bases['002'] = exento_bases.get('002', 0.0) + base
+            rows.append({'Base': base_s, 'Impuesto': '002', 'TipoFactor': 'Exento'})
+        traslados.append(rows)
+
+    subtotal_sum = 0.0
+    for b in bases:
+        subtotal_sum += b
+    return {
+        'bases': bases,
+        'imp_obj': imp_obj,
+        'traslados': traslados,
+        'agg_base': agg_base,
+        'agg_tras': agg_tras,
+        'exento_bases': exento_bases,
+        'subtotal_sum': subtotal_sum,
+        'traslados_total': traslados_total,
+    }
@@ -0,0 +1,208 @@
+# mx_cfdi_core/services/cfdi_trace.py
+"""Traza estructurada del timbrado CFDI con costo casi nulo cuando está apagada.
+
+    - TraceConfig se arma UNA vez por lote desde parámetros del sistema (config_from_params);
+      el engine la toma del contexto (cfdi_trace_cfg) si el lote ya la resolvió.
+    - start(cfg, key) decide el muestreo y regresa un Trace o NULL. NULL es falso en
+      booleano, así que el código caliente hace `if trace:` y no arma strings ni hashes.
+    - Los eventos guardan (fmt, args) y se formatean sólo al emitirse al logger (si el nivel
+      lo permite) o al volcar el anillo (dump()).
+    - El anillo es por documento: máximo `ring_events` eventos y `ring_kb` KB al volcarse
+      (se conservan los más recientes).
+    - current()/activate() exponen la traza activa a código que no la recibe por parámetro
+      (p.ej. el provider del PAC), vía contextvars.
+
+Niveles (mx_cfdi_core.trace_level):
+    off      nada (default)
+    events   eventos del flujo (emisor, receptor, proveedor, reintentos, UUID)
+    hash     + SHA-256 y tamaño de cada XML
+    preview  + primeros `preview_kb` KB del XML
+    full     + XML completo hasta `full_kb` KB
+"""
+import contextlib
+import contextvars
+import hashlib
+import logging
+import random
+import time
+from collections import deque, namedtuple
+
+_logger = logging.getLogger(__name__)
+
+LEVELS = ('off', 'events', 'hash', 'preview', 'full')
+_RANK = {name: i for i, name in enumerate(LEVELS)}
+
+TraceConfig = namedtuple('TraceConfig', [
+    'level', 'sample', 'sink', 'preview_kb', 'full_kb', 'ring_events', 'ring_kb',
+])
+
+OFF = TraceConfig('off', 0.0, 'both', 8, 256, 200, 64)
+
+
+def _truthy(v):
+    return (v or '').strip().lower() in ('1', 'true', 'yes')
+
+
+def config_from_params(get_param):
+    """Arma TraceConfig a partir de ir.config_parameter.get_param (una lectura por llave)."""
+    level = (get_param('mx_cfdi_core.trace_level') or '').strip().lower()
+    if not level:
+        # Compatibilidad: los switches históricos de volcado equivalen a 'full'
+        legacy = (_truthy(get_param('mx_cfdi_core.log_xml_full'))
+                  or _truthy(get_param('mx_cfdi_core.log_xml_timbrado_full')))
+        level = 'full' if legacy else 'off'
+    if level not in _RANK or level == 'off':
+        return OFF
+
+    def _num(key, default, cast):
+        try:
+            return cast(get_param(key) or default)
+        except (TypeError, ValueError):
+            return default
+
+    sink = (get_param('mx_cfdi_core.trace_sink') or 'both').strip().lower()
+    return TraceConfig(
+        level=level,
+        sample=min(1.0, max(0.0, _num('mx_cfdi_core.trace_sample', 1.0, float))),
+        sink=sink if sink in ('log', 'document', 'both') else 'both',
+        preview_kb=max(1, _num('mx_cfdi_core.trace_preview_kb', 8, int)),
+        full_kb=max(1, _num('mx_cfdi_core.trace_full_kb', 256, int)),
+        ring_events=max(1, _num('mx_cfdi_core.trace_ring_events', 200, int)),
+        ring_kb=max(1, _num('mx_cfdi_core.trace_ring_kb', 64, int)),
+    )
+
+
+class _NullTrace:
+    """Traza apagada / no muestreada: falsa en booleano y sin efectos."""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def wants(self, level):
+        return False
+
+    def event(self, name, fmt='', *args):
+        pass
+
+    def xml(self, label, data):
+        pass
+
+    def set_key(self, key):
+        pass
+
+    def dump(self):
+        return ''
+
+
+NULL = _NullTrace()
+
+
+class _LazyXml:
+    """Resumen del XML que sólo se calcula al formatearse."""
+
+    __slots__ = ('data', 'limit')
+
+    def __init__(self, data, limit):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        data = self.data
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = data or b''
+        out = 'sha256=%s len=%s' % (hashlib.sha256(data).hexdigest(), len(data))
+        if self.limit:
+            txt = data[:self.limit].decode('utf-8', errors='ignore')
+            more = len(data) - self.limit
+            out += '\n' + txt + ('\n...[truncated %s bytes]' % more if more > 0 else '')
+        return out
+
+
+class Trace:
+    """Traza de un documento: anillo acotado + emisión diferida al logger."""
+
+    __slots__ = ('cfg', 'key', 'ring', '_rank', '_log', '_t0')
+
+    def __init__(self, cfg, key):
+        self.cfg = cfg
+        self.key = key
+        self.ring = deque(maxlen=cfg.ring_events) if cfg.sink in ('document', 'both') else None
+        self._rank = _RANK[cfg.level]
+        self._log = cfg.sink in ('log', 'both') and _logger.isEnabledFor(logging.INFO)
+        self._t0 = time.monotonic()
+
+    def __bool__(self):
+        return True
+
+    def wants(self, level):
+        return self._rank >= _RANK[level]
+
+    def event(self, name, fmt='', *args):
+        ms = (time.monotonic() - self._t0) * 1000.0
+        if self.ring is not None:
+            self.ring.append((ms, name, fmt, args))
+        if self._log:
+            _logger.info('CFDI TRACE | %s | +%.1fms | %s | ' + fmt, self.key, ms, name, *args)
+
+    def xml(self, label, data):
+        rank = self._rank
+        if rank < _RANK['hash']:
+            return
+        if rank >= _RANK['full']:
+            limit = self.cfg.full_kb * 1024
+        elif rank >= _RANK['preview']:
+            limit = self.cfg.preview_kb * 1024
+        else:
+            limit = 0
+        self.event('xml', '%s %s', label, _LazyXml(data, limit))
+
+    def set_key(self, key):
+        self.key = key
+
+    def dump(self):
+        """Formatea el anillo (más recientes al final) acotado a ring_kb."""
+        if not self.ring:
+            return ''
+        budget = self.cfg.ring_kb * 1024
+        lines = []
+        for ms, name, fmt, args in reversed(self.ring):
+            try:
+                msg = (fmt % args) if args else fmt
+            except Exception as e:
+                msg = '%r %r (%s)' % (fmt, args, e)
+            line = '+%.1fms %s %s' % (ms, name, msg)
+            if len(line) > budget:
+                if not lines:
+                    lines.append(line[:budget])
+                break
+            budget -= len(line) + 1
+            lines.append(line)
+        return '\n'.join(reversed(lines))
+
+
+def start(cfg, key=''):
+    """Traza para un documento según nivel y muestreo; NULL si no aplica."""
+    if cfg is None or cfg.level == 'off':
+        return NULL
+    if cfg.sample < 1.0 and random.random() >= cfg.sample:
+        return NULL
+    return Trace(cfg, key)
+
+
+_current = contextvars.ContextVar('cfdi_trace', default=NULL)
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def activate(trace):
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
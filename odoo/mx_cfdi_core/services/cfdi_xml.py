@@ -0,0 +1,226 @@
+# mx_cfdi_core/services/cfdi_xml.py
+"""Serialización del cfdi:Comprobante 4.0.
+
+CfdiEngine._build_xml calcula importes/impuestos y arma un dict `doc` con los
+atributos ya formateados de cada nodo; aquí se convierte a bytes:
+
+    - render_etree(doc): Element/SubElement + tostring (comportamiento histórico).
+    - render_stream(doc): escribe directo al buffer usando el esqueleto precompilado
+      por tipo (I/E/P). Produce exactamente los mismos bytes que render_etree.
+    - patch_fecha(xml, fecha): cambia el atributo Fecha sin reconstruir el documento
+      (reintento por error 305 del PAC).
+
+Estructura de `doc`:
+    tipo               'I' | 'E' | 'P'
+    root               dict de atributos del Comprobante (en orden)
+    informacion_global dict | None
+    emisor, receptor   dict
+    relacionados       (TipoRelacion, [uuid, ...]) | None
+    conceptos          [(attrs, [traslado_attrs, ...]), ...] | None     (I/E)
+    impuestos          {'attrs', 'retenciones', 'traslados'} | None    (I/E)
+    pagos              {'totales': attrs, 'pagos': [(attrs, [docto_attrs])]} | None   (P)
+"""
+from functools import lru_cache
+from xml.etree.ElementTree import Element, SubElement, tostring, register_namespace
+
+CFDI_NS = 'http://www.sat.gob.mx/cfd/4'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+PAGOS_NS = 'http://www.sat.gob.mx/Pagos20'
+PAGOS_PREFIX = 'pago20'
+SCHEMA_CFDI = 'http://www.sat.gob.mx/cfd/4 http://www.sat.gob.mx/sitio_internet/cfd/4/cfdv40.xsd'
+SCHEMA_PAGOS = 'http://www.sat.gob.mx/Pagos20 http://www.sat.gob.mx/sitio_internet/cfd/Pagos/Pagos20.xsd'
+
+register_namespace('cfdi', CFDI_NS)
+register_namespace('xsi', XSI_NS)
+register_namespace(PAGOS_PREFIX, PAGOS_NS)
+
+# Concepto fijo del CFDI de Pago (84111506 / ACT)
+PAGO_CONCEPTO = {
+    'ClaveProdServ': '84111506',
+    'Cantidad': '1',
+    'ClaveUnidad': 'ACT',
+    'Descripcion': 'Pago',
+    'ValorUnitario': '0',
+    'Importe': '0',
+    'ObjetoImp': '01',
+}
+
+_DECL = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+
+# ============================ ElementTree ============================
+
+def render_etree(doc):
+    tipo = doc['tipo']
+    comprobante = Element('cfdi:Comprobante', doc['root'])
+    if doc.get('informacion_global'):
+        SubElement(comprobante, 'cfdi:InformacionGlobal', doc['informacion_global'])
+    SubElement(comprobante, 'cfdi:Emisor', doc['emisor'])
+    SubElement(comprobante, 'cfdi:Receptor', doc['receptor'])
+
+    if doc.get('relacionados'):
+        tipo_rel, uuids = doc['relacionados']
+        rel = SubElement(comprobante, 'cfdi:CfdiRelacionados', {'TipoRelacion': tipo_rel})
+        for u in uuids:
+            SubElement(rel, 'cfdi:CfdiRelacionado', {'UUID': u})
+
+    if tipo in ('I', 'E'):
+        cs = SubElement(comprobante, 'cfdi:Conceptos')
+        for attrs, traslados in doc['conceptos']:
+            nodo = SubElement(cs, 'cfdi:Concepto', attrs)
+            if traslados:
+                imps = SubElement(nodo, 'cfdi:Impuestos')
+                tras = SubElement(imps, 'cfdi:Traslados')
+                for t in traslados:
+                    SubElement(tras, 'cfdi:Traslado', t)
+
+        imp = doc.get('impuestos')
+        if imp:
+            imp_glob = SubElement(comprobante, 'cfdi:Impuestos', imp['attrs'])
+            if imp['retenciones']:
+                rets = SubElement(imp_glob, 'cfdi:Retenciones')
+                for r in imp['retenciones']:
+                    SubElement(rets, 'cfdi:Retencion', r)
+            tras = SubElement(imp_glob, 'cfdi:Traslados')
+            for t in imp['traslados']:
+                SubElement(tras, 'cfdi:Traslado', t)
+
+    if tipo == 'P':
+        cs = SubElement(comprobante, 'cfdi:Conceptos')
+        SubElement(cs, 'cfdi:Concepto', dict(PAGO_CONCEPTO))
+        comp = SubElement(comprobante, 'cfdi:Complemento')
+        pg = doc['pagos']
+        pagos = SubElement(comp, '{%s}Pagos' % PAGOS_NS, {'Version': '2.0'})
+        SubElement(pagos, '{%s}Totales' % PAGOS_NS, pg['totales'])
+        for attrs, doctos in pg['pagos']:
+            pago = SubElement(pagos, '{%s}Pago' % PAGOS_NS, attrs)
+            for d in doctos:
+                SubElement(pago, '{%s}DoctoRelacionado' % PAGOS_NS, d)
+
+    return tostring(comprobante, encoding='utf-8', xml_declaration=True)
+
+
+# ============================ Streaming ============================
+
+def _esc(text):
+    # Mismo escape de atributos que xml.etree.ElementTree (incluye error con no-str).
+    if not isinstance(text, str):
+        raise TypeError("cannot serialize %r (type %s)" % (text, type(text).__name__))
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\r" in text:
+        text = text.replace("\r", "&#13;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    if "\t" in text:
+        text = text.replace("\t", "&#09;")
+    return text
+
+
+def _attrs(attrs):
+    return ''.join([' %s="%s"' % (k, _esc(v)) for k, v in attrs.items()])
+
+
+@lru_cache(maxsize=None)
+def _skeleton(tipo):
+    """Fragmentos fijos por tipo: apertura del Comprobante, cierre y (P) el concepto fijo."""
+    ns = (' xmlns:%s="%s"' % (PAGOS_PREFIX, PAGOS_NS)) if tipo == 'P' else ''
+    concepto_p = ('<cfdi:Conceptos><cfdi:Concepto%s /></cfdi:Conceptos>' % _attrs(PAGO_CONCEPTO)
+                  if tipo == 'P' else '')
+    return _DECL + '<cfdi:Comprobante' + ns, '</cfdi:Comprobante>', concepto_p
+
+
+def render_stream(doc):
+    tipo = doc['tipo']
+    head, tail, concepto_p = _skeleton(tipo)
+    out = [head, _attrs(doc['root']), '>']
+    w = out.append
+
+    if doc.get('informacion_global'):
+        w('<cfdi:InformacionGlobal%s />' % _attrs(doc['informacion_global']))
+    w('<cfdi:Emisor%s />' % _attrs(doc['emisor']))
+    w('<cfdi:Receptor%s />' % _attrs(doc['receptor']))
+
+    if doc.get('relacionados'):
+        tipo_rel, uuids = doc['relacionados']
+        if uuids:
+            w('<cfdi:CfdiRelacionados TipoRelacion="%s">' % _esc(tipo_rel))
+            for u in uuids:
+                w('<cfdi:CfdiRelacionado UUID="%s" />' % _esc(u))
+            w('</cfdi:CfdiRelacionados>')
+        else:
+            w('<cfdi:CfdiRelacionados TipoRelacion="%s" />' % _esc(tipo_rel))
+
+    if tipo in ('I', 'E'):
+        conceptos = doc['conceptos']
+        if conceptos:
+            w('<cfdi:Conceptos>')
+            for attrs, traslados in conceptos:
+                if traslados:
+                    w('<cfdi:Concepto%s><cfdi:Impuestos><cfdi:Traslados>' % _attrs(attrs))
+                    for t in traslados:
+                        w('<cfdi:Traslado%s />' % _attrs(t))
+                    w('</cfdi:Traslados></cfdi:Impuestos></cfdi:Concepto>')
+                else:
+                    w('<cfdi:Concepto%s />' % _attrs(attrs))
+            w('</cfdi:Conceptos>')
+        else:
+            w('<cfdi:Conceptos />')
+
+        imp = doc.get('impuestos')
+        if imp:
+            w('<cfdi:Impuestos%s>' % _attrs(imp['attrs']))
+            if imp['retenciones']:
+                w('<cfdi:Retenciones>')
+                for r in imp['retenciones']:
+                    w('<cfdi:Retencion%s />' % _attrs(r))
+                w('</cfdi:Retenciones>')
+            if imp['traslados']:
+                w('<cfdi:Traslados>')
+                for t in imp['traslados']:
+                    w('<cfdi:Traslado%s />' % _attrs(t))
+                w('</cfdi:Traslados>')
+            else:
+                w('<cfdi:Traslados />')
+            w('</cfdi:Impuestos>')
+
+    if tipo == 'P':
+        pg = doc['pagos']
+        w(concepto_p)
+        w('<cfdi:Complemento><%s:Pagos Version="2.0">' % PAGOS_PREFIX)
+        w('<%s:Totales%s />' % (PAGOS_PREFIX, _attrs(pg['totales'])))
+        for attrs, doctos in pg['pagos']:
+            if doctos:
+                w('<%s:Pago%s>' % (PAGOS_PREFIX, _attrs(attrs)))
+                for d in doctos:
+                    w('<%s:DoctoRelacionado%s />' % (PAGOS_PREFIX, _attrs(d)))
+                w('</%s:Pago>' % PAGOS_PREFIX)
+            else:
+                w('<%s:Pago%s />' % (PAGOS_PREFIX, _attrs(attrs)))
+        w('</%s:Pagos></cfdi:Complemento>' % PAGOS_PREFIX)
+
+    w(tail)
+    return ''.join(out).encode('utf-8')
+
+
+def render(doc, mode='etree'):
+    return render_stream(doc) if mode == 'stream' else render_etree(doc)
+
+
+_FECHA = b' Fecha="'
+
+
+def patch_fecha(xml_bytes, fecha):
+    """Reemplaza el atributo Fecha del Comprobante (el primero del documento)."""
+    i = xml_bytes.find(_FECHA)
+    if i < 0:
+        raise ValueError('El XML no tiene atributo Fecha.')
+    i += len(_FECHA)
+    j = xml_bytes.index(b'"', i)
+    return xml_bytes[:i] + _esc(fecha).encode('utf-8') + xml_bytes[j:]
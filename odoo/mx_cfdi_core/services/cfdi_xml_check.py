@@ -0,0 +1,139 @@
+# mx_cfdi_core/services/cfdi_xml_check.py
+"""Equivalencia y benchmark de los serializadores del Comprobante (sólo stdlib, sin ORM).
+
+Arma documentos `doc` de ejemplo para I/E/P con la misma estructura que deja
+CfdiEngine._build_xml (informacion global, relacionados, retenciones, conceptos sin
+impuestos, caracteres a escapar) y verifica que render_stream produzca exactamente los
+mismos bytes que render_etree; después mide ambos. No lo importa el módulo.
+
+Uso (consola):
+    python cfdi_xml_check.py --conceptos 5 --conceptos 50 --n 2000
+Sale con código 1 si algún documento difiere (imprime el primer byte distinto).
+"""
+import argparse
+import json
+import sys
+import time
+
+try:
+    from . import cfdi_xml
+except ImportError:     # ejecutado como script
+    import cfdi_xml
+
+
+def _root(tipo, subtotal, total):
+    root = {
+        'Version': '4.0', 'Serie': 'A', 'Folio': '1001', 'Fecha': '2025-01-31T12:00:00',
+        'FormaPago': '01', 'MetodoPago': 'PUE', 'Moneda': 'MXN', 'TipoDeComprobante': tipo,
+        'Exportacion': '01', 'SubTotal': subtotal, 'Total': total, 'LugarExpedicion': '64000',
+        'Sello': '', 'Certificado': '', 'NoCertificado': '',
+        'xmlns:cfdi': cfdi_xml.CFDI_NS, 'xmlns:xsi': cfdi_xml.XSI_NS,
+        'xsi:schemaLocation': cfdi_xml.SCHEMA_CFDI,
+    }
+    if tipo == 'P':
+        for k in ('FormaPago', 'MetodoPago'):
+            root.pop(k)
+        root['Moneda'] = 'XXX'
+        root['xsi:schemaLocation'] = cfdi_xml.SCHEMA_CFDI + ' ' + cfdi_xml.SCHEMA_PAGOS
+    return root
+
+
+def sample_doc(tipo, conceptos=5):
+    """Documento de ejemplo del tipo indicado ('I', 'E' o 'P')."""
+    doc = {
+        'tipo': tipo,
+        'root': _root(tipo, '0' if tipo == 'P' else '1000.00', '0' if tipo == 'P' else '1160.00'),
+        'emisor': {'Rfc': 'EKU9003173C9', 'Nombre': 'ESCUELA KEMPER URGATE', 'RegimenFiscal': '601'},
+        'receptor': {'Rfc': 'XAXX010101000', 'Nombre': 'PÚBLICO EN GENERAL & "CÍA" <S.A.>',
+                     'DomicilioFiscalReceptor': '64000', 'RegimenFiscalReceptor': '616',
+                     'UsoCFDI': 'CP01' if tipo == 'P' else 'S01'},
+    }
+    if tipo == 'I':
+        doc['informacion_global'] = {'Periodicidad': '01', 'Meses': '01', 'Año': '2025'}
+    if tipo in ('E', 'P'):
+        doc['relacionados'] = ('01' if tipo == 'E' else '04',
+                               ['5FB2822E-396D-4725-8521-CDC4BDD20CCF'])
+    if tipo in ('I', 'E'):
+        items = []
+        for i in range(max(1, int(conceptos))):
+            attrs = {'ClaveProdServ': '01010101', 'Cantidad': '1', 'ClaveUnidad': 'H87',
+                     'Descripcion': 'Concepto %s\tlínea\n"especial"' % (i + 1),
+                     'ValorUnitario': '100.00', 'Importe': '100.00',
+                     'ObjetoImp': '01' if i % 4 == 3 else '02'}
+            traslados = [] if i % 4 == 3 else [{'Base': '100.00', 'Impuesto': '002', 'TipoFactor': 'Tasa',
+                                                'TasaOCuota': '0.160000', 'Importe': '16.00'}]
+            items.append((attrs, traslados))
+        doc['conceptos'] = items
+        doc['impuestos'] = {
+            'attrs': {'TotalImpuestosRetenidos': '10.00', 'TotalImpuestosTrasladados': '160.00'},
+            'retenciones': [{'Impuesto': '001', 'Importe': '10.00'}] if tipo == 'I' else [],
+            'traslados': [{'Base': '1000.00', 'Impuesto': '002', 'TipoFactor': 'Tasa',
+                           'TasaOCuota': '0.160000', 'Importe': '160.00'}],
+        }
+    if tipo == 'P':
+        pagos = []
+        for i in range(max(1, int(conceptos))):
+            pagos.append(({'FechaPago': '2025-01-31T12:00:00', 'FormaDePagoP': '03', 'MonedaP': 'MXN',
+                           'TipoCambioP': '1', 'Monto': '116.00'},
+                          [{'IdDocumento': '5FB2822E-396D-4725-8521-CDC4BDD20CCF', 'Serie': 'A',
+                            'Folio': str(i + 1), 'MonedaDR': 'MXN', 'EquivalenciaDR': '1',
+                            'NumParcialidad': '1', 'ImpSaldoAnt': '116.00', 'ImpPagado': '116.00',
+                            'ImpSaldoInsoluto': '0.00', 'ObjetoImpDR': '01'}] if i % 3 != 2 else []))
+        doc['pagos'] = {'totales': {'MontoTotalPagos': '%.2f' % (116.0 * len(pagos))}, 'pagos': pagos}
+    return doc
+
+
+def first_diff(a, b):
+    """Posición del primer byte distinto (o -1 si son iguales)."""
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return -1 if len(a) == len(b) else min(len(a), len(b))
+
+
+def check(conceptos=(0, 1, 5, 50)):
+    """[(tipo, conceptos, posición)] de los documentos donde stream y etree difieren."""
+    errores = []
+    for tipo in ('I', 'E', 'P'):
+        for n in conceptos:
+            doc = sample_doc(tipo, n)
+            if tipo in ('I', 'E') and not n:
+                doc['conceptos'] = []
+            a, b = cfdi_xml.render_etree(doc), cfdi_xml.render_stream(doc)
+            if a != b:
+                errores.append((tipo, n, first_diff(a, b)))
+    return errores
+
+
+def bench(conceptos=5, n=2000):
+    """{tipo: {'etree_us', 'stream_us', 'speedup'}} por documento."""
+    report = {}
+    for tipo in ('I', 'E', 'P'):
+        doc = sample_doc(tipo, conceptos)
+        res = {}
+        for mode, fn in (('etree', cfdi_xml.render_etree), ('stream', cfdi_xml.render_stream)):
+            fn(doc)
+            t0 = time.perf_counter()
+            for _i in range(n):
+                fn(doc)
+            res['%s_us' % mode] = round((time.perf_counter() - t0) * 1e6 / n, 1)
+        res['speedup'] = round(res['etree_us'] / res['stream_us'], 2) if res['stream_us'] else 0.0
+        report[tipo] = res
+    return report
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Equivalencia y benchmark de serializadores CFDI')
+    p.add_argument('--conceptos', type=int, action='append',
+                   help='Conceptos (o pagos) por documento; se puede repetir (default 5)')
+    p.add_argument('--n', type=int, default=2000, help='Documentos por medición')
+    args = p.parse_args(argv)
+    errores = check()
+    out = {'equivalentes': not errores, 'diferencias': errores,
+           'bench': {str(c): bench(c, args.n) for c in (args.conceptos or [5])}}
+    print(json.dumps(out, indent=2, ensure_ascii=False))
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+# mx_cfdi_core/services/cfdi_zip.py
+"""ZIP en flujo para exportar XML CFDI.
+
+iter_zip(entries) recibe un iterable de (nombre, bytes) y va regresando los pedazos del
+archivo ZIP conforme se escribe cada entrada: nunca tiene en memoria más que la entrada
+actual. zipfile detecta que el destino no es "seekable" y usa descriptores de datos.
+"""
+import zipfile
+
+
+class _Sink:
+    """Destino de escritura que acumula bytes hasta que el generador los entrega."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_zip(entries, compresslevel=6):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+            chunk = sink.pop()
+            if chunk:
+                yield chunk
+    chunk = sink.pop()
+    if chunk:
+        yield chunk
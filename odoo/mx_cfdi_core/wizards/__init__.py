@@ -0,0 +1 @@
+from . import xml_export
@@ -0,0 +1,40 @@
+# wizards/xml_export.py
+# Exportación masiva de XML CFDI (ZIP en flujo) por empresa y rango de fechas de timbrado.
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from urllib.parse import urlencode
+
+
+class WizCfdiXmlExport(models.TransientModel):
+    _name = 'mx.cfdi.wiz.xml.export'
+    _description = 'Exportar XML CFDI (ZIP)'
+
+    empresa_id = fields.Many2one('empresas.empresa', string='Empresa')
+    date_from  = fields.Date(string='Desde', required=True, default=fields.Date.context_today)
+    date_to    = fields.Date(string='Hasta', required=True, default=fields.Date.context_today)
+    tipo       = fields.Selection([('I', 'Ingreso'), ('E', 'Egreso'), ('P', 'Pago')], string='Tipo')
+    doc_count  = fields.Integer(string='Documentos', compute='_compute_doc_count')
+
+    def _domain(self):
+        self.ensure_one()
+        return self.env['mx.cfdi.document']._export_domain(
+            self.empresa_id.id, self.date_from, self.date_to, self.tipo)
+
+    @api.depends('empresa_id', 'date_from', 'date_to', 'tipo')
+    def _compute_doc_count(self):
+        for w in self:
+            w.doc_count = self.env['mx.cfdi.document'].search_count(w._domain()) if w.date_from else 0
+
+    def action_export(self):
+        self.ensure_one()
+        if self.date_from > self.date_to:
+            raise UserError(_('La fecha inicial es posterior a la final.'))
+        if not self.doc_count:
+            raise UserError(_('No hay CFDI timbrados en el rango seleccionado.'))
+        params = {'date_from': self.date_from, 'date_to': self.date_to}
+        if self.empresa_id:
+            params['empresa_id'] = self.empresa_id.id
+        if self.tipo:
+            params['tipo'] = self.tipo
+        return {'type': 'ir.actions.act_url', 'url': '/mx_cfdi/xml_zip?' + urlencode(params),
+                'target': 'self'}
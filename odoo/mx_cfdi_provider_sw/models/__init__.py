@@ -1,3 +1,4 @@
 from . import provider_sw
+from . import endpoint
 from . import res_config_settings
-
+from . import ir_config_parameter
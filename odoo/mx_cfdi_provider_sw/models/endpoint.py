@@ -0,0 +1,103 @@
+#mx_cfdi_provider_sw/models/endpoint.py
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+# Registro de la ruta de timbrado que funcionó por URL base, versión CFDI y
+# configuración de rutas (mx_cfdi_sw.issue_path / issue_paths). _stamp_xml usa la
+# ruta recordada y sólo vuelve a probar todas tras N fallas seguidas
+# (mx_cfdi_sw.endpoint_max_failures, 3 por defecto).
+class CfdiSwEndpoint(models.Model):
+    _name = "mx.cfdi.sw.endpoint"
+    _description = "SW - Endpoint de timbrado descubierto"
+    _order = "base_url, version"
+
+    base_url   = fields.Char(required=True, index=True)
+    version    = fields.Selection([('cfdi40', 'CFDI 4.0'), ('cfdi33', 'CFDI 3.3')], required=True)
+    config_key = fields.Char(required=True, help="Huella de las rutas forzadas/extra configuradas.")
+    path       = fields.Char(required=True)
+    failures   = fields.Integer(default=0, help="Fallas seguidas de la ruta recordada.")
+    discovered = fields.Datetime(default=fields.Datetime.now)
+
+    _sql_constraints = [
+        ('endpoint_uniq', 'unique(base_url, version, config_key)',
+         'Sólo puede recordarse una ruta por URL base, versión y configuración.'),
+    ]
+
+    @api.model
+    def _config_key(self, forced, extras):
+        raw = '|'.join([forced or ''] + list(extras or []))
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    def _lookup(self, base_url, version, config_key):
+        return self.sudo().search([
+            ('base_url', '=', base_url), ('version', '=', version), ('config_key', '=', config_key),
+        ], limit=1)
+
+    @api.model
+    def _get_path(self, base_url, version, config_key):
+        return self._lookup(base_url, version, config_key).path or False
+
+    # Las marcas se guardan en un cursor propio: si el timbrado falla y la
+    # transacción del usuario se revierte, el conteo de fallas no se pierde.
+    def _in_own_cursor(self, method, *args):
+        with self.env.registry.cursor() as cr:
+            return getattr(self.with_env(self.env(cr=cr, su=True)), method)(*args)
+
+    @api.model
+    def _mark_ok(self, base_url, version, config_key, path):
+        """Recuerda `path` como ruta buena; sólo escribe si algo cambió."""
+        rec = self._lookup(base_url, version, config_key)
+        if rec and rec.path == path and not rec.failures:
+            return True
+        return self._in_own_cursor('_do_mark_ok', base_url, version, config_key, path)
+
+    def _do_mark_ok(self, base_url, version, config_key, path):
+        rec = self._lookup(base_url, version, config_key)
+        if rec:
+            rec.write({'path': path, 'failures': 0, 'discovered': fields.Datetime.now()})
+            return True
+        try:
+            with self.env.cr.savepoint():
+                self.create({
+                    'base_url': base_url, 'version': version,
+                    'config_key': config_key, 'path': path,
+                })
+            _logger.info("SW: ruta de timbrado descubierta %s%s (%s)", base_url, path, version)
+        except Exception:
+            # Otro worker la registró al mismo tiempo
+            pass
+        return True
+
+    @api.model
+    def _mark_failure(self, base_url, version, config_key):
+        """Cuenta una falla de la ruta recordada. True si ya toca redescubrir (y la olvida)."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        try:
+            max_failures = int(ICP.get_param('mx_cfdi_sw.endpoint_max_failures', 3) or 3)
+        except Exception:
+            max_failures = 3
+        return self._in_own_cursor('_do_mark_failure', base_url, version, config_key, max_failures)
+
+    def _do_mark_failure(self, base_url, version, config_key, max_failures):
+        rec = self._lookup(base_url, version, config_key)
+        if not rec:
+            return True
+        failures = rec.failures + 1
+        if failures >= max_failures:
+            _logger.warning("SW: se olvida la ruta %s%s tras %s fallas seguidas", base_url, rec.path, failures)
+            rec.unlink()
+            return True
+        rec.write({'failures': failures})
+        return False
+
+    @api.model
+    def _invalidate(self, base_url=None):
+        """Olvida las rutas recordadas (todas o las de `base_url`)."""
+        domain = [('base_url', '=', base_url.rstrip('/'))] if base_url else []
+        self.sudo().search(domain).unlink()
+        return True
@@ -0,0 +1,33 @@
+# mx_cfdi_provider_sw/models/ir_config_parameter.py
+from odoo import models, api
+from ..services import http_pool
+
+# Parámetros con los que se arma el pool HTTP de SW (ver provider_sw._http).
+_HTTP_PARAMS = ('mx_cfdi_sw.http_pool_maxsize', 'mx_cfdi_sw.http_retries', 'mx_cfdi_sw.http_backoff')
+
+
+class IrConfigParameter(models.Model):
+    _inherit = 'ir.config_parameter'
+
+    # Al cambiar el pool HTTP se cierran las sesiones de este worker; en los demás,
+    # http_pool.get_session las rehace al notar la configuración distinta.
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        if any(vals.get('key') in _HTTP_PARAMS for vals in vals_list):
+            http_pool.close_all()
+        return res
+
+    def write(self, vals):
+        touched = any(k in _HTTP_PARAMS for k in self.mapped('key')) or vals.get('key') in _HTTP_PARAMS
+        res = super().write(vals)
+        if touched:
+            http_pool.close_all()
+        return res
+
+    def unlink(self):
+        touched = any(k in _HTTP_PARAMS for k in self.mapped('key'))
+        res = super().unlink()
+        if touched:
+            http_pool.close_all()
+        return res
@@ -5,6 +5,7 @@ import json
 from odoo import models, api, _
 from odoo.exceptions import UserError
 import time
+import random
 import logging
 import hashlib
 # --- DEBUG helpers ---
@@ -28,6 +29,31 @@ try:
 except Exception:  # pragma: no cover
     requests = None
 
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from ..services import http_pool, cert_cache, rate_limit
+from odoo.addons.mx_cfdi_core.services import cfdi_trace
+
+
+class _SwCancelError(Exception):
+    pass
+
+
+# POST de cancelación sin ORM (se usa también desde los hilos de _cancel_many).
+# Devuelve {'status': ..., 'acuse': bytes|None}; lanza _SwCancelError si SW responde error.
+def _cancel_request(session, url, headers, payload):
+    r = session.post(url, headers=headers, data=json.dumps(payload), timeout=60)
+    if r.status_code >= 400:
+        try:
+            data = r.json(); msg = data.get('message') or data.get('Message') or r.text
+        except Exception:
+            msg = r.text
+        raise _SwCancelError(msg)
+    data = r.json() if r.headers.get('Content-Type','').startswith('application/json') else {}
+    acuse_b64 = data.get('acuse') or data.get('Acuse') or None
+    acuse = base64.b64decode(acuse_b64) if acuse_b64 else None
+    return {'status': data.get('status') or data.get('Status'), 'acuse': acuse}
+
 # Implementación del proveedor SW Sapien (REST) para timbrado/cancelación y utilidades asociadas (carga/verificación de CSD y descarga de XML).
 class CfdiProviderSW(models.AbstractModel):
     _name = "mx.cfdi.engine.provider.sw"
@@ -44,7 +70,8 @@ class CfdiProviderSW(models.AbstractModel):
         sandbox  = (ICP.get_param('mx_cfdi_sw.sandbox', '1') or '').lower() in ('1','true','yes')
         base_url = (ICP.get_param('mx_cfdi_sw.base_url') or
                     ('https://services.sw.com.mx' if not sandbox else 'https://services.test.sw.com.mx')).rstrip('/')
-        api_base = 'https://api.sw.com.mx' if not sandbox else 'https://api.test.sw.com.mx'
+        api_base = (ICP.get_param('mx_cfdi_sw.api_base_url') or
+                    ('https://api.sw.com.mx' if not sandbox else 'https://api.test.sw.com.mx')).rstrip('/')
         token    = ICP.get_param('mx_cfdi_sw.token') or ''
         user     = ICP.get_param('mx_cfdi_sw.user') or ''
         pwd      = ICP.get_param('mx_cfdi_sw.password') or ''
@@ -75,8 +102,18 @@ class CfdiProviderSW(models.AbstractModel):
             'key_b64': _as_str(emp.cfdi_sw_key_file),           # CSD por empresa
             'key_password': emp.cfdi_sw_key_password or key_pwd_default,
             'token_fp': _tok_fp(token),
+            'empresa_id': emp.id,
         }
 
+    # Sandbox de SW o simulador local (services/sw_simulator.py): no emite CFDI reales.
+    # Con sandbox=1 pero un base_url/api_base_url de producción explícito, no cuenta como prueba.
+    def _is_test_endpoint(self):
+        cfg = self._cfg(self.env.context.get('empresa_id'))
+        hosts = {(urlsplit(cfg[k]).hostname or '').lower() for k in ('base_url', 'api_base_url')}
+        if hosts <= {'127.0.0.1', 'localhost', '::1'}:
+            return True
+        return bool(cfg['sandbox']) and not hosts & {'services.sw.com.mx', 'api.sw.com.mx'}
+
     # Timbrado principal:
     #  - Verifica/carga CSD en SW si no existe.
     #  - Intenta múltiples endpoints (issue/stamp, cfdi40 y compat cfdi33).
@@ -105,9 +142,10 @@ class CfdiProviderSW(models.AbstractModel):
 
         is_v40 = (b'Version="4.0"' in xml_bytes) or (b"Version='4.0'" in xml_bytes)
 
-        # Asegura que el CSD esté cargado en SW (necesario para ISSUE)
+        # Asegura que el CSD esté cargado en SW (necesario para ISSUE); con caché TTL
+        # en estado estable no cuesta ninguna petición.
         try:
-            if not self._has_cert():
+            if not self._has_cert_cached(cfg):
                 self._upload_cert_from_company()
         except Exception as e:
             raise UserError(_("No pude verificar/cargar el CSD en SW: %s") % e)
@@ -159,122 +197,161 @@ class CfdiProviderSW(models.AbstractModel):
             _logger.warning("SW HTTP DEBUG | hosts=%s", hosts)
             _logger.warning("SW HTTP DEBUG | paths=%s", paths[:8] + (['...'] if len(paths) > 8 else []))
 
+        registry = self.env['mx.cfdi.sw.endpoint']
+        version = 'cfdi40' if is_v40 else 'cfdi33'
+        config_key = registry._config_key(forced, extras)
+
+        # Endpoint recordado: en estado estable se timbra con una sola petición.
+        cached = registry._get_path(base, version, config_key)
+        if cached:
+            result, last_err = self._post_stamp(cfg, base + cached, cached, xml_bytes,
+                                                req_timeout, debug_http, resp_kb)
+            if result:
+                registry._mark_ok(base, version, config_key, cached)
+                return result
+            if not registry._mark_failure(base, version, config_key):
+                raise UserError(_('SW: falló el endpoint de timbrado %s (se reintentará antes de volver a '
+                                  'probar rutas). Detalle: %s') % (cached, last_err or 'N/A'))
+            _logger.warning("SW: endpoint %s%s descartado tras fallas repetidas; redescubriendo.", base, cached)
+            paths = [p for p in paths if p != cached]
+
         for host in hosts:
             for p in paths:
-                url = host.rstrip('/') + p
-                try:
-                    # Headers seguros (enmascara token si logueas)
-                    hdrs = self._headers(cfg)
-                    if debug_http:
-                        _logger.warning("SW HTTP TRY | url=%s | token=%s", url, cfg.get('token_fp'))
-
-
-                    resp = requests.post(url, headers=hdrs,
-                                         files={'xml': ('cfdi.xml', xml_bytes, 'application/xml')},
-                                         timeout=req_timeout)
-
-                    ct = (resp.headers.get('Content-Type') or '').lower()
-                    body = resp.text or ''
-                    if debug_http:
-                        _logger.warning("SW HTTP RESP | url=%s | code=%s | ct=%s | body<=%dkB:\n%s",
-                                        url, resp.status_code, ct, resp_kb, body[:resp_kb*1024])
-
-
-                except Exception as e:
-                    last_err = f"{url} -> {e}"
-                    continue
-
-                # Éxito → extrae uuid + XML timbrado (puede venir en texto o en Base64)
-                if resp.status_code < 400:
-                    data = resp.json() if ('json' in ct) else {}
-                    d = (data.get('data') or data) if isinstance(data, dict) else {}
-                    uuid = d.get('uuid') or d.get('UUID') or ''
-                    cfdi_val = (d.get('cfdi') or d.get('Cfdi') or d.get('xml') or
-                                d.get('XML') or d.get('cfdiXml') or d.get('cfdiXML'))
-                    if uuid and cfdi_val:
-                        if isinstance(cfdi_val, (bytes, bytearray)):
-                            xml_bytes_out = bytes(cfdi_val)
-                        elif isinstance(cfdi_val, str) and cfdi_val.lstrip().startswith('<'):
-                            # XML en texto plano
-                            xml_bytes_out = cfdi_val.encode('utf-8')
-                        else:
-                            # XML en Base64
-                            xml_bytes_out = base64.b64decode(cfdi_val)
-                        return {'uuid': uuid, 'xml_timbrado': xml_bytes_out}
-                    last_err = f"{url} -> respuesta sin uuid/cfdi"
-                    continue
-
-
-                # Normaliza errores de SW (para decidir retry vs fail)
-                detail = body
-                try:
-                    j = resp.json()
-                    msgs = []
-                    if isinstance(j, dict):
-                        if j.get('message') or j.get('Message'):
-                            msgs.append(j.get('message') or j.get('Message'))
-                        if j.get('messageDetail') or j.get('MessageDetail'):
-                            msgs.append(j.get('messageDetail') or j.get('MessageDetail'))
-                        for k in ('data','Data'):
-                            dd = j.get(k) or {}
-                            if isinstance(dd, dict) and (dd.get('messageDetail') or dd.get('MessageDetail')):
-                                msgs.append(dd.get('messageDetail') or dd.get('MessageDetail'))
-                            errs = dd.get('errors') or dd.get('Errors') or dd.get('detalle') or dd.get('Detalle')
-                            if isinstance(errs, list):
-                                msgs += [str(e) for e in errs if e]
-                            elif isinstance(errs, dict):
-                                msgs += [f"{a}: {b}" for a,b in errs.items()]
-                            
-                    if msgs:
-                        detail = ' | '.join(msgs)
-                except Exception:
-                    pass
-
-                low = (detail or '').lower()
-                # 404/405 → prueba siguiente path/host
-                if resp.status_code in (404, 405):
-                    last_err = f"{url} -> {resp.status_code} {detail[:200]}"
-                    continue
-                
-                # 400 → si trae detalle de validación, detén y muestra
-                if resp.status_code == 400:
-                    # errores típicos de validación (atributos faltantes, receptor/emisor, etc.)
-                    if any(word in low for word in ('attribute', 'atributo', 'base', 'receptor', 'emisor', 'regimen', 'uso')):
-                        raise UserError(_('Validación CFDI (400): %s') % detail[:800])
-                    # solo reintenta si es el genérico "no clasificado" sin pistas útiles
-                    if ('cfdi40999' in low) or ('no clasificado' in low):
-                        last_err = f"{url} -> 400 {detail[:200]}"
-                        continue
-
-                # 401 → token
-                if resp.status_code == 401:
-                    j = {}
-                    try:
-                        j = resp.json()
-                    except Exception:
-                        pass
-                    msg = (j.get('message') or j.get('Message') or body or resp.reason or '').strip()
-                    code = (j.get('code') or j.get('Code') or '').lower()
-                    if debug_http:
-                        _logger.warning("SW 401 DIAG | url=%s | token=%s | code=%s | msg=%s",
-                                        url, cfg.get('token_fp'), code, msg[:400])
-                    low = msg.lower()
-                    if 's2000' in low or 'saldo' in low:
-                        raise UserError(_('SW: saldo de timbres agotado para el RFC %(rfc)s.') % {'rfc': cfg.get('rfc')})
-                    # ← mensaje explícito cuando sea token/cuenta/entorno
-                    raise UserError(_('SW 401 (no saldo): token inválido/expirado o de otra cuenta/entorno. '
-                                      'RFC=%(rfc)s, url=%(url)s, detalle=%(det)s')
-                                    % {'rfc': cfg.get('rfc'), 'url': url, 'det': msg[:300]})
-
-
-
-
-                # Otros 4xx/5xx → falla inmediata
-                raise UserError(_('Error timbrando con SW (%s): %s') % (p, detail[:800]))
+                result, last_err = self._post_stamp(cfg, host.rstrip('/') + p, p, xml_bytes,
+                                                    req_timeout, debug_http, resp_kb)
+                if result:
+                    registry._mark_ok(host.rstrip('/'), version, config_key, p)
+                    return result
 
         raise UserError(_('SW: sin endpoint activo para timbrar (probé: %s). Último error: %s')
                         % (', '.join(paths), (last_err or 'N/A')))
 
+    # Envía el XML a una ruta de timbrado de SW.
+    # Regresa (resultado, None) en éxito o (None, error) si conviene probar otra ruta
+    # (404/405, conexión, respuesta sin uuid/cfdi, 400 genérico). Los errores definitivos
+    # (validación, token, saldo, 5xx) se lanzan como UserError.
+    def _post_stamp(self, cfg, url, p, xml_bytes, req_timeout, debug_http, resp_kb):
+        try:
+            # Headers seguros (enmascara token si logueas)
+            hdrs = self._headers(cfg)
+            if debug_http:
+                _logger.warning("SW HTTP TRY | url=%s | token=%s", url, cfg.get('token_fp'))
+
+
+            trace = cfdi_trace.current()
+            t0 = time.monotonic() if trace else 0.0
+            resp = self._http(cfg).post(url, headers=hdrs,
+                                        files={'xml': ('cfdi.xml', xml_bytes, 'application/xml')},
+                                        timeout=req_timeout)
+
+            ct = (resp.headers.get('Content-Type') or '').lower()
+            body = resp.text or ''
+            if debug_http:
+                _logger.warning("SW HTTP RESP | url=%s | code=%s | ct=%s | body<=%dkB:\n%s",
+                                url, resp.status_code, ct, resp_kb, body[:resp_kb*1024])
+            if trace:
+                trace.event('sw.http', '%s code=%s %.0fms', url, resp.status_code,
+                            (time.monotonic() - t0) * 1000.0)
+                if trace.wants('full'):
+                    trace.event('sw.body', '%s', body[:resp_kb * 1024])
+
+
+        except Exception as e:
+            return None, f"{url} -> {e}"
+
+        # Éxito → extrae uuid + XML timbrado (puede venir en texto o en Base64)
+        if resp.status_code < 400:
+            data = resp.json() if ('json' in ct) else {}
+            d = (data.get('data') or data) if isinstance(data, dict) else {}
+            uuid = d.get('uuid') or d.get('UUID') or ''
+            cfdi_val = (d.get('cfdi') or d.get('Cfdi') or d.get('xml') or
+                        d.get('XML') or d.get('cfdiXml') or d.get('cfdiXML'))
+            if uuid and cfdi_val:
+                if isinstance(cfdi_val, (bytes, bytearray)):
+                    xml_bytes_out = bytes(cfdi_val)
+                elif isinstance(cfdi_val, str) and cfdi_val.lstrip().startswith('<'):
+                    # XML en texto plano
+                    xml_bytes_out = cfdi_val.encode('utf-8')
+                else:
+                    # XML en Base64
+                    xml_bytes_out = base64.b64decode(cfdi_val)
+                return {'uuid': uuid, 'xml_timbrado': xml_bytes_out}, None
+            if uuid:
+                # Timbrado sin XML en la respuesta: el CFDI ya existe en el SAT, así que no se
+                # prueba otra ruta (timbraría de nuevo); el engine difiere la descarga por UUID.
+                return {'uuid': uuid, 'xml_timbrado': None}, None
+            return None, f"{url} -> respuesta sin uuid/cfdi"
+
+
+        # Normaliza errores de SW (para decidir retry vs fail)
+        detail = body
+        try:
+            j = resp.json()
+            msgs = []
+            if isinstance(j, dict):
+                if j.get('message') or j.get('Message'):
+                    msgs.append(j.get('message') or j.get('Message'))
+                if j.get('messageDetail') or j.get('MessageDetail'):
+                    msgs.append(j.get('messageDetail') or j.get('MessageDetail'))
+                for k in ('data','Data'):
+                    dd = j.get(k) or {}
+                    if isinstance(dd, dict) and (dd.get('messageDetail') or dd.get('MessageDetail')):
+                        msgs.append(dd.get('messageDetail') or dd.get('MessageDetail'))
+                    errs = dd.get('errors') or dd.get('Errors') or dd.get('detalle') or dd.get('Detalle')
+                    if isinstance(errs, list):
+                        msgs += [str(e) for e in errs if e]
+                    elif isinstance(errs, dict):
+                        msgs += [f"{a}: {b}" for a,b in errs.items()]
+                    
+            if msgs:
+                detail = ' | '.join(msgs)
+        except Exception:
+            pass
+
+        low = (detail or '').lower()
+        # SW dice que no tiene el CSD → la próxima verificación debe consultar de nuevo
+        if self._is_missing_csd(low):
+            self._cert_cache_invalidate([cfg.get('empresa_id')])
+
+        # 404/405 → prueba siguiente path/host
+        if resp.status_code in (404, 405):
+            return None, f"{url} -> {resp.status_code} {detail[:200]}"
+        
+        # 400 → si trae detalle de validación, detén y muestra
+        if resp.status_code == 400:
+            # errores típicos de validación (atributos faltantes, receptor/emisor, etc.)
+            if any(word in low for word in ('attribute', 'atributo', 'base', 'receptor', 'emisor', 'regimen', 'uso')):
+                raise UserError(_('Validación CFDI (400): %s') % detail[:800])
+            # solo reintenta si es el genérico "no clasificado" sin pistas útiles
+            if ('cfdi40999' in low) or ('no clasificado' in low):
+                return None, f"{url} -> 400 {detail[:200]}"
+
+        # 401 → token
+        if resp.status_code == 401:
+            j = {}
+            try:
+                j = resp.json()
+            except Exception:
+                pass
+            msg = (j.get('message') or j.get('Message') or body or resp.reason or '').strip()
+            code = (j.get('code') or j.get('Code') or '').lower()
+            if debug_http:
+                _logger.warning("SW 401 DIAG | url=%s | token=%s | code=%s | msg=%s",
+                                url, cfg.get('token_fp'), code, msg[:400])
+            low = msg.lower()
+            if 's2000' in low or 'saldo' in low:
+                raise UserError(_('SW: saldo de timbres agotado para el RFC %(rfc)s.') % {'rfc': cfg.get('rfc')})
+            # ← mensaje explícito cuando sea token/cuenta/entorno
+            raise UserError(_('SW 401 (no saldo): token inválido/expirado o de otra cuenta/entorno. '
+                              'RFC=%(rfc)s, url=%(url)s, detalle=%(det)s')
+                            % {'rfc': cfg.get('rfc'), 'url': url, 'det': msg[:300]})
+
+
+
+
+        # Otros 4xx/5xx → falla inmediata
+        raise UserError(_('Error timbrando con SW (%s): %s') % (p, detail[:800]))
+
     # =========================== utils ===========================
     # Consulta el DataWarehouse "live" de SW por UUID y devuelve el primer
     # registro encontrado (dict) o None si aún no está disponible.
@@ -284,7 +361,7 @@ class CfdiProviderSW(models.AbstractModel):
             raise UserError(_('El módulo requests no está disponible.'))
         cfg = self._cfg(self.env.context.get('empresa_id'))
         url = f"{cfg['api_base_url'].rstrip('/')}/datawarehouse/v1/live/{uuid}"
-        r = requests.get(url, headers=self._headers(cfg), timeout=30)
+        r = self._http(cfg, cfg['api_base_url']).get(url, headers=self._headers(cfg), timeout=30)
         if r.status_code >= 400:
             return None
         try:
@@ -308,25 +385,48 @@ class CfdiProviderSW(models.AbstractModel):
             return recs[0]
         return None
 
-    # Hace polling al DataWarehouse hasta obtener el XML y, si existe, # el acuse de timbrado. Devuelve {'xml': bytes, 'acuse': bytes|None}.
-    # Lanza UserError si no aparece tras 'tries' intentos (con 'delay' entre cada uno).
-    def download_xml_by_uuid(self, uuid, tries=30, delay=1.0):
+    # Un solo intento contra el DataWarehouse (no duerme): {'xml': bytes, 'acuse': bytes|None}
+    # si SW ya expone el XML del UUID, None si todavía no. Lo usa la descarga diferida
+    # de mx.cfdi.document (cron con backoff) y download_xml_by_uuid.
+    def _fetch_stamped_xml(self, uuid):
+        if not requests:
+            raise UserError(_('El módulo requests no está disponible.'))
+        rec = self._dw_lookup(uuid)
+        if not (rec and rec.get('urlXml')):
+            return None
+        xml = self._http_public(rec['urlXml']).get(rec['urlXml'], timeout=60).content
+        ack = None
+        if rec.get('urlAckCfdi'):
+            try:
+                ack = self._http_public(rec['urlAckCfdi']).get(rec['urlAckCfdi'], timeout=60).content
+            except Exception:
+                ack = None
+        return {'xml': xml, 'acuse': ack}
+
+    # Hace polling al DataWarehouse hasta obtener el XML y, si existe, el acuse de timbrado.
+    # Devuelve {'xml': bytes, 'acuse': bytes|None}. Entre intentos espera con backoff exponencial
+    # y jitter a partir de 'delay' (tope 30 s). Sólo para acciones manuales del usuario: el
+    # timbrado no la usa (difiere la descarga, ver mx.cfdi.document._schedule_download).
+    # 'max_wait' (seg) acota el tiempo total: no se duerme si la siguiente espera lo rebasa,
+    # así una petición HTTP no se queda colgada aunque 'tries' sea grande.
+    # Lanza UserError si no aparece tras 'tries' intentos o al agotar 'max_wait'.
+    def download_xml_by_uuid(self, uuid, tries=30, delay=1.0, max_wait=20.0):
         """Devuelve {'xml': bytes, 'acuse': bytes|None} desde SW DW."""
         if not requests:
             raise UserError(_('El módulo requests no está disponible.'))
         start = time.monotonic()
-        for attempt in range(max(1, int(tries))):   # ← no pises _
-            rec = self._dw_lookup(uuid)
-            if rec and rec.get('urlXml'):
-                xml = requests.get(rec['urlXml'], timeout=60).content
-                ack = None
-                if rec.get('urlAckCfdi'):
-                    try:
-                        ack = requests.get(rec['urlAckCfdi'], timeout=60).content
-                    except Exception:
-                        ack = None
-                return {'xml': xml, 'acuse': ack}
-            time.sleep(max(0.1, float(delay)))
+        deadline = start + max(0.0, float(max_wait))
+        tries = max(1, int(tries))
+        for attempt in range(tries):   # ← no pises _
+            data = self._fetch_stamped_xml(uuid)
+            if data:
+                return data
+            if attempt + 1 < tries:
+                wait = min(30.0, max(0.1, float(delay)) * 2 ** attempt)
+                wait = wait / 2 + random.uniform(0, wait / 2)
+                if time.monotonic() + wait > deadline:
+                    break
+                time.sleep(wait)
 
         waited = time.monotonic() - start
         # usa _() correctamente con % dict (y sin pisarlo en este scope)
@@ -363,14 +463,16 @@ class CfdiProviderSW(models.AbstractModel):
             _logger.warning("SW HTTP TRY | url=%s | token=%s", url, cfg.get('token_fp'))
 
 
-        r = requests.post(url, headers=self._headers(cfg, json_ct=True),
-                          data=json.dumps(payload), timeout=60)
+        r = self._http(cfg).post(url, headers=self._headers(cfg, json_ct=True),
+                                 data=json.dumps(payload), timeout=60)
         if r.status_code >= 400:
             try:
                 data = r.json(); msg = data.get('message') or data.get('Message') or r.text
             except Exception:
                 msg = r.text
             raise UserError(_('SW: error al cargar CSD: %s') % msg)
+        self._cert_cache_invalidate([cfg.get('empresa_id')])
+        cert_cache.put(self._cert_cache_key(cfg), True, self._cert_cache_ttl())
         return True
 
     # Cancela un CFDI vía endpoint CSD de SW usando el CSD de la empresa.
@@ -383,10 +485,69 @@ class CfdiProviderSW(models.AbstractModel):
         ICP = self.env['ir.config_parameter'].sudo()
         debug_http = (ICP.get_param('mx_cfdi_sw.debug_http', '0') or '').lower() in ('1','true','yes')
 
-        rfc = (rfc or cfg.get('rfc') or '').upper()
         url = cfg['base_url'] + '/cfdi33/cancel/csd'
-        payload = {
-            'rfc': rfc,
+        payload = self._cancel_payload(cfg, uuid, rfc=rfc, password=password, motivo=motivo,
+                                       folio_sustitucion=folio_sustitucion)
+        if debug_http:
+            _logger.warning("SW HTTP TRY | url=%s | token=%s", url, cfg.get('token_fp'))
+
+        try:
+            return _cancel_request(self._http(cfg), url, self._headers(cfg, json_ct=True), payload)
+        except _SwCancelError as e:
+            raise UserError(_('Error al cancelar con SW: %s') % e)
+
+    # Cancela varios UUID de UNA empresa (la del contexto) en paralelo.
+    #   items: [{'uuid', 'motivo', 'folio_sustitucion'}]
+    # La configuración, la sesión y los encabezados se arman una vez aquí; los hilos sólo
+    # hacen HTTP (no tocan env/ORM). Un token bucket limita las peticiones por segundo.
+    # Parámetros: mx_cfdi_sw.cancel_workers (default 4), mx_cfdi_sw.cancel_rate (peticiones/s,
+    # default 5; 0 = sin límite).
+    # Devuelve {uuid: {'ok', 'status', 'acuse', 'error', 'elapsed'}}; nunca lanza por un UUID.
+    def _cancel_many(self, items, rfc=None):
+        if not requests:
+            raise UserError(_('El módulo requests no está disponible.'))
+        if not items:
+            return {}
+        cfg = self._cfg(self.env.context.get('empresa_id'))
+        ICP = self.env['ir.config_parameter'].sudo()
+        try:
+            workers = max(1, int(ICP.get_param('mx_cfdi_sw.cancel_workers', 4) or 4))
+            rate = float(ICP.get_param('mx_cfdi_sw.cancel_rate', 5) or 0.0)
+        except (TypeError, ValueError):
+            workers, rate = 4, 5.0
+        url = cfg['base_url'] + '/cfdi33/cancel/csd'
+        session = self._http(cfg)
+        headers = self._headers(cfg, json_ct=True)
+        jobs = [(it['uuid'], self._cancel_payload(cfg, it['uuid'], rfc=rfc,
+                                                  motivo=it.get('motivo') or '02',
+                                                  folio_sustitucion=it.get('folio_sustitucion')))
+                for it in items]
+        bucket = rate_limit.TokenBucket(rate, burst=workers)
+
+        def _one(job):
+            uuid, payload = job
+            bucket.acquire()
+            t0 = time.monotonic()
+            try:
+                res = _cancel_request(session, url, headers, payload)
+                out = {'ok': True, 'status': res.get('status'), 'acuse': res.get('acuse'), 'error': ''}
+            except Exception as e:
+                out = {'ok': False, 'status': None, 'acuse': None, 'error': str(e) or repr(e)}
+            out['elapsed'] = time.monotonic() - t0
+            return uuid, out
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(jobs)),
+                                thread_name_prefix='sw-cancel') as pool:
+            results = dict(pool.map(_one, jobs))
+        _logger.info("SW CANCEL LOTE | empresa=%s | uuids=%s | ok=%s | workers=%s | rate=%s",
+                     cfg.get('empresa_id'), len(results),
+                     sum(1 for r in results.values() if r['ok']), workers, rate)
+        return results
+
+    # Cuerpo JSON del endpoint /cfdi33/cancel/csd.
+    def _cancel_payload(self, cfg, uuid, rfc=None, password=None, motivo='02', folio_sustitucion=None):
+        return {
+            'rfc': (rfc or cfg.get('rfc') or '').upper(),
             'b64Cer': cfg.get('cer_b64') or '',
             'b64Key': cfg.get('key_b64') or '',
             'password': password or cfg.get('key_password') or '',
@@ -394,31 +555,14 @@ class CfdiProviderSW(models.AbstractModel):
             'motivo': motivo,
             'folioSustitucion': folio_sustitucion or ''
         }
-        if debug_http:
-            _logger.warning("SW HTTP TRY | url=%s | token=%s", url, cfg.get('token_fp'))
-
-
-        r = requests.post(url, headers=self._headers(cfg, json_ct=True),
-                          data=json.dumps(payload), timeout=60)
-        if r.status_code >= 400:
-            try:
-                data = r.json(); msg = data.get('message') or data.get('Message') or r.text
-            except Exception:
-                msg = r.text
-            raise UserError(_('Error al cancelar con SW: %s') % msg)
 
-        data = r.json() if r.headers.get('Content-Type','').startswith('application/json') else {}
-        acuse_b64 = data.get('acuse') or data.get('Acuse') or None
-        acuse = base64.b64decode(acuse_b64) if acuse_b64 else None
-        return {'status': data.get('status') or data.get('Status'), 'acuse': acuse}
-    
     # Consulta a SW los certificados cargados y confirma si existe uno para el RFC de la empresa. Devuelve True/False con parsing robusto del JSON de respuesta.
     def _has_cert(self, rfc=None):
         if not requests:
             raise UserError(_('El módulo requests no está disponible.'))
         cfg = self._cfg(self.env.context.get('empresa_id'))
         url = cfg['base_url'] + '/certificates'
-        resp = requests.get(url, headers=self._headers(cfg), timeout=30)
+        resp = self._http(cfg).get(url, headers=self._headers(cfg), timeout=30)
 
         # Parse robusto: puede venir JSON con content-type no-JSON, un dict con 'data',
         # una lista directa o incluso un string JSON.
@@ -459,6 +603,70 @@ class CfdiProviderSW(models.AbstractModel):
         rfc = (rfc or cfg.get('rfc') or '').upper()
         return any(_issuer_rfc(c) == rfc for c in data)
     
+    # Igual que _has_cert pero recordando por `mx_cfdi_sw.cert_cache_ttl` segundos
+    # (default 3600, 0 desactiva) que SW ya tiene el CSD de la empresa. Sólo se
+    # guarda el resultado positivo: un False siempre vuelve a consultar.
+    def _has_cert_cached(self, cfg=None):
+        cfg = cfg or self._cfg(self.env.context.get('empresa_id'))
+        key = self._cert_cache_key(cfg)
+        if cert_cache.get(key):
+            return True
+        has = self.with_context(empresa_id=cfg['empresa_id'])._has_cert(rfc=cfg.get('rfc'))
+        if has:
+            cert_cache.put(key, True, self._cert_cache_ttl())
+        return has
+
+    # Llave de caché: BD, empresa, RFC, host de SW y huella del .cer (un CSD nuevo no reutiliza la entrada).
+    def _cert_cache_key(self, cfg):
+        return (self.env.cr.dbname, cfg.get('empresa_id'), cfg.get('rfc'), cfg.get('base_url'),
+                cert_cache.fingerprint(cfg.get('cer_b64')))
+
+    def _cert_cache_ttl(self):
+        try:
+            return int(self.env['ir.config_parameter'].sudo().get_param('mx_cfdi_sw.cert_cache_ttl', 3600) or 0)
+        except Exception:
+            return 3600
+
+    # Olvida la presencia de CSD cacheada para esas empresas (todas si no se indican).
+    @api.model
+    def _cert_cache_invalidate(self, empresa_ids=None):
+        cert_cache.invalidate(self.env.cr.dbname, [i for i in (empresa_ids or []) if i])
+
+    # ¿El error de SW indica que no tiene cargado el CSD del emisor?
+    @staticmethod
+    def _is_missing_csd(low):
+        if not any(w in low for w in ('certificado', 'csd', 'certificate')):
+            return False
+        return any(w in low for w in ('no se encontr', 'no encontrado', 'not found', 'no existe',
+                                       'no registrado', 'no cargado', 'does not exist'))
+
+    # Sesión HTTP compartida (keep-alive, pool acotado y reintentos) para la URL base
+    # y credenciales de `cfg`. Por defecto usa cfg['base_url']; el DW usa api_base_url.
+    # Parámetros: mx_cfdi_sw.http_pool_maxsize, mx_cfdi_sw.http_retries, mx_cfdi_sw.http_backoff.
+    def _http(self, cfg, base_url=None):
+        ICP = self.env['ir.config_parameter'].sudo()
+        try:
+            maxsize = int(ICP.get_param('mx_cfdi_sw.http_pool_maxsize', 10) or 10)
+            retries = int(ICP.get_param('mx_cfdi_sw.http_retries', 3) or 0)
+            backoff = float(ICP.get_param('mx_cfdi_sw.http_backoff', 0.5) or 0.0)
+        except Exception:
+            maxsize, retries, backoff = 10, 3, 0.5
+        credential = cfg.get('token') or '%s:%s' % (cfg.get('user') or '', cfg.get('password') or '')
+        return http_pool.get_session(base_url or cfg['base_url'], credential,
+                                     pool_maxsize=maxsize, retries=retries, backoff=backoff)
+
+    # Sesión compartida sin credenciales para URLs públicas (p.ej. urlXml del DW).
+    def _http_public(self, url):
+        parts = urlsplit(url)
+        return http_pool.get_session(f"{parts.scheme}://{parts.netloc}")
+
+    # Métricas de las sesiones HTTP de este worker (peticiones, errores, pools).
+    @api.model
+    def _http_pool_stats(self):
+        data = http_pool.stats()
+        _logger.info("SW HTTP POOL: %s", data)
+        return data
+
     # Construye encabezados HTTP para SW. Inserta Authorization Bearer si hay token.
     # Si 'json_ct' es True, añade 'Content-Type: application/json'.
     def _headers(self, cfg, *, json_ct=False):
@@ -483,7 +691,7 @@ class CfdiProviderSW(models.AbstractModel):
         cfg = self._cfg(self.env.context.get('empresa_id'))
         url = cfg['base_url'].rstrip('/') + '/'  # probar raíz
         try:
-            r = requests.get(url, headers=self._headers(cfg), timeout=10)
+            r = self._http(cfg).get(url, headers=self._headers(cfg), timeout=10)
             code = r.status_code
             # Host accesible aunque la ruta raíz no tenga recurso
             if code < 500:
@@ -522,7 +730,7 @@ class CfdiProviderSW(models.AbstractModel):
             return False
         cfg = self._cfg(self.env.context.get('empresa_id'))
         url = cfg['base_url'] + '/certificates'
-        r = requests.get(url, headers=self._headers(cfg), timeout=30)
+        r = self._http(cfg).get(url, headers=self._headers(cfg), timeout=30)
         try:
             data = r.json()
         except Exception:
@@ -35,4 +35,33 @@ class ResConfigSettings(models.TransientModel):
                        'sticky': False}
         }
 
-    
\ No newline at end of file
+    # Botón de "Estadísticas HTTP": resume las sesiones SW de este worker
+    # (peticiones, errores, latencia media y conexiones abiertas).
+    def action_sw_pool_stats(self):
+        self.ensure_one()
+        stats = self.env['mx.cfdi.engine.provider.sw']._http_pool_stats()
+        lines = []
+        for s in stats:
+            conns = sum(p.get('connections', 0) for p in s.get('pools', []))
+            lines.append('%s: %s req, %s err, %.0f ms prom., %s conexiones' % (
+                s['base_url'], s['requests'], s['errors'], s['avg_ms'], conns))
+        return {
+            'type': 'ir.actions.client', 'tag': 'display_notification',
+            'params': {'title': 'SW Sapien - HTTP',
+                       'message': '\n'.join(lines) or 'Sin sesiones abiertas en este worker',
+                       'type': 'info',
+                       'sticky': True}
+        }
+
+    # Botón "Redescubrir ruta": olvida la ruta de timbrado recordada para que el
+    # siguiente timbrado vuelva a probar los endpoints de SW.
+    def action_sw_reset_endpoint(self):
+        self.ensure_one()
+        self.env['mx.cfdi.sw.endpoint']._invalidate()
+        return {
+            'type': 'ir.actions.client', 'tag': 'display_notification',
+            'params': {'title': 'SW Sapien',
+                       'message': 'Se volverá a descubrir la ruta de timbrado en el siguiente CFDI.',
+                       'type': 'success',
+                       'sticky': False}
+        }
@@ -0,0 +1,11 @@
+"""Services for mx_cfdi_provider_sw.
+
+Helpers sin ORM usados por el proveedor SW (pool de sesiones HTTP,
+caché de presencia de CSD y limitador de tasa para llamadas concurrentes).
+sw_simulator (simulador local de SW para desarrollo/benchmark) no se carga
+con el módulo: se ejecuta aparte o se importa explícitamente.
+"""
+
+from . import http_pool
+from . import cert_cache
+from . import rate_limit
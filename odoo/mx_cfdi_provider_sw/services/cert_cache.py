@@ -0,0 +1,44 @@
+# mx_cfdi_provider_sw/services/cert_cache.py
+"""Caché por worker de "SW tiene CSD cargado para el RFC X".
+
+La llave incluye la base de datos, la empresa, el RFC y una huella del .cer,
+así que cambiar el certificado de la empresa invalida la entrada en cualquier
+worker sin señalización adicional.
+"""
+import hashlib
+import threading
+import time
+
+_lock = threading.Lock()
+_entries = {}
+
+
+def fingerprint(cer_b64):
+    return hashlib.sha1((cer_b64 or '').encode()).hexdigest()[:16]
+
+
+def get(key):
+    """Valor vigente para `key` o None si no hay o ya expiró."""
+    entry = _entries.get(key)
+    if not entry:
+        return None
+    value, expires = entry
+    if expires < time.monotonic():
+        with _lock:
+            _entries.pop(key, None)
+        return None
+    return value
+
+
+def put(key, value, ttl):
+    with _lock:
+        _entries[key] = (value, time.monotonic() + max(0, ttl))
+
+
+def invalidate(dbname, empresa_ids=None):
+    """Olvida las entradas de la BD (todas o sólo de `empresa_ids`)."""
+    empresa_ids = set(empresa_ids or [])
+    with _lock:
+        for key in list(_entries):
+            if key[0] == dbname and (not empresa_ids or key[1] in empresa_ids):
+                _entries.pop(key, None)
@@ -0,0 +1,140 @@
+# mx_cfdi_provider_sw/services/http_pool.py
+"""Pool de sesiones HTTP compartidas por worker para hablar con SW.
+
+Cada proceso de Odoo guarda una `requests.Session` por (URL base, credencial),
+con conexiones keep-alive, un tamaño de pool acotado y reintentos con backoff.
+Así un timbrado reutiliza la conexión TLS abierta en lugar de negociar una
+nueva en cada llamada (_stamp_xml, _has_cert, _dw_lookup, descarga, etc.).
+"""
+import hashlib
+import threading
+import time
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except Exception:  # pragma: no cover
+    requests = None
+
+_lock = threading.Lock()
+_sessions = {}
+
+# Sólo se reintenta el envío cuando la conexión no se pudo abrir o en GET
+# idempotentes; un POST de timbrado que llegó a SW no se repite solo.
+_RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+_RETRY_STATUS = (502, 503, 504)
+
+
+def _cred_key(credential):
+    return hashlib.sha1((credential or '').encode()).hexdigest()[:12]
+
+
+if requests:
+    class PooledSession(requests.Session):
+        """Session con contadores para monitoreo."""
+
+        def __init__(self, base_url):
+            super().__init__()
+            self.base_url = base_url
+            self.created = time.time()
+            self.last_used = None
+            self.requests = 0
+            self.errors = 0
+            self.elapsed = 0.0
+            self.config = None
+
+        def request(self, method, url, *args, **kwargs):
+            t0 = time.monotonic()
+            self.requests += 1
+            self.last_used = time.time()
+            try:
+                return super().request(method, url, *args, **kwargs)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.elapsed += time.monotonic() - t0
+
+
+def get_session(base_url, credential='', pool_maxsize=10, retries=3, backoff=0.5):
+    """Devuelve la sesión compartida para `base_url` + `credential` (la crea si falta).
+
+    Si cambió la configuración (tamaño de pool, reintentos o backoff) la sesión
+    anterior se cierra y se crea otra: así los demás workers toman los parámetros
+    nuevos sin reiniciar aunque el close_all() sólo corra en el que los guardó.
+    """
+    if not requests:
+        return None
+    base_url = (base_url or '').rstrip('/')
+    key = (base_url, _cred_key(credential))
+    config = (pool_maxsize, retries, backoff)
+    session = _sessions.get(key)
+    if session is not None and session.config == config:
+        return session
+    with _lock:
+        session = _sessions.get(key)
+        if session is not None and session.config != config:
+            try:
+                session.close()
+            except Exception:
+                pass
+            session = None
+        if session is None:
+            session = PooledSession(base_url)
+            session.config = config
+            retry = Retry(
+                total=retries, connect=retries, read=retries, status=retries,
+                backoff_factor=backoff,
+                status_forcelist=_RETRY_STATUS,
+                allowed_methods=_RETRY_METHODS,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                                  max_retries=retry, pool_block=False)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[key] = session
+    return session
+
+
+def close_all():
+    """Cierra y olvida todas las sesiones (p.ej. al cambiar credenciales)."""
+    with _lock:
+        for session in _sessions.values():
+            try:
+                session.close()
+            except Exception:
+                pass
+        _sessions.clear()
+
+
+def stats():
+    """Lista de métricas por sesión: peticiones, errores, tiempo y estado de los pools."""
+    out = []
+    for (base_url, cred), session in list(_sessions.items()):
+        pools = []
+        for adapter in set(session.adapters.values()):
+            manager = getattr(adapter, 'poolmanager', None)
+            for pool_key in (list(manager.pools.keys()) if manager else []):
+                pool = manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                pools.append({
+                    'host': getattr(pool, 'host', ''),
+                    'connections': getattr(pool, 'num_connections', 0),
+                    'requests': getattr(pool, 'num_requests', 0),
+                    'idle': pool.pool.qsize() if getattr(pool, 'pool', None) else 0,
+                    'maxsize': getattr(pool.pool, 'maxsize', 0) if getattr(pool, 'pool', None) else 0,
+                })
+        out.append({
+            'base_url': base_url,
+            'credential': cred,
+            'requests': session.requests,
+            'errors': session.errors,
+            'avg_ms': (session.elapsed / session.requests * 1000.0) if session.requests else 0.0,
+            'created': session.created,
+            'last_used': session.last_used,
+            'pools': pools,
+        })
+    return out
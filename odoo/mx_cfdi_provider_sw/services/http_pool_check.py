@@ -0,0 +1,123 @@
+# mx_cfdi_provider_sw/services/http_pool_check.py
+"""Verificación del pool HTTP contra el simulador de SW local (sólo stdlib + requests, sin ORM).
+
+Levanta sw_simulator en un puerto libre y revisa que http_pool:
+    - reutilice la conexión keep-alive entre peticiones seguidas,
+    - no conserve más de `pool_maxsize` conexiones con carga concurrente,
+    - separe sesiones por credencial y regrese la misma para la misma llave,
+    - rehaga (y cierre) la sesión cuando cambia la configuración del pool,
+    - olvide todo con close_all().
+No lo importa el módulo.
+
+Uso (consola):
+    python http_pool_check.py --threads 16 --requests 200
+Imprime el resultado por verificación y sale con código 1 si alguna falla.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+try:
+    from . import http_pool, sw_simulator
+except ImportError:     # ejecutado como script
+    import http_pool
+    import sw_simulator
+
+_AUTH = {'Authorization': 'Bearer prueba'}
+
+
+def _connections(session):
+    """Conexiones abiertas (creadas) y en reposo de los pools de la sesión."""
+    for info in http_pool.stats():
+        if info['base_url'] == session.base_url and info['requests'] == session.requests:
+            pools = info['pools']
+            return (sum(p['connections'] for p in pools), sum(p['idle'] for p in pools),
+                    max([p['maxsize'] for p in pools] or [0]))
+    return 0, 0, 0
+
+
+def run(threads=16, total=200, latency_ms=20.0):
+    """Corre las verificaciones; regresa [(nombre, ok, detalle)]."""
+    server = sw_simulator.serve(port=0, latency_ms=latency_ms, jitter_ms=0)
+    url = server.url
+    results = []
+
+    def _check(name, ok, detail=''):
+        results.append((name, bool(ok), detail))
+
+    try:
+        http_pool.close_all()
+
+        # Reutilización keep-alive
+        s = http_pool.get_session(url, 'tok', pool_maxsize=4, retries=0)
+        for _i in range(20):
+            s.get(url + '/certificates', headers=_AUTH, timeout=10).raise_for_status()
+        conns, _idle, _max = _connections(s)
+        _check('keepalive', conns == 1, '20 GET -> %s conexiones' % conns)
+
+        # Carga concurrente con pool acotado
+        errors = []
+        per_thread = max(1, total // max(1, threads))
+
+        def _worker():
+            for _i in range(per_thread):
+                try:
+                    s.get(url + '/certificates', headers=_AUTH, timeout=10).raise_for_status()
+                except Exception as e:
+                    errors.append(str(e))
+
+        t0 = time.monotonic()
+        workers = [threading.Thread(target=_worker) for _i in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        wall = time.monotonic() - t0
+        conns, idle, maxsize = _connections(s)
+        _check('concurrent', not errors and idle <= 4 and maxsize == 4,
+               '%s hilos x %s GET en %.2f s: %s errores, %s creadas, %s en reposo (max %s)'
+               % (threads, per_thread, wall, len(errors), conns, idle, maxsize))
+
+        # Llaves de sesión
+        _check('same_key', http_pool.get_session(url, 'tok', pool_maxsize=4, retries=0) is s)
+        other = http_pool.get_session(url, 'otra', pool_maxsize=4, retries=0)
+        _check('per_credential', other is not s)
+
+        # Cambio de configuración del pool
+        s2 = http_pool.get_session(url, 'tok', pool_maxsize=8, retries=0)
+        s2.get(url + '/certificates', headers=_AUTH, timeout=10).raise_for_status()
+        _conns, _idle, maxsize = _connections(s2)
+        old_pools = sum(len(a.poolmanager.pools.keys()) for a in set(s.adapters.values()))
+        _check('config_change', s2 is not s and maxsize == 8 and old_pools == 0,
+               'maxsize=%s, pools de la sesión anterior=%s' % (maxsize, old_pools))
+
+        # close_all
+        http_pool.close_all()
+        _check('close_all', not http_pool.stats(),
+               '%s sesiones tras close_all' % len(http_pool.stats()))
+    finally:
+        http_pool.close_all()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Verificación del pool HTTP contra el simulador SW')
+    p.add_argument('--threads', type=int, default=16)
+    p.add_argument('--requests', type=int, default=200, help='GET totales de la prueba concurrente')
+    p.add_argument('--latency-ms', type=float, default=20.0)
+    args = p.parse_args(argv)
+    if http_pool.requests is None:
+        print('requests no está instalado')
+        return 1
+    results = run(args.threads, args.requests, args.latency_ms)
+    print(json.dumps([{'check': n, 'ok': ok, 'detalle': d} for n, ok, d in results],
+                     indent=2, ensure_ascii=False))
+    return 0 if all(ok for _n, ok, _d in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
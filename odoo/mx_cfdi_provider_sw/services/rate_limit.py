@@ -0,0 +1,37 @@
+# mx_cfdi_provider_sw/services/rate_limit.py
+"""Limitador de tasa (token bucket) seguro entre hilos.
+
+Lo usa la cancelación por lote para no rebasar las peticiones por segundo que
+acepta SW aunque varios hilos llamen al PAC a la vez: cada llamada toma una
+ficha con acquire(), que espera lo necesario si la cubeta está vacía.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """`rate` fichas por segundo con ráfaga máxima de `burst` (rate <= 0: sin límite)."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate or 0.0)
+        self.burst = max(1.0, float(burst or 1))
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Toma una ficha; regresa los segundos que tuvo que esperar."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return waited
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
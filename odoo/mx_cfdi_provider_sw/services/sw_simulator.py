@@ -0,0 +1,278 @@
+# mx_cfdi_provider_sw/services/sw_simulator.py
+"""Simulador local de SW Sapien para desarrollo y benchmark (sólo stdlib, sin ORM).
+
+Atiende las rutas que usa el proveedor SW:
+    POST /cfdi40/issue/v4 (y demás /cfdiXX/issue|stamp[/vN])   timbrado (multipart 'xml')
+    GET  /certificates          CSD cargados (lista con el RFC una vez que se sube)
+    POST /certificates/save     carga de CSD
+    POST /cfdi33/cancel/csd     cancelación (acuse en base64)
+    GET  /datawarehouse/v1/live/<uuid>   DW: aparece `dw_lag` segundos después del timbrado
+    GET  /_sim/xml/<uuid>       XML timbrado (urlXml del DW)
+    GET  /_sim/stats            contadores por ruta y resultado
+    POST /_sim/config           cambia la configuración en caliente (JSON)
+
+Inyección de fallas y latencia (SimConfig):
+    latency_ms / jitter_ms    latencia por petición (uniforme en latency ± jitter)
+    error_rate                500 en timbrado/cancelación
+    rate_305                  400 "CFDI40305 ... vigencia del CSD" (el engine reintenta con Fecha UTC)
+    missing_xml_rate          timbra pero sin 'cfdi' en la respuesta (el XML llega por el DW)
+    dw_lag                    segundos hasta que el DW expone el UUID
+    cancel_error_rate         400 en cancelación
+    seed                      semilla para repetir una corrida
+
+Uso (consola):
+    python sw_simulator.py --port 8089 --latency-ms 300 --rate-305 0.05 --missing-xml-rate 0.1
+y en Odoo: mx_cfdi_sw.base_url = mx_cfdi_sw.api_base_url = http://127.0.0.1:8089
+(mx_cfdi_sw.token cualquiera). Desde código: server = serve(port=0); server.url; server.shutdown().
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid as uuidlib
+from collections import Counter
+from dataclasses import dataclass, asdict, fields as dc_fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_STAMP_RE = re.compile(r'^/cfdi(33|40)/(issue|stamp)(/v[1-4])?$')
+_DW_RE = re.compile(r'^/datawarehouse/v1/live/([0-9A-Fa-f-]{36})$')
+_XML_RE = re.compile(r'^/_sim/xml/([0-9A-Fa-f-]{36})$')
+_RFC_RE = re.compile(rb'<cfdi:Emisor[^>]*\sRfc="([^"]+)"')
+_TFD = ('<cfdi:Complemento><tfd:TimbreFiscalDigital '
+        'xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" Version="1.1" UUID="%s" '
+        'FechaTimbrado="%s" RfcProvCertif="SPR190613I52" SelloCFD="SIM" '
+        'NoCertificadoSAT="00001000000000000000" SelloSAT="SIM"/></cfdi:Complemento>')
+
+
+@dataclass
+class SimConfig:
+    latency_ms: float = 150.0
+    jitter_ms: float = 50.0
+    error_rate: float = 0.0
+    rate_305: float = 0.0
+    missing_xml_rate: float = 0.0
+    dw_lag: float = 2.0
+    cancel_error_rate: float = 0.0
+    seed: int = None
+
+    def update(self, **vals):
+        names = {f.name for f in dc_fields(self)}
+        for k, v in vals.items():
+            if k in names:
+                setattr(self, k, v)
+
+
+class SimState:
+    """Estado compartido entre hilos del servidor."""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.lock = threading.Lock()
+        self.rng = random.Random(cfg.seed)
+        self.certs = set()          # RFC con CSD cargado
+        self.stamped = {}           # uuid -> (monotonic, xml bytes)
+        self.stats = Counter()
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def delay(self):
+        cfg = self.cfg
+        with self.lock:
+            ms = cfg.latency_ms + self.rng.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+
+def _extract_xml(body):
+    """Toma el XML del multipart (campo 'xml') sin depender del parser de email."""
+    start = body.find(b'<?xml')
+    if start < 0:
+        start = body.find(b'<cfdi:Comprobante')
+    end = body.rfind(b'</cfdi:Comprobante>')
+    if start < 0 or end < 0:
+        return b''
+    return body[start:end + len(b'</cfdi:Comprobante>')]
+
+
+def _stamp(xml, uid):
+    fecha = time.strftime('%Y-%m-%dT%H:%M:%S')
+    tfd = (_TFD % (uid, fecha)).encode('utf-8')
+    end = xml.rfind(b'</cfdi:Comprobante>')
+    return xml[:end] + tfd + xml[end:]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'SWSimulator/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    @property
+    def sim(self):
+        return self.server.sim
+
+    def _body(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(n) if n else b''
+
+    def _send(self, code, payload=None, raw=None, ctype='application/json'):
+        data = raw if raw is not None else json.dumps(payload or {}).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _auth_ok(self):
+        if self.headers.get('Authorization', '').startswith('Bearer '):
+            return True
+        self._send(401, {'status': 'error', 'message': 'AU2000 - Token inválido'})
+        return False
+
+    def do_GET(self):
+        sim, path = self.sim, self.path.split('?', 1)[0]
+        if path == '/_sim/stats':
+            with sim.lock:
+                out = {'stats': dict(sim.stats), 'stamped': len(sim.stamped),
+                       'config': asdict(sim.cfg)}
+            return self._send(200, out)
+        m = _XML_RE.match(path)
+        if m:
+            hit = sim.stamped.get(m.group(1))
+            sim.count('xml.%s' % ('ok' if hit else '404'))
+            return self._send(200, raw=hit[1], ctype='application/xml') if hit else self._send(404)
+        if not self._auth_ok():
+            return
+        sim.delay()
+        if path == '/certificates':
+            sim.count('certificates')
+            return self._send(200, {'status': 'success',
+                                    'data': [{'issuer_rfc': r} for r in sorted(sim.certs)]})
+        m = _DW_RE.match(path)
+        if m:
+            hit = sim.stamped.get(m.group(1))
+            ready = hit and time.monotonic() - hit[0] >= sim.cfg.dw_lag
+            sim.count('dw.%s' % ('hit' if ready else 'miss'))
+            recs = []
+            if ready:
+                host = self.headers.get('Host') or '%s:%s' % self.server.server_address[:2]
+                recs.append({'uuid': m.group(1), 'urlXml': 'http://%s/_sim/xml/%s' % (host, m.group(1))})
+            return self._send(200, {'status': 'success', 'data': {'records': recs}})
+        sim.count('404')
+        self._send(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        sim, path = self.sim, self.path.split('?', 1)[0]
+        body = self._body()
+        if path == '/_sim/config':
+            sim.cfg.update(**json.loads(body or b'{}'))
+            return self._send(200, asdict(sim.cfg))
+        if not self._auth_ok():
+            return
+        sim.delay()
+        if path == '/certificates/save':
+            rfc = (json.loads(body or b'{}').get('rfc') or '').upper()
+            with sim.lock:
+                sim.certs.add(rfc or '*')
+            sim.count('certificates.save')
+            return self._send(200, {'status': 'success'})
+        if path == '/cfdi33/cancel/csd':
+            req = json.loads(body or b'{}')
+            if sim.roll(sim.cfg.error_rate):
+                sim.count('cancel.500')
+                return self._send(500, {'status': 'error', 'message': 'Error interno (simulado)'})
+            if sim.roll(sim.cfg.cancel_error_rate) or req.get('uuid') not in sim.stamped:
+                sim.count('cancel.400')
+                return self._send(400, {'status': 'error',
+                                        'message': 'CA205 - UUID no encontrado o no cancelable (simulado)'})
+            acuse = base64.b64encode(('<Acuse UUID="%s" Estatus="201"/>' % req['uuid']).encode()).decode()
+            sim.count('cancel.ok')
+            return self._send(200, {'status': 'success', 'acuse': acuse, 'data': {'acuse': acuse}})
+        if _STAMP_RE.match(path):
+            return self._issue(body)
+        sim.count('404')
+        self._send(404, {'message': 'Not found'})
+
+    def _issue(self, body):
+        sim = self.sim
+        xml = _extract_xml(body)
+        if not xml:
+            sim.count('stamp.400')
+            return self._send(400, {'status': 'error', 'message': 'CFDI40999 - XML no recibido'})
+        m = _RFC_RE.search(xml)
+        rfc = (m.group(1).decode() if m else '').upper()
+        if sim.certs and rfc not in sim.certs and '*' not in sim.certs:
+            sim.count('stamp.csd')
+            return self._send(400, {'status': 'error', 'message': 'CSD no encontrado para el RFC (simulado)'})
+        if sim.roll(sim.cfg.error_rate):
+            sim.count('stamp.500')
+            return self._send(500, {'status': 'error', 'message': 'Error interno (simulado)'})
+        if sim.roll(sim.cfg.rate_305):
+            sim.count('stamp.305')
+            return self._send(400, {'status': 'error', 'message':
+                                    'CFDI40305 - La fecha de emisión no está dentro de la vigencia del CSD del Emisor'})
+        uid = str(uuidlib.uuid4()).upper()
+        stamped = _stamp(xml, uid)
+        with sim.lock:
+            sim.stamped[uid] = (time.monotonic(), stamped)
+        data = {'uuid': uid}
+        if sim.roll(sim.cfg.missing_xml_rate):
+            sim.count('stamp.no_xml')
+        else:
+            sim.count('stamp.ok')
+            data['cfdi'] = stamped.decode('utf-8')
+        self._send(200, {'status': 'success', 'data': data})
+
+
+class SimServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cfg):
+        super().__init__(address, _Handler)
+        self.sim = SimState(cfg)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+
+def serve(host='127.0.0.1', port=8089, background=True, **cfg):
+    """Levanta el simulador; con background=True corre en un hilo y regresa el servidor."""
+    server = SimServer((host, port), SimConfig(**cfg))
+    if background:
+        threading.Thread(target=server.serve_forever, name='sw-simulator', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Simulador local de SW Sapien')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8089)
+    for f in dc_fields(SimConfig):
+        p.add_argument('--' + f.name.replace('_', '-'), type=int if f.name == 'seed' else float,
+                       default=f.default)
+    args = vars(p.parse_args(argv))
+    host, port = args.pop('host'), args.pop('port')
+    server = serve(host, port, background=False, **args)
+    print('SW simulator en %s (%s)' % (server.url, args))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -127,3 +127,31 @@ class pagos(models.Model):
                 raise ValidationError("El pago no puede ser cancelado.")
             record.status = 'cancelled'
         return True
+
+    # Campos que cambian los pagos considerados en el interés del crédito.
+    _CAMPOS_INTERES = ('fecha', 'status', 'monto', 'credito')
+
+    def _invalidar_cortes_interes(self, desde=None):
+        for record in self:
+            fecha = desde or record.fecha
+            if desde and record.fecha:
+                fecha = min(desde, record.fecha)
+            record.credito._invalidar_cortes_interes(fecha)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records.filtered(lambda p: p.credito and p.status == 'posted')._invalidar_cortes_interes()
+        return records
+
+    def write(self, vals):
+        if any(f in vals for f in self._CAMPOS_INTERES):
+            self._invalidar_cortes_interes(fields.Date.to_date(vals.get('fecha')))
+        res = super().write(vals)
+        if 'credito' in vals:
+            self._invalidar_cortes_interes()
+        return res
+
+    def unlink(self):
+        self._invalidar_cortes_interes()
+        return super().unlink()
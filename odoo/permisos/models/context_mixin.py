@@ -70,7 +70,7 @@ class PermModuleContextMixin(models.AbstractModel):
         _apply('bodega', bod_id)
         _apply('bodega_id', bod_id)
 
-        _logger.info(
+        _logger.debug(
             "CTX.default_get(%s): modulo=%s -> empresa=%s sucursal=%s bodega=%s",
             self._name, code, emp_id, suc_id, bod_id,
         )
@@ -148,26 +148,8 @@ class PermModuleContextMixin(models.AbstractModel):
                 rec.ctx_context_label = _("Sin contexto")
             return
 
-        emp_id, suc_id, bod_id = self.env.user._resolve_ctx_from_user_module(
-            code, None, None, None
-        )
-
-        Empresa = self.env['empresas.empresa']
-        Sucursal = self.env['sucursales.sucursal']
-        Bodega = self.env['bodegas.bodega']
-
-        emp = Empresa.browse(emp_id) if emp_id else Empresa.browse()
-        suc = Sucursal.browse(suc_id) if suc_id else Sucursal.browse()
-        bod = Bodega.browse(bod_id) if bod_id else Bodega.browse()
-
-        parts = []
-        if emp:
-            parts.append(emp.display_name)
-        if suc:
-            parts.append(suc.display_name)
-        if bod:
-            parts.append(bod.display_name)
-        label = " / ".join(parts) if parts else _("Sin contexto definido")
+        # Cacheado por petición (cr.cache) y, para el contexto guardado, entre peticiones
+        emp, suc, bod, label = self.env.user._perm_ctx_info(code)
 
         for rec in self:
             rec.ctx_empresa_id = emp
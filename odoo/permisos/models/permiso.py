@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
 # permisos/models/permiso.py
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
 from odoo.osv import expression
-from logging import getLogger
+from collections import Counter
+from logging import getLogger, DEBUG
 _logger = getLogger(__name__)
 
+# Contadores de la resolución de contexto (hit/miss por nivel de caché). Sólo se llevan con
+# el logger en DEBUG: --log-handler=odoo.addons.permisos.models.permiso:DEBUG
+_CTX_STATS = Counter()
+_CTX_CR_KEY = 'permisos.user.ctx'  # caché por petición en cr.cache
+_VERSION_CR_KEY = 'permisos.perm.version'
+_CTX_STAMP_CR_KEY = 'permisos.user.ctx.stamp'  # {user_id: sello de sus contextos} por petición
+
+# Llave de ormcache con la versión de permisos (ver permisos.perm.version)
+_PERM_VERSION = 'self.env["permisos.perm.version"]._perm_version()'
+
+
+def _ctx_stat(key):
+    if _logger.isEnabledFor(DEBUG):
+        _CTX_STATS[key] += 1
+
 class ResUsers(models.Model):
     _inherit = 'res.users'
     
@@ -44,46 +60,140 @@ class ResUsers(models.Model):
             bodega_id = ctx.get('bodega_actual_id') or bodega_id
 
         if empresa_id or sucursal_id or bodega_id:
-            _logger.info(
-                "RESOLVE_CTX (explicit/context): user=%s modulo=%s -> empresa=%s sucursal=%s bodega=%s",
-                self.id, modulo_code, empresa_id, sucursal_id, bodega_id,
-            )
+            _ctx_stat('explicit')
             return empresa_id, sucursal_id, bodega_id
 
-        # 2) Fallback: tabla permisos.user.context
-        Ctx = self.env['permisos.user.context'].sudo()
-        Mod = self.env['permisos.modulo'].sudo().search([('code', '=', modulo_code)], limit=1)
+        # 2) Fallback: contexto guardado (permisos.user.context), cacheado
+        return self._perm_user_ctx_ids(self.id, modulo_code)
 
-        if not Mod:
-            _logger.info(
-                "RESOLVE_CTX (no modulo): user=%s modulo=%s -> sin registro de módulo",
-                self.id, modulo_code,
-            )
+    # Contexto guardado de user+modulo como ids (empresa, sucursal, bodega). Se cachea entre
+    # peticiones (ormcache) con el sello de los contextos de ese usuario (_perm_user_ctx_stamp):
+    # cambiar de empresa/sucursal/bodega sólo invalida al propio usuario. La versión de
+    # permisos cubre el mapa de códigos de módulo.
+    @api.model
+    @tools.ormcache('user_id', 'modulo_code', 'self._perm_user_ctx_stamp(user_id)', _PERM_VERSION)
+    def _perm_user_ctx_ids(self, user_id, modulo_code):
+        _ctx_stat('ids.miss')
+        mod_id = self.env['permisos.modulo']._code_id_map().get(modulo_code)
+        if not mod_id:
             return False, False, False
-
-        ctx_rec = Ctx.search([
-            ('usuario_id', '=', self.id),
-            ('modulo_id',  '=', Mod.id),
+        ctx_rec = self.env['permisos.user.context'].sudo().search([
+            ('usuario_id', '=', user_id),
+            ('modulo_id', '=', mod_id),
         ], limit=1)
+        return ctx_rec.empresa_id.id or False, ctx_rec.sucursal_id.id or False, ctx_rec.bodega_id.id or False
 
-        if not ctx_rec:
-            _logger.info(
-                "RESOLVE_CTX (no ctx_rec): user=%s modulo=%s -> sin contexto guardado",
-                self.id, modulo_code,
-            )
-            return False, False, False
+    # Sello de los contextos guardados del usuario (cuántos, último id, último write_date); una
+    # consulta por usuario y petición (cr.cache). Cambia con cualquier create/write/unlink
+    # de sus permisos.user.context sin tocar filas compartidas con otros usuarios.
+    @api.model
+    def _perm_user_ctx_stamp(self, user_id):
+        cache = self.env.cr.cache.setdefault(_CTX_STAMP_CR_KEY, {})
+        if user_id not in cache:
+            self.env.cr.execute("""
+                SELECT count(*), max(id), max(write_date)
+                  FROM permisos_user_context
+                 WHERE usuario_id = %s
+            """, [user_id])
+            cache[user_id] = self.env.cr.fetchone()
+        return cache[user_id]
+
+    def _perm_ctx_info(self, modulo_code):
+        """(empresa, sucursal, bodega, etiqueta) del usuario en el módulo.
+
+        Se guarda por petición en cr.cache; los ids salen de _resolve_ctx_from_user_module
+        (overrides de env.context o contexto guardado). La etiqueta no se cachea entre
+        peticiones para que un cambio de nombre se vea de inmediato.
+        """
+        self.ensure_one()
+        ctx = self.env.context
+        key = (self.id, modulo_code, ctx.get('lang'), ctx.get('empresa_actual_id'),
+               ctx.get('sucursal_actual_id'), ctx.get('bodega_actual_id'))
+        cache = self.env.cr.cache.setdefault(_CTX_CR_KEY, {})
+        if key in cache:
+            _ctx_stat('info.hit')
+            emp_id, suc_id, bod_id, label = cache[key]
+        else:
+            _ctx_stat('info.miss')
+            emp_id, suc_id, bod_id = self._resolve_ctx_from_user_module(modulo_code)
+            parts = [r.display_name for r in (self.env['empresas.empresa'].browse(emp_id),
+                                              self.env['sucursales.sucursal'].browse(suc_id),
+                                              self.env['bodegas.bodega'].browse(bod_id)) if r]
+            label = " / ".join(parts) if parts else _("Sin contexto definido")
+            cache[key] = (emp_id, suc_id, bod_id, label)
+        if _logger.isEnabledFor(DEBUG):
+            _logger.debug("RESOLVE_CTX: user=%s modulo=%s -> %s | %s",
+                          self.id, modulo_code, cache[key], dict(_CTX_STATS))
+        return (self.env['empresas.empresa'].browse(emp_id),
+                self.env['sucursales.sucursal'].browse(suc_id),
+                self.env['bodegas.bodega'].browse(bod_id),
+                label)
+
+
+# Versión de la configuración de permisos. Las cachés entre peticiones de permisos
+# (res.users._perm_matrix, _perm_user_ctx_ids, permisos.modulo._code_id_map) llevan la
+# versión en su llave: un cambio sube la versión y las entradas viejas dejan de usarse en
+# todos los workers sin vaciar la caché del registro (vistas, ACL, etc. de otros módulos).
+# El valor sale de una secuencia (nunca se repite aunque la transacción se revierta) y se
+# guarda en una fila normal, así los demás workers sólo ven la versión nueva tras el commit.
+class PermVersion(models.Model):
+    _name = 'permisos.perm.version'
+    _description = 'Versión de la configuración de permisos'
+    _log_access = False
+
+    version = fields.Integer(required=True, default=0)
+
+    def init(self):
+        cr = self.env.cr
+        cr.execute("CREATE SEQUENCE IF NOT EXISTS permisos_perm_version_seq")
+        cr.execute("""
+            INSERT INTO permisos_perm_version (version)
+            SELECT nextval('permisos_perm_version_seq')
+            WHERE NOT EXISTS (SELECT 1 FROM permisos_perm_version)
+        """)
+
+    # Versión vigente para esta transacción (una consulta por petición, cr.cache).
+    @api.model
+    def _perm_version(self):
+        cache = self.env.cr.cache
+        if _VERSION_CR_KEY not in cache:
+            self.env.cr.execute("SELECT max(version) FROM permisos_perm_version")
+            cache[_VERSION_CR_KEY] = self.env.cr.fetchone()[0] or 0
+        return cache[_VERSION_CR_KEY]
+
+    # Invalida las cachés de permisos: versión nueva y fuera la caché por petición.
+    @api.model
+    def _perm_bump(self):
+        self.env.cr.execute("UPDATE permisos_perm_version SET version = nextval('permisos_perm_version_seq')")
+        self.env.cr.cache.pop(_VERSION_CR_KEY, None)
+        self.env.cr.cache.pop(_CTX_CR_KEY, None)
 
-        emp = ctx_rec.empresa_id.id or False
-        suc = ctx_rec.sucursal_id.id or False
-        bod = ctx_rec.bodega_id.id or False
 
-        _logger.info(
-            "RESOLVE_CTX (from_db): user=%s modulo=%s -> empresa=%s sucursal=%s bodega=%s ctx_id=%s",
-            self.id, modulo_code, emp, suc, bod, ctx_rec.id,
-        )
-        return emp, suc, bod
+# Invalida las cachés de permisos (ver permisos.perm.version) cuando cambian permisos,
+# rangos o asignaciones. Los contextos de usuario no suben la versión global (ver
+# res.users._perm_user_ctx_stamp).
+class PermCacheMixin(models.AbstractModel):
+    _name = 'permisos.perm.cache.mixin'
+    _description = 'Invalida la matriz de permisos al modificar registros'
 
+    def _perm_clear_caches(self):
+        self.env['permisos.perm.version']._perm_bump()
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        recs = super().create(vals_list)
+        self._perm_clear_caches()
+        return recs
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._perm_clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._perm_clear_caches()
+        return res
 
 
 #Se guardan los permisos de modulo funcionales
@@ -207,6 +317,18 @@ class PermModulo(models.Model):
         for r in self:
             r.dirty = True
 
+    # Mapa código -> id de los módulos activos (ormcache por versión de permisos). Se calienta
+    # al cargar el registro; los create/write(code, active)/unlink de módulos suben la versión.
+    @api.model
+    @tools.ormcache(_PERM_VERSION)
+    def _code_id_map(self):
+        self.env.cr.execute("SELECT code, id FROM permisos_modulo WHERE active ORDER BY code, id DESC")
+        return dict(self.env.cr.fetchall())
+
+    def _register_hook(self):
+        super()._register_hook()
+        self._code_id_map()
+
     # --- NORMALIZA el code siempre a minúsculas/trim ---
     @api.model
     def create(self, vals):
@@ -215,6 +337,7 @@ class PermModulo(models.Model):
         rec = super().create(vals)
         # marca dirty para que el botón "Aplicar seguridad" aparezca
         rec.dirty = True
+        self.env['permisos.perm.version']._perm_bump()  # un código nuevo pudo quedar cacheado como inexistente
         return rec
 
     def write(self, vals):
@@ -225,6 +348,8 @@ class PermModulo(models.Model):
         if {'code', 'name', 'description', 'active', 'menu_ids'} & set(vals.keys()):
             vals['dirty'] = True
         res = super().write(vals)
+        if {'code', 'active'} & set(vals.keys()):
+            self.env['permisos.perm.version']._perm_bump()  # matriz de permisos y mapa de códigos de módulo
         # si cambian code/name, renombrar el grupo coherente "[code] name"
         if {'code', 'name'} & set(vals.keys()):
             for r in self.filtered('group_id'):
@@ -264,7 +389,9 @@ class PermModulo(models.Model):
                     "• O elimina primero los registros relacionados (Permisos, Accesos, Contextos, Config. de modelos)."
                 ) % {'mod': mod.display_name, 'det': "\n".join(det)})
 
-        return super().unlink()
+        res = super().unlink()
+        self.env['permisos.perm.version']._perm_bump()
+        return res
 
 
 
@@ -272,6 +399,7 @@ class PermModulo(models.Model):
 #Acción puntual que se concede/deniega y es lo que consulta has_perm/check_perm.
 class PermPermiso(models.Model):
     _name = 'permisos.permiso'
+    _inherit = ['permisos.perm.cache.mixin']
     _description = 'Permiso atómico dentro de un módulo'
     _order = 'modulo_id, code'
 
@@ -312,6 +440,7 @@ class PermPermiso(models.Model):
 #Se guardan los rangos (paquetes de permisos). Estructura.
 class PermRango(models.Model):
     _name = 'permisos.rango'
+    _inherit = ['permisos.perm.cache.mixin']
     _description = 'Rango (paquete de permisos)'
     _order = 'code'
 
@@ -335,6 +464,7 @@ class PermRango(models.Model):
 # Da la base de permisos del usuario (suma todo lo que traen sus rangos aplicables al contexto).
 class PermAsignacionRango(models.Model):
     _name = 'permisos.asignacion.rango'
+    _inherit = ['permisos.perm.cache.mixin']
     _description = 'Asignación de rango(s) a usuario con contexto'
     _order = 'id desc'
     _check_company_auto = False
@@ -402,6 +532,7 @@ class PermAsignacionRango(models.Model):
 #Ajusta la base solo para ese permiso: permite o deniega explícitamente. hace una excepcion a lo que traen los rangos.
 class PermAsignacionPermiso(models.Model):
     _name = 'permisos.asignacion.permiso'
+    _inherit = ['permisos.perm.cache.mixin']
     _description = 'Override de permiso por usuario (permitir o denegar)'
     _order = 'id desc'
     _check_company_auto = False
@@ -1,5 +1,8 @@
 # permisos/models/user_context.py
-from odoo import models, fields
+from odoo import models, fields, api
+
+from .permiso import _CTX_CR_KEY, _CTX_STAMP_CR_KEY
+
 
 class PermUserContext(models.Model):
     _name = 'permisos.user.context'
@@ -11,3 +14,25 @@ class PermUserContext(models.Model):
     empresa_id  = fields.Many2one('empresas.empresa', ondelete='restrict')
     sucursal_id = fields.Many2one('sucursales.sucursal', ondelete='restrict')
     bodega_id   = fields.Many2one('bodegas.bodega', ondelete='restrict')
+
+    # El contexto cacheado entre peticiones lleva en su llave el sello de los contextos del
+    # usuario (res.users._perm_user_ctx_stamp); aquí sólo se olvidan las cachés de la petición.
+    def _perm_ctx_forget(self):
+        self.env.cr.cache.pop(_CTX_CR_KEY, None)
+        self.env.cr.cache.pop(_CTX_STAMP_CR_KEY, None)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        recs = super().create(vals_list)
+        self._perm_ctx_forget()
+        return recs
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._perm_ctx_forget()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._perm_ctx_forget()
+        return res
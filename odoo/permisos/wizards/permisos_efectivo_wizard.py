@@ -43,75 +43,65 @@ class PermisosEfectivoWiz(models.TransientModel):
 
             Perm = self.env['permisos.permiso'].sudo()
             perms = Perm.search([('active', '=', True)], order='modulo_id, code')
+            u = wiz.usuario_id
+
+            # ---- Permiso efectivo (rangos + overrides internos) de todos los módulos en una
+            # sola compilación, en vez de un has_perm por permiso ----
+            mod_codes = list(dict.fromkeys(perms.mapped('modulo_id.code')))
+            effective = u.effective_permissions(
+                mod_codes,
+                empresa_id=wiz.empresa_id.id if wiz.empresa_id else None,
+                sucursal_id=wiz.sucursal_id.id if wiz.sucursal_id else None,
+                bodega_id=wiz.bodega_id.id if wiz.bodega_id else None,
+            )[u.id]
+            # Admin por gate (por MÓDULO, sin empresa)
+            admin_by_mod = {code: u._perm__is_admin_gate(code) for code in mod_codes}
+
+            # Overrides del usuario: una sola búsqueda, agrupados por permiso
+            Asig = self.env['permisos.asignacion.permiso'].sudo()
+            ovs_by_perm = {}
+            for o in Asig.search([('usuario_id', '=', u.id), ('permiso_id', 'in', perms.ids),
+                                  ('active', '=', True)]):
+                ovs_by_perm.setdefault(o.permiso_id.id, []).append(o)
+
+            def _aplica_ctx(o):
+                # Empresa: si el override tiene empresa, debe coincidir; si no, es global
+                if o.empresa_id and wiz.empresa_id and o.empresa_id != wiz.empresa_id:
+                    return False
+                if o.empresa_id and not wiz.empresa_id:
+                    # override ligado a empresa, pero el wizard está "sin empresa" -> no aplica
+                    return False
+
+                # Sucursal
+                if o.sucursal_id and wiz.sucursal_id and o.sucursal_id != wiz.sucursal_id:
+                    return False
+                if o.sucursal_id and not wiz.sucursal_id:
+                    # override ligado a sucursal, pero wizard sin sucursal -> no aplica
+                    return False
+
+                # Bodega
+                if o.bodega_id and wiz.bodega_id and o.bodega_id != wiz.bodega_id:
+                    return False
+                if o.bodega_id and not wiz.bodega_id:
+                    # override ligado a bodega, pero wizard sin bodega -> no aplica
+                    return False
+
+                return True
+
+            # score por especificidad: 0=global, 1=empresa, 2=empresa+sucursal, 3=empresa+sucursal+bodega
+            def _score(o):
+                return bool(o.empresa_id) + bool(o.sucursal_id) + bool(o.bodega_id)
 
             for p in perms:
-                # ---- Permiso efectivo según has_perm (rangos + overrides internos) ----
-                allowed = wiz.usuario_id.has_perm(
-                    p.modulo_id.code,
-                    p.code,
-                    empresa_id=wiz.empresa_id.id if wiz.empresa_id else None,
-                    sucursal_id=wiz.sucursal_id.id if wiz.sucursal_id else None,
-                    bodega_id=wiz.bodega_id.id if wiz.bodega_id else None,
-                )
-
-                # Helpers del usuario (gate/admin por MÓDULO, sin empresa)
-                u = wiz.usuario_id
-                # if not u._perm__has_gate(p.modulo_id.code):
-                #     continue   # <- opcional si quieres ocultar módulos sin gate
-                is_admin = u._perm__is_admin_gate(p.modulo_id.code)
+                allowed = p.code in effective.get(p.modulo_id.code, ())
+                is_admin = admin_by_mod.get(p.modulo_id.code, False)
 
                 # -----------------------------------------------------------------
-                # Overrides: buscar el MÁS ESPECÍFICO que aplique al contexto
+                # Overrides: el MÁS ESPECÍFICO que aplique al contexto
                 #   global < empresa < empresa+sucursal < empresa+sucursal+bodega
                 # -----------------------------------------------------------------
-                Asig = self.env['permisos.asignacion.permiso'].sudo()
-                cand = Asig.search([
-                    ('usuario_id', '=', wiz.usuario_id.id),
-                    ('permiso_id', '=', p.id),
-                    ('active', '=', True),
-                ])
-
-                def _aplica_ctx(o):
-                    # Empresa: si el override tiene empresa, debe coincidir; si no, es global
-                    if o.empresa_id and wiz.empresa_id and o.empresa_id != wiz.empresa_id:
-                        return False
-                    if o.empresa_id and not wiz.empresa_id:
-                        # override ligado a empresa, pero el wizard está "sin empresa" -> no aplica
-                        return False
-
-                    # Sucursal
-                    if o.sucursal_id and wiz.sucursal_id and o.sucursal_id != wiz.sucursal_id:
-                        return False
-                    if o.sucursal_id and not wiz.sucursal_id:
-                        # override ligado a sucursal, pero wizard sin sucursal -> no aplica
-                        return False
-
-                    # Bodega
-                    if o.bodega_id and wiz.bodega_id and o.bodega_id != wiz.bodega_id:
-                        return False
-                    if o.bodega_id and not wiz.bodega_id:
-                        # override ligado a bodega, pero wizard sin bodega -> no aplica
-                        return False
-
-                    return True
-
-                cand = cand.filtered(_aplica_ctx)
-
-                # Elegimos el override más específico
-                override = False
-                if cand:
-                    # score por especificidad: 0=global, 1=empresa, 2=empresa+sucursal, 3=empresa+sucursal+bodega
-                    def _score(o):
-                        s = 0
-                        if o.empresa_id:
-                            s += 1
-                        if o.sucursal_id:
-                            s += 1
-                        if o.bodega_id:
-                            s += 1
-                        return s
-
-                    override = sorted(cand, key=_score, reverse=True)[0]
+                cand = [o for o in ovs_by_perm.get(p.id, ()) if _aplica_ctx(o)]
+                override = sorted(cand, key=_score, reverse=True)[0] if cand else False
 
                 # Estado textual del override (columna "Override")
                 override_state = 'none'
@@ -5,6 +5,7 @@ from datetime import date
 from odoo import SUPERUSER_ID
 import base64
 import logging
+import time
 _logger = logging.getLogger(__name__)
 
 class venta(models.Model):
@@ -139,34 +140,109 @@ class venta(models.Model):
     
     @api.depends('state', 'importe', 'codigo', 'detalle_venta.write_date')
     def _compute_saldo(self):
-        FUI = self.env['facturas.factura']
-        FUIL = self.env['facturas.factura.line']
+        ingresos_por_venta, saldo_por_factura = self._stamped_ingresos_by_sale()
         for r in self:
             if r.state == 'cancelled':
                 r.saldo = 0.0
                 continue
 
-            # Ingresos timbrados ligados a esta venta:
-            ingresos = FUI.search([
-                ('tipo', '=', 'I'),
-                ('state', '=', 'stamped'),
-                ('venta_ids', 'in', r.id),
-            ])
-
-            # Fallback: si no hubo M2M, liga por líneas con sale_id = esta venta
-            if not ingresos:
-                cand = FUIL.search([('sale_id', '=', r.id)]).mapped('factura_id')
-                ingresos = cand.filtered(lambda f: f.tipo == 'I' and f.state == 'stamped')
-
+            ingresos = ingresos_por_venta.get(r._origin.id)
             if ingresos:
                 # Suma el saldo que ya calcula FacturaUI (incluye NC/DEV/Pagos aplicados)
-                r.saldo = sum(max(f.saldo or 0.0, 0.0) for f in ingresos)
+                r.saldo = sum(max(saldo_por_factura.get(fid) or 0.0, 0.0) for fid in ingresos)
             elif r.state == 'confirmed':
                 # Sin facturas aún: saldo = total de la venta
                 r.saldo = r.importe or 0.0
             else:
                 r.saldo = 0.0
 
+    def _stamped_ingresos_by_sale(self):
+        """Ingresos timbrados de todas las ventas de `self` con un número fijo de consultas.
+
+        Regresa ({venta_id: {factura_id, ...}}, {factura_id: saldo}). Primero liga por el
+        M2M venta_ids y, para las ventas sin M2M, por líneas con sale_id = venta.
+        """
+        sale_ids = [sid for sid in self._origin.ids if isinstance(sid, int)]
+        if not sale_ids:
+            return {}, {}
+        FUI = self.env['facturas.factura']
+        FUIL = self.env['facturas.factura.line']
+        wanted = set(sale_ids)
+        by_sale = {}
+        saldo_por_factura = {}
+
+        # Ingresos timbrados ligados por M2M
+        for f in FUI.search_read(
+            [('tipo', '=', 'I'), ('state', '=', 'stamped'), ('venta_ids', 'in', sale_ids)],
+            ['venta_ids', 'saldo'],
+        ):
+            saldo_por_factura[f['id']] = f['saldo']
+            for sid in wanted.intersection(f['venta_ids']):
+                by_sale.setdefault(sid, set()).add(f['id'])
+
+        # Fallback: si no hubo M2M, liga por líneas con sale_id = esta venta
+        missing = [sid for sid in sale_ids if sid not in by_sale]
+        if missing:
+            for line in FUIL.search_read(
+                [('sale_id', 'in', missing), ('factura_id.tipo', '=', 'I'), ('factura_id.state', '=', 'stamped')],
+                ['sale_id', 'factura_id'],
+            ):
+                by_sale.setdefault(line['sale_id'][0], set()).add(line['factura_id'][0])
+            pending = {fid for fids in by_sale.values() for fid in fids} - set(saldo_por_factura)
+            if pending:
+                for f in FUI.browse(list(pending)).read(['saldo']):
+                    saldo_por_factura[f['id']] = f['saldo']
+        return by_sale, saldo_por_factura
+
+    # Benchmark del recálculo de saldo: mide queries y ms del compute por lote contra el mismo
+    # compute venta por venta (el patrón anterior hacía 1-2 consultas por venta). Desde `odoo shell`:
+    #     env['ventas.venta']._bench_saldo(n=500)
+    # El lote se mide con n/10 y con n ventas: sus queries deben ser las mismas (constantes sin
+    # importar el tamaño); si no, lanza UserError con el reporte.
+    # Corre en un savepoint que se revierte. Regresa y loguea: ventas, queries y ms de cada modo,
+    # y cuántas ventas difieren entre ambos.
+    @api.model
+    def _bench_saldo(self, n=500):
+        ventas = self.search([('state', 'in', ('confirmed', 'invoiced'))], order='id desc', limit=max(1, int(n)))
+        chico = ventas[:max(1, len(ventas) // 10)]
+        field = self._fields['saldo']
+        cr = self.env.cr
+
+        def _medir(grupos):
+            self.env.invalidate_all()
+            q0, t0 = cr.sql_log_count, time.monotonic()
+            saldos = {}
+            for grupo in grupos:
+                self.env.add_to_compute(field, grupo)
+                saldos.update(zip(grupo.ids, grupo.mapped('saldo')))
+            self.env.flush_all()
+            return cr.sql_log_count - q0, (time.monotonic() - t0) * 1000.0, saldos
+
+        sp = cr.savepoint(flush=True)
+        try:
+            q_chico, _ms, _saldos = _medir([chico])
+            q_lote, ms_lote, lote = _medir([ventas])
+            q_uno, ms_uno, uno = _medir([v for v in ventas])
+        finally:
+            sp.close(rollback=True)
+        report = {
+            'ventas': len(ventas),
+            'ventas_lote_chico': len(chico),
+            'queries_lote_chico': q_chico,
+            'queries_lote': q_lote,
+            'queries_constantes': q_chico == q_lote,
+            'ms_lote': round(ms_lote, 1),
+            'queries_por_venta': q_uno,
+            'ms_por_venta': round(ms_uno, 1),
+            'diferencias': sum(1 for vid, saldo in lote.items() if abs(saldo - uno.get(vid, 0.0)) > 0.005),
+        }
+        _logger.info("VENTAS SALDO BENCH | %s", report)
+        if not report['queries_constantes']:
+            raise UserError(_('El saldo por lote no hace un número constante de queries '
+                              '(%(chico)s con %(n_chico)s ventas, %(lote)s con %(n)s): %(report)s') % {
+                'chico': q_chico, 'n_chico': len(chico), 'lote': q_lote, 'n': len(ventas), 'report': report})
+        return report
+
 
 
     @api.onchange('metododepago')
@@ -467,6 +543,13 @@ class venta(models.Model):
 
     def action_download_cfdi(self):
         self.ensure_one()
+        # Resolver indexado por UUID (una consulta); la búsqueda en cascada queda para adjuntos anteriores
+        if self.cfdi_uuid and 'mx.cfdi.document' in self.env:
+            Doc = self.env['mx.cfdi.document']
+            hit = Doc._resolve_xml(uuids=[self.cfdi_uuid]).get(self.cfdi_uuid)
+            if hit and hit['blob_id']:
+                return Doc._xml_download_action(hit)
+
         Att = self.env['ir.attachment']
         FUI = self.env['facturas.factura']
         FUIL = self.env['facturas.factura.line']
@@ -590,7 +673,7 @@ class venta(models.Model):
             raise ValidationError(_('No hay UUID en la venta.'))
 
         provider = self.env['mx.cfdi.engine']._get_provider().with_context(empresa_id=self.empresa_id.id)
-        data = provider.download_xml_by_uuid(self.cfdi_uuid, tries=10, delay=1.0)
+        data = provider.download_xml_by_uuid(self.cfdi_uuid, tries=10, delay=1.0, max_wait=15.0)
         if not data or not data.get('xml'):
             raise UserError(_('SW no devolvió XML para el UUID %s.') % self.cfdi_uuid)
 